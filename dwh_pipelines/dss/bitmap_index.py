@@ -0,0 +1,150 @@
+import os
+import json
+
+import numpy as np
+
+from dss.columnar import DictColumn, MANIFEST
+
+# Bitmap indexes over the low-cardinality columns of a datamart extract.
+#
+# For every value of an indexed column (and for NULL) a bitset with one bit per
+# row is kept, packed with np.packbits, so a 1M row table costs 125KB per value.
+# The fact build writes them next to the .npy extract of the table (dss/columnar.py)
+# for the same data version. A filter such as
+#
+#     gender='F' AND location IN ('Chicago', 'New York')
+#
+# then resolves to bitmap(F) & (bitmap(Chicago) | bitmap(New York)) over the
+# packed bytes, and only the rows left in the result are read from the columns.
+
+BITMAPS_MANIFEST = 'bitmaps.json'
+MAX_BITMAP_CARDINALITY = 256
+
+
+class BitmapIndex:
+    """Packed bitsets of one dictionary-encoded column: row i of `bitmaps` is value i, the last row is NULL."""
+
+    def __init__(self, values, bitmaps, rows):
+        self.values = values
+        self.bitmaps = bitmaps
+        self.rows = rows
+
+    @classmethod
+    def build(cls, column):
+        if not isinstance(column, DictColumn):
+            raise TypeError("Bitmap indexes are built over dictionary-encoded columns")
+        if len(column.dictionary) > MAX_BITMAP_CARDINALITY:
+            raise ValueError(f"{len(column.dictionary)} distinct values, bitmap indexes are for columns of at most {MAX_BITMAP_CARDINALITY}")
+
+        codes = np.asarray(column.codes)
+        bitmaps = np.empty((len(column.dictionary) + 1, (len(codes) + 7) // 8), dtype=np.uint8)
+        for code in range(len(column.dictionary)):
+            bitmaps[code] = np.packbits(codes == code)
+        bitmaps[-1] = np.packbits(codes == -1)
+        return cls(column.dictionary, bitmaps, len(codes))
+
+    def _position(self, value):
+        if value is None:
+            return len(self.values)
+        position = np.searchsorted(self.values, str(value))
+        if position < len(self.values) and self.values[position] == str(value):
+            return int(position)
+        return None
+
+    def empty(self):
+        return np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+
+    def equal(self, value):
+        position = self._position(value)
+        return self.empty() if position is None else np.array(self.bitmaps[position])
+
+    def any_of(self, values):
+        positions = [position for position in map(self._position, values) if position is not None]
+        return np.bitwise_or.reduce(self.bitmaps[positions], axis=0) if positions else self.empty()
+
+    def not_equal(self, value):
+        # SQL semantics: NULL rows match neither = nor <>
+        position = self._position(value)
+        return self.any_of([item for index, item in enumerate(self.values) if index != position])
+
+    def bitmap(self, condition):
+        """Bitset of a condition in the form ColumnTable.mask takes: value, [values] or ('==' | '!=', value)."""
+        if isinstance(condition, (list, set, frozenset)):
+            return self.any_of(condition)
+        if isinstance(condition, tuple):
+            op, value = condition
+            if op == '==':
+                return self.equal(value)
+            if op == '!=':
+                return self.not_equal(value)
+            raise ValueError(f"Bitmap indexes answer = / <> / IN, not '{op}'")
+        return self.equal(condition)
+
+
+def build_bitmap_indexes(table, columns):
+    """{column: BitmapIndex} for the dictionary-encoded `columns` of a ColumnTable."""
+    return {column: BitmapIndex.build(table.columns[column]) for column in columns}
+
+
+def save_bitmap_indexes(path, indexes, data_version=None):
+    os.makedirs(path, exist_ok=True)
+    manifest = {'data_version': data_version, 'columns': {}}
+    for column, index in indexes.items():
+        np.save(os.path.join(path, f'{column}.bitmap.npy'), index.bitmaps)
+        np.save(os.path.join(path, f'{column}.bitmap_values.npy'), index.values)
+        manifest['columns'][column] = {'values': len(index.values), 'rows': index.rows}
+    with open(os.path.join(path, BITMAPS_MANIFEST + '.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    os.replace(os.path.join(path, BITMAPS_MANIFEST + '.tmp'), os.path.join(path, BITMAPS_MANIFEST))
+
+
+def load_bitmap_indexes(path, mmap=True):
+    """{column: BitmapIndex} stored next to the extract in `path`; empty when missing or built for another data version."""
+    if not os.path.exists(os.path.join(path, BITMAPS_MANIFEST)) or not os.path.exists(os.path.join(path, MANIFEST)):
+        return {}
+    with open(os.path.join(path, BITMAPS_MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+    with open(os.path.join(path, MANIFEST)) as manifest_file:
+        if json.load(manifest_file)['data_version'] != manifest['data_version']:
+            return {}
+
+    return {column: BitmapIndex(np.load(os.path.join(path, f'{column}.bitmap_values.npy')),
+                                np.load(os.path.join(path, f'{column}.bitmap.npy'), mmap_mode='r' if mmap else None),
+                                spec['rows'])
+            for column, spec in manifest['columns'].items()}
+
+
+def resolve(indexes, **conditions):
+    """AND of the conditions over the bitmaps, as a packed bitset (every column must be indexed)."""
+    result = None
+    for column, condition in conditions.items():
+        bits = indexes[column].bitmap(condition)
+        result = bits if result is None else result & bits
+    if result is None:
+        raise ValueError("resolve needs at least one condition")
+    return result
+
+
+def resolve_any(indexes, alternatives):
+    """OR of AND-ed condition dicts: [{'gender': 'F'}, {'location': 'Chicago'}] is gender='F' OR location='Chicago'."""
+    return np.bitwise_or.reduce([resolve(indexes, **conditions) for conditions in alternatives], axis=0)
+
+
+def to_rows(bits, rows):
+    return np.flatnonzero(np.unpackbits(bits, count=rows))
+
+
+def count(bits, rows):
+    return int(np.count_nonzero(np.unpackbits(bits, count=rows)))
+
+
+def select(table, indexes, **conditions):
+    """`table.where(**conditions)`, resolving the indexed conditions on bitmaps before touching the columns."""
+    indexed = {column: condition for column, condition in conditions.items()
+               if column in indexes and not (isinstance(condition, tuple) and condition[0] not in ('==', '!='))}
+    if not indexed:
+        return table.where(**conditions)
+
+    selected = table.take(to_rows(resolve(indexes, **indexed), table.rows))
+    remaining = {column: condition for column, condition in conditions.items() if column not in indexed}
+    return selected.where(**remaining) if remaining else selected
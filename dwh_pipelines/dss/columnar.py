@@ -0,0 +1,403 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import configparser
+from decimal import Decimal
+
+import numpy as np
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from extract.oltp_extract import stream_query, DEFAULT_ITERSIZE
+from dwh.data_versions import get_versions
+
+# In-process columnar engine for exploratory DSS queries on datamart extracts.
+#
+# A table is a set of NumPy column arrays: numbers stay numeric, strings are
+# dictionary encoded (int32 codes into a sorted dictionary, -1 for NULL). Extracts
+# are cached on disk as one .npy file per array plus a manifest holding the data
+# version of the source table, and are memory-mapped back, so a notebook only
+# reads Postgres again after a reload bumped that version.
+#
+# Queries run on whole arrays: filters compare codes (values are looked up once in
+# the dictionary with searchsorted), group-by packs the key codes into one int64
+# and uses np.unique + np.bincount, and joins against small dimensions resolve
+# each distinct left value to a dimension row through a sorted key array.
+#
+#     sales = load_datamart_table(connection, 'datamart', 'customers_sales')
+#     sales.where(gender='F', location=['Chicago', 'New York']).group_by(['product_category'], sales_count=('count', None))
+
+DEFAULT_CACHE_DIR = 'columnar_cache'
+MANIFEST = 'manifest.json'
+
+
+class DictColumn:
+    """Dictionary-encoded string column: codes index into a sorted dictionary, -1 is NULL."""
+
+    def __init__(self, codes, dictionary):
+        self.codes = codes
+        self.dictionary = dictionary
+
+    @classmethod
+    def encode(cls, values):
+        values = np.asarray(values, dtype=object)
+        present = np.array([value is not None for value in values], dtype=bool)
+        dictionary, inverse = np.unique(values[present].astype(str), return_inverse=True)
+        codes = np.full(len(values), -1, dtype=np.int32)
+        codes[present] = inverse
+        return cls(codes, dictionary)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def take(self, index):
+        return DictColumn(self.codes[index], self.dictionary)
+
+    def code_of(self, value):
+        """Code of `value`, or -2 when it is not in the dictionary (matches no row)."""
+        if value is None:
+            return -1
+        position = np.searchsorted(self.dictionary, str(value))
+        if position < len(self.dictionary) and self.dictionary[position] == str(value):
+            return int(position)
+        return -2
+
+    def decode(self):
+        values = np.empty(len(self.codes), dtype=object)
+        present = self.codes >= 0
+        values[present] = self.dictionary[self.codes[present]]
+        return values
+
+
+def _as_numeric(values):
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, (bool, np.bool_)):
+        return None
+    if isinstance(sample, (int, np.integer)) and all(value is not None for value in values):
+        return np.asarray(values, dtype=np.int64)
+    if isinstance(sample, (int, float, Decimal, np.integer, np.floating)):
+        return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+    return None
+
+
+_COMPARISONS = {
+    '<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal, '!=': np.not_equal, '==': np.equal,
+}
+
+
+class ColumnTable:
+    """Columns of equal length: numeric ndarrays or DictColumns."""
+
+    def __init__(self, columns):
+        self.columns = dict(columns)
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {sorted(lengths)}")
+        self.rows = lengths.pop() if lengths else 0
+
+    # ----------------------------------------------------------------- building
+    @classmethod
+    def from_rows(cls, headers, rows):
+        columns = {}
+        for index, header in enumerate(headers):
+            values = [row[index] for row in rows]
+            numeric = _as_numeric(values)
+            columns[header] = numeric if numeric is not None else DictColumn.encode(values)
+        return cls(columns)
+
+    @classmethod
+    def from_query(cls, connection, query, params=None, itersize=DEFAULT_ITERSIZE):
+        """Stream a query through a server-side cursor (`connection` must not be in autocommit mode)."""
+        headers, rows = None, []
+        for headers, batch in stream_query(connection, query, params, itersize, cursor_name='columnar_extract'):
+            rows.extend(batch)
+        if headers is None:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT * FROM ({query}) AS empty_result LIMIT 0", params)
+                headers = [column[0] for column in cursor.description]
+        return cls.from_rows(headers, rows)
+
+    def save(self, path, data_version=None, complete=True):
+        # complete: every column of the source table is saved, not a projection of it
+        os.makedirs(path, exist_ok=True)
+        manifest = {'rows': self.rows, 'data_version': data_version, 'complete': complete, 'columns': {}}
+        for name, column in self.columns.items():
+            if isinstance(column, DictColumn):
+                np.save(os.path.join(path, f'{name}.codes.npy'), column.codes)
+                np.save(os.path.join(path, f'{name}.dict.npy'), column.dictionary)
+                manifest['columns'][name] = {'kind': 'dict'}
+            else:
+                np.save(os.path.join(path, f'{name}.npy'), column)
+                manifest['columns'][name] = {'kind': 'numeric', 'dtype': str(column.dtype)}
+        # the manifest is written last, a directory without one is an incomplete extract
+        with open(os.path.join(path, MANIFEST + '.tmp'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        os.replace(os.path.join(path, MANIFEST + '.tmp'), os.path.join(path, MANIFEST))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        mode = 'r' if mmap else None
+        columns = {}
+        for name, spec in manifest['columns'].items():
+            if spec['kind'] == 'dict':
+                columns[name] = DictColumn(np.load(os.path.join(path, f'{name}.codes.npy'), mmap_mode=mode),
+                                           np.load(os.path.join(path, f'{name}.dict.npy')))
+            else:
+                columns[name] = np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mode)
+        return cls(columns)
+
+    # ----------------------------------------------------------------- access
+    def __len__(self):
+        return self.rows
+
+    def column(self, name):
+        column = self.columns[name]
+        return column.decode() if isinstance(column, DictColumn) else column
+
+    def with_column(self, name, values):
+        columns = dict(self.columns)
+        columns[name] = values if isinstance(values, DictColumn) else np.asarray(values)
+        return ColumnTable(columns)
+
+    def take(self, index):
+        return ColumnTable({name: column.take(index) if isinstance(column, DictColumn) else column[index]
+                            for name, column in self.columns.items()})
+
+    def to_frame(self, categorical=False):
+        """pandas DataFrame of the table; with `categorical` the dictionary columns become
+        pandas Categoricals built on the codes, without decoding a string per row."""
+        import pandas as pd
+        if not categorical:
+            return pd.DataFrame({name: self.column(name) for name in self.columns})
+        return pd.DataFrame({name: pd.Categorical.from_codes(np.asarray(column.codes), column.dictionary) if isinstance(column, DictColumn) else column
+                             for name, column in self.columns.items()}, copy=False)
+
+    # ----------------------------------------------------------------- filter
+    def mask(self, **conditions):
+        """Boolean row mask: column=value, column=[values] (IN) or column=(op, value) with op in < <= > >= != ==."""
+        mask = np.ones(self.rows, dtype=bool)
+        for name, condition in conditions.items():
+            column = self.columns[name]
+            if isinstance(column, DictColumn):
+                if isinstance(condition, (list, set, frozenset)):
+                    mask &= np.isin(column.codes, [column.code_of(value) for value in condition])
+                elif isinstance(condition, tuple):
+                    op, value = condition
+                    if op == '==':
+                        mask &= column.codes == column.code_of(value)
+                    elif op == '!=':
+                        # NULL matches neither = nor <>
+                        mask &= (column.codes != column.code_of(value)) & (column.codes >= 0)
+                    else:
+                        # order comparisons on the sorted dictionary, then on the codes
+                        selected = np.flatnonzero(_COMPARISONS[op](column.dictionary, str(value)))
+                        mask &= np.isin(column.codes, selected)
+                else:
+                    mask &= column.codes == column.code_of(condition)
+            else:
+                if isinstance(condition, (list, set, frozenset)):
+                    mask &= np.isin(column, list(condition))
+                elif isinstance(condition, tuple):
+                    op, value = condition
+                    mask &= _COMPARISONS[op](column, value)
+                else:
+                    mask &= column == condition
+        return mask
+
+    def where(self, **conditions):
+        return self.take(np.flatnonzero(self.mask(**conditions)))
+
+    # ----------------------------------------------------------------- group by
+    def _key_codes(self, name):
+        """(codes >= 0, cardinality, decoded key values) of a group-by column."""
+        column = self.columns[name]
+        if isinstance(column, DictColumn):
+            values = np.empty(len(column.dictionary) + 1, dtype=object)
+            values[1:] = column.dictionary
+            return column.codes.astype(np.int64) + 1, len(values), values
+        uniques, inverse = np.unique(column, return_inverse=True)
+        return inverse.astype(np.int64), len(uniques), uniques
+
+    def group_ids(self, keys):
+        """(group id per row, number of groups, {key: value per group})."""
+        if not keys:
+            return np.zeros(self.rows, dtype=np.int64), 1 if self.rows else 0, {}
+
+        key_codes = [self._key_codes(name) for name in keys]
+        if np.prod([float(cardinality) for _, cardinality, _ in key_codes]) < 2 ** 62:
+            # pack the key codes into one int64 (mixed radix)
+            combined = np.zeros(self.rows, dtype=np.int64)
+            for codes, cardinality, _ in key_codes:
+                combined = combined * cardinality + codes
+            groups, inverse = np.unique(combined, return_inverse=True)
+            group_codes = []
+            for codes, cardinality, _ in reversed(key_codes):
+                group_codes.append(groups % cardinality)
+                groups = groups // cardinality
+            group_codes.reverse()
+        else:
+            stacked, inverse = np.unique(np.stack([codes for codes, _, _ in key_codes], axis=1), axis=0, return_inverse=True)
+            group_codes = [stacked[:, index] for index in range(len(keys))]
+
+        labels = {name: values[codes] for name, codes, (_, _, values) in zip(keys, group_codes, key_codes)}
+        return inverse.reshape(-1), len(group_codes[0]), labels
+
+    def group_by(self, keys, **aggregates):
+        """Aggregate per group of `keys`; aggregates are name=(function, column) with function in
+        count, sum, mean, min, max, count_distinct (column is ignored by count).
+        Returns a ColumnTable of the keys followed by the aggregates, one row per group.
+        """
+        group_id, groups, labels = self.group_ids(list(keys))
+        counts = np.bincount(group_id, minlength=groups)
+        result = {name: DictColumn.encode(values) if values.dtype == object else values for name, values in labels.items()}
+
+        order = starts = None
+        for name, (function, column_name) in aggregates.items():
+            if function == 'count':
+                result[name] = counts
+                continue
+
+            column = self.columns[column_name]
+            if function == 'count_distinct':
+                # NULLs are not counted, as in SQL COUNT(DISTINCT)
+                if isinstance(column, DictColumn):
+                    present = np.asarray(column.codes) >= 0
+                    codes = np.asarray(column.codes)[present].astype(np.int64)
+                else:
+                    present = ~np.isnan(column) if np.asarray(column).dtype.kind == 'f' else np.ones(self.rows, dtype=bool)
+                    codes = np.unique(np.asarray(column)[present], return_inverse=True)[1].reshape(-1)
+                cardinality = int(codes.max(initial=0)) + 1
+                pairs = np.unique(group_id[present] * cardinality + codes)
+                result[name] = np.bincount(pairs // cardinality, minlength=groups)
+                continue
+
+            values = np.asarray(column, dtype=np.float64)
+            if function in ('sum', 'mean'):
+                # NULLs are skipped; a group with no values gets NULL (NaN), as SUM / AVG do
+                present_counts = np.bincount(group_id, weights=~np.isnan(values), minlength=groups)
+                sums = np.bincount(group_id, weights=np.nan_to_num(values), minlength=groups)
+                if function == 'mean':
+                    sums = sums / np.maximum(present_counts, 1)
+                result[name] = np.where(present_counts > 0, sums, np.nan)
+            elif function in ('min', 'max'):
+                if order is None:
+                    order = np.argsort(group_id, kind='stable')
+                    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+                ufunc = np.fmin if function == 'min' else np.fmax
+                result[name] = ufunc.reduceat(values[order], starts) if self.rows else np.empty(0)
+            else:
+                raise ValueError(f"Unknown aggregate function '{function}'")
+        return ColumnTable(result)
+
+    # ----------------------------------------------------------------- join
+    def join(self, dimension, left_on, right_on, columns=None, how='inner'):
+        """Join a small dimension table on left_on = right_on (keys of the dimension are unique).
+
+        Every distinct left key is resolved once against the sorted dimension keys;
+        rows then gather the dimension columns by index. how is 'inner' or 'left'.
+        """
+        right_keys = dimension.column(right_on)
+        present = np.flatnonzero(np.array([key is not None for key in right_keys], dtype=bool)) if right_keys.dtype == object else np.arange(len(right_keys))
+        sortable = right_keys[present].astype(str) if right_keys.dtype == object else right_keys[present]
+        order = np.argsort(sortable, kind='stable')
+        sorted_keys, sorted_rows = sortable[order], present[order]
+
+        def lookup(keys):
+            positions = np.clip(np.searchsorted(sorted_keys, keys), 0, max(len(sorted_keys) - 1, 0))
+            if not len(sorted_keys):
+                return np.full(len(keys), -1, dtype=np.int64)
+            return np.where(sorted_keys[positions] == keys, sorted_rows[positions], -1)
+
+        left = self.columns[left_on]
+        if isinstance(left, DictColumn):
+            by_code = np.append(lookup(left.dictionary.astype(sortable.dtype) if right_keys.dtype != object else left.dictionary), -1)
+            right_row = by_code[left.codes]
+        else:
+            right_row = lookup(left.astype(sortable.dtype) if right_keys.dtype == object else left)
+
+        table = self if how == 'left' else self.take(np.flatnonzero(right_row >= 0))
+        if how != 'left':
+            right_row = right_row[right_row >= 0]
+
+        joined = dict(table.columns)
+        for name in columns or [name for name in dimension.columns if name != right_on]:
+            column = dimension.columns[name]
+            if isinstance(column, DictColumn):
+                joined[name] = DictColumn(np.where(right_row >= 0, column.codes[right_row], -1).astype(np.int32), column.dictionary)
+            else:
+                gathered = column[right_row].astype(np.float64 if how == 'left' else column.dtype)
+                if how == 'left':
+                    gathered[right_row < 0] = np.nan
+                joined[name] = gathered
+        return ColumnTable(joined)
+
+
+def extract_path(cache_dir, schema_name, table_name):
+    return os.path.join(cache_dir, f'{schema_name}.{table_name}')
+
+
+def _is_current(path, version, complete=False):
+    try:
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return False
+    return manifest['data_version'] == version and (manifest.get('complete', False) or not complete)
+
+
+def load_datamart_table(connection, schema_name, table_name, cache_dir=DEFAULT_CACHE_DIR, columns=None, itersize=DEFAULT_ITERSIZE):
+    """The table (or its `columns`) as a ColumnTable, from the .npy cache when its data version is current,
+    else extracted and cached.
+
+    The whole table is cached in extract_path(); a column subset is served from it when it is current,
+    otherwise extracted into a directory of its own, so it never replaces the complete extract.
+    """
+    path = extract_path(cache_dir, schema_name, table_name)
+    with connection.cursor() as cursor:
+        version = get_versions(cursor, [f'{schema_name}.{table_name}'])[f'{schema_name}.{table_name}']
+    connection.rollback()
+
+    if _is_current(path, version, complete=True):
+        table = ColumnTable.load(path)
+        return table if columns is None else ColumnTable({name: table.columns[name] for name in columns})
+
+    if columns is not None:
+        path = f"{path}.columns-{hashlib.sha256(','.join(sorted(columns)).encode()).hexdigest()[:12]}"
+        if _is_current(path, version):
+            table = ColumnTable.load(path)
+            return ColumnTable({name: table.columns[name] for name in columns})
+
+    table = ColumnTable.from_query(connection, f"SELECT {', '.join(columns) if columns else '*'} FROM {schema_name}.{table_name}", itersize=itersize)
+    connection.rollback()
+    table.save(path, data_version=version, complete=columns is None)
+    return ColumnTable.load(path)
+
+
+if __name__=="__main__":
+    # refresh the cached extract of a datamart table and time a sample group-by:
+    # python dwh_pipelines/dss/columnar.py [table] [group-by column ...]
+    import psycopg2
+
+    config  =   configparser.ConfigParser()
+    config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+    settings = config['data_filepath']
+
+    table_name = sys.argv[1] if len(sys.argv) > 1 else 'customers_sales'
+    keys = sys.argv[2:] or ['gender', 'location']
+
+    connection = psycopg2.connect(host=settings['HOST'], port=settings['PORT'], dbname=settings['DWH_DB'],
+                                  user=settings['USERNAME'], password=settings['PASSWORD'])
+    try:
+        start = time.perf_counter()
+        table = load_datamart_table(connection, 'datamart', table_name, settings.get('COLUMNAR_CACHE_DIR', DEFAULT_CACHE_DIR))
+        print("\033[92m {}\033[00m".format(f"Loaded datamart.{table_name}: {table.rows} rows in {(time.perf_counter() - start) * 1000:.1f}ms"))
+    finally:
+        connection.close()
+
+    start = time.perf_counter()
+    result = table.group_by(keys, rows=('count', None))
+    print("\033[92m {}\033[00m".format(f"GROUP BY {', '.join(keys)}: {result.rows} groups in {(time.perf_counter() - start) * 1000:.2f}ms"))
+    print(result.to_frame().to_string(index=False))
@@ -0,0 +1,343 @@
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import hashlib
+import configparser
+from collections import OrderedDict
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+sys.path.append(os.path.abspath('dwh_pipelines/dwh/datamarts'))
+from dwh.data_versions import get_versions
+from rollups import aggregate_query, MEASURE_NAMES
+from approximate import estimate_distinct_customers, estimate_aggregate, sketch_table, sample_table
+from dss.snapshots import current_snapshot, export_table, load_snapshot, DEFAULT_SNAPSHOT_DIR
+from lazy_imports import lazy_import
+
+psycopg2 = lazy_import('psycopg2')
+
+# Query client for the decision-support notebooks, with a versioned result cache.
+#
+# Results are cached in memory (LRU, bounded by entries and bytes) and spilled to
+# disk when evicted, keyed by the normalized SQL, its parameters and the current
+# data versions of every table the query reads (dwh/data_versions.py). Loaders
+# and fact builds bump those versions, so a reload changes the key and a stale
+# result can never be returned; old entries simply age out of the LRU and disk.
+# A query whose FROM items are not all plain tables (set-returning functions,
+# LATERAL, ...) is run uncached, unless its tables are passed explicitly.
+#
+#     client = QueryClient.from_config()
+#     df = client.query("SELECT gender, COUNT(*) FROM datamart.customers_sales GROUP BY gender")
+#     df = client.aggregate(['location'], filters={'gender': 'F'})
+#     df = client.snapshot('customers_sales')      # memory-mapped columnar snapshot, no SELECT *
+#     df = client.approximate_distinct_customers(['location'], filters={'transaction_date': ['1-2019', '2-2019']})
+
+DEFAULT_CACHE_DIR = 'query_cache'
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_MEMORY_BYTES = 256 * 1024 * 1024
+DEFAULT_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+_QUOTED = re.compile(r"('(?:[^']|'')*')")
+_TOKEN = re.compile(r'"(?:[^"]|"")*"|[a-z_][\w$]*|::|\S', re.IGNORECASE)
+# words that end a FROM item instead of aliasing it
+_CLAUSE_WORDS = {'where', 'group', 'order', 'having', 'limit', 'offset', 'fetch', 'for', 'window', 'union', 'intersect', 'except',
+                 'join', 'inner', 'left', 'right', 'full', 'cross', 'natural', 'on', 'using', 'returning', 'tablesample', 'with'}
+
+
+def normalize_sql(query):
+    """Collapse whitespace outside string literals and drop the trailing semicolon."""
+    parts = _QUOTED.split(query.strip().rstrip(';').strip())
+    return ''.join(part if index % 2 else re.sub(r'\s+', ' ', part) for index, part in enumerate(parts))
+
+
+def _is_identifier(token):
+    return token[0] == '"' or token[0].isalpha() or token[0] == '_'
+
+
+def _identifier(token):
+    return token[1:-1].replace('""', '"') if token[0] == '"' else token.lower()
+
+
+def _skip_parentheses(tokens, index):
+    """Index after the parenthesized group starting at tokens[index]."""
+    depth = 0
+    for position in range(index, len(tokens)):
+        depth += {'(': 1, ')': -1}.get(tokens[position], 0)
+        if depth == 0:
+            return position + 1
+    return len(tokens)
+
+
+def _tables_of(tokens, default_schema):
+    tables = set()
+    index = 0
+    while index < len(tokens):
+        if tokens[index].lower() not in ('from', 'join'):
+            index += 1
+            continue
+        index += 1
+        while index < len(tokens):
+            if tokens[index] == '(':
+                # subquery: its tables are read on their own, the FROM list goes on after it
+                end = _skip_parentheses(tokens, index)
+                inner = tokens[index + 1:end - 1]
+                if not inner or inner[0].lower() not in ('select', 'with', 'values'):
+                    return None
+                inner_tables = _tables_of(inner, default_schema)
+                if inner_tables is None:
+                    return None
+                tables |= inner_tables
+                index = end
+            else:
+                if tokens[index].lower() == 'only':
+                    index += 1
+                if index >= len(tokens) or not _is_identifier(tokens[index]) or tokens[index].lower() == 'lateral':
+                    return None
+                parts = [_identifier(tokens[index])]
+                index += 1
+                while index + 1 < len(tokens) and tokens[index] == '.' and _is_identifier(tokens[index + 1]):
+                    parts.append(_identifier(tokens[index + 1]))
+                    index += 2
+                if (index < len(tokens) and tokens[index] == '(') or len(parts) > 2:
+                    # a set-returning function, or a database-qualified name
+                    return None
+                tables.add('.'.join(parts) if len(parts) == 2 else f'{default_schema}.{parts[0]}')
+
+            # optional alias, with its column list
+            if index < len(tokens) and tokens[index].lower() == 'as':
+                index += 1
+            if index < len(tokens) and _is_identifier(tokens[index]) and tokens[index].lower() not in _CLAUSE_WORDS:
+                index += 1
+                if index < len(tokens) and tokens[index] == '(':
+                    index = _skip_parentheses(tokens, index)
+            if index < len(tokens) and tokens[index] == ',':
+                index += 1
+                continue
+            break
+    return tables
+
+
+def referenced_tables(query, default_schema='public'):
+    """'schema.table' names of every FROM / JOIN item of `query` (comma-separated FROM lists,
+    quoted identifiers and subqueries included; string literals ignored), or None when a FROM
+    item is not a plain table (a function call, LATERAL, ...) and the tables read are uncertain."""
+    unquoted = ' '.join(part for index, part in enumerate(_QUOTED.split(query)) if index % 2 == 0)
+    tables = _tables_of(_TOKEN.findall(unquoted), default_schema)
+    return None if tables is None else sorted(tables)
+
+
+class ResultCache:
+    """LRU of pickled results in memory, evicted entries spilled to `cache_dir`."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, memory_entries=DEFAULT_MEMORY_ENTRIES, memory_bytes=DEFAULT_MEMORY_BYTES, disk_bytes=DEFAULT_DISK_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        if cache_dir and disk_bytes > 0:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.pkl')
+
+    def get(self, key):
+        """(value, 'memory' | 'disk') or (None, None)."""
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return pickle.loads(self._memory[key]), 'memory'
+
+        if self.cache_dir and self.disk_bytes > 0 and os.path.exists(self._path(key)):
+            with open(self._path(key), 'rb') as cache_file:
+                blob = cache_file.read()
+            os.utime(self._path(key))
+            self._remember(key, blob)
+            return pickle.loads(blob), 'disk'
+        return None, None
+
+    def put(self, key, value):
+        self._remember(key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def _remember(self, key, blob):
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = blob
+        self._memory_size += len(blob)
+        while self._memory and (len(self._memory) > self.memory_entries or self._memory_size > self.memory_bytes):
+            evicted_key, evicted_blob = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted_blob)
+            self._spill(evicted_key, evicted_blob)
+
+    def _spill(self, key, blob):
+        if not self.cache_dir or self.disk_bytes <= 0 or len(blob) > self.disk_bytes or os.path.exists(self._path(key)):
+            return
+        temp_path = self._path(key) + '.tmp'
+        with open(temp_path, 'wb') as cache_file:
+            cache_file.write(blob)
+        os.replace(temp_path, self._path(key))
+        self._prune_disk()
+
+    def _prune_disk(self):
+        # drop the least recently used spill files beyond the disk budget
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith('.pkl'):
+                stat = os.stat(os.path.join(self.cache_dir, filename))
+                entries.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, filename))
+            total -= size
+
+    def clear(self):
+        self._memory.clear()
+        self._memory_size = 0
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.pkl'):
+                    os.remove(os.path.join(self.cache_dir, filename))
+
+
+class QueryClient:
+    """Read-only datamart queries through the versioned result cache."""
+
+    def __init__(self, connection_params, cache=None, default_schema='public', snapshot_dir=DEFAULT_SNAPSHOT_DIR):
+        self.connection_params = connection_params
+        self.snapshot_dir = snapshot_dir
+        self.connection = psycopg2.connect(**connection_params)
+        self.connection.set_session(readonly=True, autocommit=True)
+        self.cache = cache if cache is not None else ResultCache()
+        self.default_schema = default_schema
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'uncached': 0}
+
+    @classmethod
+    def from_config(cls, config_path='dwh_pipelines/local_config.ini'):
+        config = configparser.ConfigParser()
+        config.read(os.path.abspath(config_path))
+        settings = config['data_filepath']
+        cache = ResultCache(settings.get('QUERY_CACHE_DIR', DEFAULT_CACHE_DIR),
+                            int(settings.get('QUERY_CACHE_MEMORY_ENTRIES', DEFAULT_MEMORY_ENTRIES)),
+                            int(settings.get('QUERY_CACHE_MEMORY_MB', DEFAULT_MEMORY_BYTES // 2 ** 20)) * 2 ** 20,
+                            int(settings.get('QUERY_CACHE_DISK_MB', DEFAULT_DISK_BYTES // 2 ** 20)) * 2 ** 20)
+        return cls(dict(host=settings['HOST'], port=settings['PORT'], dbname=settings['DWH_DB'],
+                        user=settings['USERNAME'], password=settings['PASSWORD']), cache,
+                   snapshot_dir=settings.get('SNAPSHOT_DIR', DEFAULT_SNAPSHOT_DIR))
+
+    def cache_key(self, normalized, params, versions):
+        payload = json.dumps([normalized, params, sorted(versions.items())], default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def query_rows(self, query, params=None, tables=None):
+        """(headers, rows) of `query`; `tables` overrides the tables detected in the SQL for invalidation.
+        A query whose tables cannot be told from the SQL is run uncached unless `tables` is given."""
+        normalized = normalize_sql(query)
+        tables = tables or referenced_tables(normalized, self.default_schema)
+        with self.connection.cursor() as cursor:
+            if tables is None:
+                self.stats['uncached'] += 1
+                cursor.execute(query, params)
+                return [column[0] for column in cursor.description], cursor.fetchall()
+
+            versions = get_versions(cursor, tables)
+            key = self.cache_key(normalized, params, versions)
+
+            result, source = self.cache.get(key)
+            if source is not None:
+                self.stats[f'{source}_hits'] += 1
+                return result
+
+            self.stats['misses'] += 1
+            cursor.execute(query, params)
+            result = ([column[0] for column in cursor.description], cursor.fetchall())
+        self.cache.put(key, result)
+        return result
+
+    def query(self, query, params=None, tables=None, as_frame=True):
+        """Cached result of `query`, as a pandas DataFrame by default."""
+        headers, rows = self.query_rows(query, params, tables)
+        if not as_frame:
+            return headers, rows
+        import pandas as pd
+        return pd.DataFrame.from_records(rows, columns=headers)
+
+    def aggregate(self, group_by, measures=MEASURE_NAMES, filters=None, schema_name='datamart', fact_table='customers_sales', as_frame=True):
+        """Cached aggregate of the fact, answered from the smallest covering rollup (see rollups.py)."""
+        with self.connection.cursor() as cursor:
+            query, params, table = aggregate_query(cursor, group_by, measures, filters, schema_name, fact_table)
+        return self.query(query, params, tables=[f'{schema_name}.{table}'], as_frame=as_frame)
+
+    def snapshot(self, table_name, schema_name='datamart', columns=None, refresh=True):
+        """The table as a DataFrame memory-mapped from its columnar snapshot (dss/snapshots.py).
+
+        A snapshot older than the table's data version is re-exported first when `refresh`
+        is set, otherwise it is returned as is.
+        """
+        path, manifest = current_snapshot(self.snapshot_dir, schema_name, table_name)
+        with self.connection.cursor() as cursor:
+            version = get_versions(cursor, [f'{schema_name}.{table_name}'])[f'{schema_name}.{table_name}']
+
+        if manifest is None or (refresh and manifest['data_version'] != version):
+            export_connection = psycopg2.connect(**self.connection_params)
+            try:
+                export_connection.set_session(readonly=True)
+                path, manifest, _ = export_table(export_connection, schema_name, table_name, self.snapshot_dir)
+            finally:
+                export_connection.close()
+        return load_snapshot(path, manifest, columns)
+
+    def _cached_estimate(self, name, arguments, tables, estimate):
+        with self.connection.cursor() as cursor:
+            key = self.cache_key(name, arguments, get_versions(cursor, tables))
+            result, source = self.cache.get(key)
+            if source is not None:
+                self.stats[f'{source}_hits'] += 1
+                return result
+            self.stats['misses'] += 1
+            result = estimate(cursor)
+        self.cache.put(key, result)
+        return result
+
+    def approximate_distinct_customers(self, group_by, filters=None, schema_name='datamart', fact_table='customers_sales', as_frame=True):
+        """Distinct customers per `group_by` estimated from the HyperLogLog sketches, with 95% bounds (see approximate.py)."""
+        rows = self._cached_estimate('approximate_distinct_customers', [group_by, filters], [f'{schema_name}.{sketch_table(fact_table)}'],
+                                     lambda cursor: estimate_distinct_customers(cursor, group_by, filters, schema_name, fact_table))
+        headers = list(group_by) + ['distinct_customers', 'distinct_customers_low', 'distinct_customers_high']
+        if not as_frame:
+            return headers, rows
+        import pandas as pd
+        return pd.DataFrame.from_records(rows, columns=headers)
+
+    def approximate_aggregate(self, group_by, measures=MEASURE_NAMES, filters=None, schema_name='datamart', fact_table='customers_sales', as_frame=True):
+        """`measures` per `group_by` estimated from the stratified sample, each with _low / _high 95% bounds."""
+        rows = self._cached_estimate('approximate_aggregate', [group_by, measures, filters], [f'{schema_name}.{sample_table(fact_table)}'],
+                                     lambda cursor: estimate_aggregate(cursor, group_by, measures, filters, schema_name, fact_table))
+        headers = list(group_by) + [f'{measure}{suffix}' for measure in measures for suffix in ('', '_low', '_high')]
+        rows = [tuple(row[:len(group_by)]) + tuple(value for bounds in row[len(group_by):] for value in bounds) for row in rows]
+        if not as_frame:
+            return headers, rows
+        import pandas as pd
+        return pd.DataFrame.from_records(rows, columns=headers)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__=="__main__":
+    # time a query cold and warm: python dwh_pipelines/dss/query_client.py "SELECT ..."
+    with QueryClient.from_config() as client:
+        for attempt in ('cold', 'warm'):
+            start = time.perf_counter()
+            headers, rows = client.query(sys.argv[1], as_frame=False)
+            print("\033[92m {}\033[00m".format(f"{attempt}: {len(rows)} rows in {(time.perf_counter() - start) * 1000:.2f}ms"))
+        print("\033[92m {}\033[00m".format(f"cache stats: {client.stats}"))
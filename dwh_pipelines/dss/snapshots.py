@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+
+import numpy as np
+
+from dss.columnar import ColumnTable, DictColumn
+from dwh.data_versions import get_versions
+from extract.oltp_extract import DEFAULT_ITERSIZE
+
+# Versioned columnar snapshots of datamart tables for the notebooks.
+#
+# The export stage writes every datamart table, once per data version, to
+#
+#     <snapshot dir>/<schema>.<table>/v<version>/    data.parquet, or one .npy per column array (dss/columnar.py)
+#                                                    snapshot.json
+#     <snapshot dir>/<schema>.<table>/CURRENT        name of the latest complete version directory
+#
+# Parquet is used when pyarrow is installed, the .npy layout otherwise. Readers
+# memory-map the files, so loading the fact costs page-cache reads instead of a
+# SELECT *, and every kernel on the machine shares the same cached pages. Older
+# versions are kept for readers still holding them, up to `keep` per table.
+
+DEFAULT_SNAPSHOT_DIR = 'datamart_snapshots'
+DEFAULT_KEEP = 2
+CURRENT = 'CURRENT'
+MANIFEST = 'snapshot.json'
+FORMATS = ('auto', 'parquet', 'npy')
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def resolve_format(snapshot_format):
+    if snapshot_format not in FORMATS:
+        raise ValueError(f"Snapshot format must be one of {FORMATS}, got '{snapshot_format}'")
+    if snapshot_format == 'auto':
+        return 'parquet' if parquet_available() else 'npy'
+    if snapshot_format == 'parquet' and not parquet_available():
+        raise ImportError("Parquet snapshots need pyarrow, install it or use SNAPSHOT_FORMAT=npy")
+    return snapshot_format
+
+
+def table_dir(snapshot_dir, schema_name, table_name):
+    return os.path.join(snapshot_dir, f'{schema_name}.{table_name}')
+
+
+def current_snapshot(snapshot_dir, schema_name, table_name):
+    """(path, manifest) of the current snapshot of the table, or (None, None)."""
+    directory = table_dir(snapshot_dir, schema_name, table_name)
+    try:
+        with open(os.path.join(directory, CURRENT)) as current_file:
+            path = os.path.join(directory, current_file.read().strip())
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            return path, json.load(manifest_file)
+    except FileNotFoundError:
+        return None, None
+
+
+def _write_parquet(table, path):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrays = {}
+    for name, column in table.columns.items():
+        if isinstance(column, DictColumn):
+            codes = np.asarray(column.codes)
+            arrays[name] = pa.DictionaryArray.from_arrays(pa.array(codes, mask=codes < 0), pa.array(column.dictionary.tolist(), type=pa.string()))
+        else:
+            arrays[name] = pa.array(np.asarray(column))
+    pq.write_table(pa.table(arrays), os.path.join(path, 'data.parquet'))
+
+
+def export_table(connection, schema_name, table_name, snapshot_dir=DEFAULT_SNAPSHOT_DIR, snapshot_format='auto', keep=DEFAULT_KEEP, itersize=DEFAULT_ITERSIZE):
+    """Write a snapshot of the table at its current data version, unless one exists already.
+
+    `connection` must not be in autocommit mode (the rows are streamed through a named cursor).
+    Returns (path, manifest, written).
+    """
+    with connection.cursor() as cursor:
+        version = get_versions(cursor, [f'{schema_name}.{table_name}'])[f'{schema_name}.{table_name}']
+    connection.rollback()
+
+    path, manifest = current_snapshot(snapshot_dir, schema_name, table_name)
+    if manifest is not None and manifest['data_version'] == version:
+        return path, manifest, False
+
+    snapshot_format = resolve_format(snapshot_format)
+    directory = table_dir(snapshot_dir, schema_name, table_name)
+    version_name = f'v{version}'
+    path = os.path.join(directory, version_name)
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        # published by another writer, CURRENT not moved yet
+        return path, _publish(snapshot_dir, schema_name, table_name, version_name), False
+
+    # every writer stages into its own directory: kernels exporting the same version never share one
+    os.makedirs(directory, exist_ok=True)
+    staging_path = tempfile.mkdtemp(prefix=f'.{version_name}.', suffix='.tmp', dir=directory)
+    try:
+        start_time = time.time()
+        table = ColumnTable.from_query(connection, f"SELECT * FROM {schema_name}.{table_name}", itersize=itersize)
+        connection.rollback()
+
+        if snapshot_format == 'parquet':
+            _write_parquet(table, staging_path)
+        else:
+            table.save(staging_path, data_version=version)
+
+        manifest = {
+            'table': f'{schema_name}.{table_name}',
+            'data_version': version,
+            'format': snapshot_format,
+            'rows': table.rows,
+            'columns': list(table.columns),
+            'exported_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'export_seconds': round(time.time() - start_time, 3),
+        }
+        with open(os.path.join(staging_path, MANIFEST), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+
+        # publish: the version directory appears complete in one rename; if another writer
+        # got there first its copy is the snapshot and this one is dropped
+        try:
+            os.rename(staging_path, path)
+            written = True
+        except OSError:
+            if not os.path.exists(os.path.join(path, MANIFEST)):
+                raise
+            written = False
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
+
+    manifest = _publish(snapshot_dir, schema_name, table_name, version_name)
+    prune_snapshots(snapshot_dir, schema_name, table_name, keep)
+    return path, manifest, written
+
+
+def _publish(snapshot_dir, schema_name, table_name, version_name):
+    """Point CURRENT at the published `version_name`, unless it already points at a newer version; returns its manifest."""
+    directory = table_dir(snapshot_dir, schema_name, table_name)
+    with open(os.path.join(directory, version_name, MANIFEST)) as manifest_file:
+        manifest = json.load(manifest_file)
+    _, current = current_snapshot(snapshot_dir, schema_name, table_name)
+    if current is None or current['data_version'] <= manifest['data_version']:
+        file_descriptor, current_path = tempfile.mkstemp(prefix=f'.{CURRENT}.', suffix='.tmp', dir=directory)
+        with os.fdopen(file_descriptor, 'w') as current_file:
+            current_file.write(version_name)
+        os.replace(current_path, os.path.join(directory, CURRENT))
+    return manifest
+
+
+def prune_snapshots(snapshot_dir, schema_name, table_name, keep=DEFAULT_KEEP):
+    """Remove all but the `keep` newest version directories (never the current one)."""
+    directory = table_dir(snapshot_dir, schema_name, table_name)
+    current_path, _ = current_snapshot(snapshot_dir, schema_name, table_name)
+    versions = sorted((int(name[1:]), name) for name in os.listdir(directory) if name.startswith('v') and name[1:].isdigit())
+    for _, name in versions[:-keep] if keep > 0 else versions:
+        if current_path is None or os.path.join(directory, name) != current_path:
+            shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def load_snapshot(path, manifest, columns=None):
+    """The snapshot as a pandas DataFrame, memory-mapped; string columns come back as Categoricals."""
+    if manifest['format'] == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(os.path.join(path, 'data.parquet'), columns=columns, memory_map=True).to_pandas()
+
+    table = ColumnTable.load(path, mmap=True)
+    if columns is not None:
+        table = ColumnTable({name: table.columns[name] for name in columns})
+    return table.to_frame(categorical=True)
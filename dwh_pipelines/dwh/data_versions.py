@@ -0,0 +1,44 @@
+# Per-table data versions of the warehouse.
+#
+# Every loader and fact build bumps the version of the tables it (re)writes, in
+# the same database, once the rows are in. Readers that cache query results (see
+# dss/query_client.py) fold the versions of the tables a query reads into their
+# cache key, so a reload invalidates exactly the results built on that table.
+
+VERSIONS_TABLE = 'public.data_versions'
+
+
+def ensure_versions_table(cursor):
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (
+        table_name varchar(255) PRIMARY KEY,
+        version bigint NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );''')
+
+
+def bump_versions(cursor, table_names):
+    """Increment the version of each 'schema.table' in `table_names`; returns {table: new version}."""
+    ensure_versions_table(cursor)
+    versions = {}
+    for table_name in table_names:
+        cursor.execute(f'''INSERT INTO {VERSIONS_TABLE} (table_name, version, updated_at) VALUES (%s, 1, CURRENT_TIMESTAMP)
+                           ON CONFLICT (table_name) DO UPDATE SET version = {VERSIONS_TABLE}.version + 1, updated_at = EXCLUDED.updated_at
+                           RETURNING version;''', (table_name,))
+        versions[table_name] = cursor.fetchone()[0]
+    return versions
+
+
+def bump_version(cursor, schema_name, table_name):
+    return bump_versions(cursor, [f'{schema_name}.{table_name}'])[f'{schema_name}.{table_name}']
+
+
+def get_versions(cursor, table_names):
+    """{table: version} for `table_names`; tables never bumped have version 0."""
+    table_names = sorted(set(table_names))
+    cursor.execute("SELECT to_regclass(%s);", (VERSIONS_TABLE,))
+    if cursor.fetchone()[0] is None:
+        return dict.fromkeys(table_names, 0)
+    cursor.execute(f"SELECT table_name, version FROM {VERSIONS_TABLE} WHERE table_name = ANY(%s);", (table_names,))
+    versions = dict.fromkeys(table_names, 0)
+    versions.update(cursor.fetchall())
+    return versions
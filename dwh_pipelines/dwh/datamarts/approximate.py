@@ -0,0 +1,232 @@
+import hashlib
+
+import numpy as np
+
+from rollups import DIMENSIONS, MEASURE_NAMES, grouping_id
+
+# Approximate aggregates of a datamart fact.
+#
+# Distinct customers: every rollup grouping set gets a HyperLogLog sketch of the
+# customer keys per cell (<fact>_hll, registers stored as bytea). Sketches merge
+# by taking the register-wise max, so "distinct customers per location over
+# these months" is answered by merging the (location, month) cells instead of a
+# COUNT(DISTINCT) over the fact. Standard error is 1.04 / sqrt(2^precision).
+#
+# Sums and counts: <fact>_sample keeps up to N random rows per stratum (by default
+# location x product_category) with the stratum size, so totals are estimated as
+# sum over strata of N_h / n_h * (sample sum) with the usual stratified variance.
+#
+# Both are rebuilt by the fact build; estimates come back with 95% bounds.
+
+DEFAULT_HLL_PRECISION = 10
+DEFAULT_SAMPLE_PER_STRATUM = 500
+DEFAULT_SAMPLE_STRATA = ['location', 'product_category']
+SKETCH_COLUMN = 'customerid'
+Z_95 = 1.96
+
+# per-row value of each rollup measure, summed over the sample
+SAMPLE_MEASURES = {
+    'sales_count': '1',
+    'quantity': 'quantity',
+    'revenue': 'quantity * avg_price',
+}
+
+
+def sketch_table(fact_table):
+    return f'{fact_table}_hll'
+
+
+def sample_table(fact_table):
+    return f'{fact_table}_sample'
+
+
+def _sort_key(key):
+    return tuple((value is None, value) for value in key)
+
+
+# ================================================ HYPERLOGLOG ================================================
+
+def hash_values(values):
+    """64-bit hashes of `values` (blake2b, stable across processes unlike hash())."""
+    return np.array([int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'little') for value in values],
+                    dtype=np.uint64)
+
+
+def _bit_length(values):
+    values = values.copy()
+    lengths = np.zeros(len(values), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        wide = values >= (np.uint64(1) << np.uint64(shift))
+        lengths[wide] += shift
+        values[wide] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+def hll_registers(hashes, group_id, groups, precision=DEFAULT_HLL_PRECISION):
+    """(groups, 2^precision) uint8 registers: the first `precision` hash bits pick the register,
+    which keeps the max position of the first 1 bit in the remaining ones."""
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rank = 64 - _bit_length(hashes << np.uint64(precision)) + 1
+    rank = np.minimum(rank, 64 - precision + 1).astype(np.uint8)
+    registers = np.zeros((groups, 1 << precision), dtype=np.uint8)
+    np.maximum.at(registers, (group_id, index), rank)
+    return registers
+
+
+def hll_estimate(registers):
+    """Cardinality estimate of each row of registers (linear counting while many registers are empty)."""
+    registers = np.atleast_2d(registers)
+    m = registers.shape[-1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimates = alpha * m * m / np.sum(np.exp2(-registers.astype(np.float64)), axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    small = (estimates <= 2.5 * m) & (zeros > 0)
+    estimates[small] = m * np.log(m / zeros[small])
+    return estimates
+
+
+def hll_error(precision):
+    return 1.04 / np.sqrt(1 << precision)
+
+
+def build_sketches(cursor, schema_name, fact_table, table, sets, precision=DEFAULT_HLL_PRECISION, dimensions=DIMENSIONS):
+    """Recreate <fact>_hll with a sketch of distinct customers per cell of every grouping set.
+
+    `table` is the columnar extract of the fact (dss/columnar.py). Returns the number of cells.
+    """
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    name = sketch_table(fact_table)
+    customers = table.columns[SKETCH_COLUMN]
+    table = table.take(np.flatnonzero(np.asarray(customers.codes) >= 0))
+    hashes = hash_values(customers.dictionary)[np.asarray(table.columns[SKETCH_COLUMN].codes)]
+
+    cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{name};")
+    cursor.execute(f'''CREATE TABLE {schema_name}.{name} (
+        grouping_id integer NOT NULL,
+        {', '.join(f'{dimension} varchar(255)' for dimension in dimensions)},
+        hll_precision smallint NOT NULL,
+        customers_hll bytea NOT NULL
+    );''')
+
+    cells = 0
+    for columns in sets:
+        group_id, groups, labels = table.group_ids(columns)
+        registers = hll_registers(hashes, group_id, groups, precision)
+        rows = [(grouping_id(columns, dimensions), *[labels[dimension][group] if dimension in columns else None for dimension in dimensions],
+                 precision, psycopg2.Binary(registers[group].tobytes()))
+                for group in range(groups)]
+        execute_values(cursor, f"INSERT INTO {schema_name}.{name} VALUES %s;", rows, page_size=1000)
+        cells += groups
+
+    cursor.execute(f"CREATE INDEX {name}_grouping_idx ON {schema_name}.{name} (grouping_id);")
+    return cells
+
+
+def estimate_distinct_customers(cursor, group_by, filters=None, schema_name='datamart', fact_table='customers_sales', dimensions=DIMENSIONS):
+    """[(group values..., estimate, low, high)] of distinct customers per `group_by`, with optional
+    {column: value or list of values} filters, merged from the cells of the smallest covering sketch set."""
+    filters = filters or {}
+    needed = set(group_by) | set(filters)
+    name = sketch_table(fact_table)
+
+    cursor.execute(f"SELECT DISTINCT grouping_id FROM {schema_name}.{name};")
+    covering = []
+    for (set_id,) in cursor.fetchall():
+        columns = [dimension for index, dimension in enumerate(dimensions) if not set_id & (1 << (len(dimensions) - 1 - index))]
+        if needed <= set(columns):
+            covering.append((len(columns), set_id))
+    if not covering:
+        raise ValueError(f"No sketch grouping set covers {sorted(needed)}")
+
+    conditions, params = ["grouping_id = %s"], [min(covering)[1]]
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f"{column} = ANY(%s)")
+            params.append(sorted(value))
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+    cursor.execute(f"SELECT {', '.join(list(group_by) + ['hll_precision', 'customers_hll'])} FROM {schema_name}.{name} WHERE {' AND '.join(conditions)};", params)
+
+    merged, precision = {}, None
+    for row in cursor.fetchall():
+        key, precision = tuple(row[:len(group_by)]), row[-2]
+        registers = np.frombuffer(bytes(row[-1]), dtype=np.uint8)
+        merged[key] = np.maximum(merged[key], registers) if key in merged else registers.copy()
+    if not merged:
+        return []
+
+    keys = sorted(merged, key=_sort_key)
+    estimates = hll_estimate(np.stack([merged[key] for key in keys]))
+    error = Z_95 * hll_error(precision)
+    return [(*key, float(estimate), float(estimate * (1 - error)), float(estimate * (1 + error))) for key, estimate in zip(keys, estimates)]
+
+
+# ================================================ STRATIFIED SAMPLE ================================================
+
+def build_sample(cursor, schema_name, fact_table, strata=DEFAULT_SAMPLE_STRATA, per_stratum=DEFAULT_SAMPLE_PER_STRATUM):
+    """Recreate <fact>_sample with up to `per_stratum` random rows of every stratum; returns the sampled rows."""
+    name = sample_table(fact_table)
+    partition = ', '.join(strata)
+    cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{name};")
+    cursor.execute(f'''CREATE TABLE {schema_name}.{name} AS
+                       SELECT * FROM (
+                           SELECT f.*,
+                                  ROW({partition})::text AS stratum,
+                                  COUNT(*) OVER (PARTITION BY {partition}) AS stratum_rows,
+                                  ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY random()) AS sample_rank
+                           FROM {schema_name}.{fact_table} f
+                       ) AS ranked
+                       WHERE sample_rank <= {int(per_stratum)};''')
+    sampled = cursor.rowcount
+    cursor.execute(f"ALTER TABLE {schema_name}.{name} ADD COLUMN stratum_sampled bigint;")
+    cursor.execute(f"UPDATE {schema_name}.{name} SET stratum_sampled = LEAST(stratum_rows, {int(per_stratum)});")
+    cursor.execute(f"ANALYZE {schema_name}.{name};")
+    return sampled
+
+
+def estimate_aggregate(cursor, group_by, measures=MEASURE_NAMES, filters=None, schema_name='datamart', fact_table='customers_sales'):
+    """[(group values..., (estimate, low, high) per measure)] of `measures` summed per `group_by`, from the stratified sample."""
+    filters = filters or {}
+    conditions, params = [], []
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f"{column} = ANY(%s)")
+            params.append(sorted(value))
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+
+    sums = ', '.join(f"SUM({SAMPLE_MEASURES[measure]}), SUM(({SAMPLE_MEASURES[measure]}) * ({SAMPLE_MEASURES[measure]}))" for measure in measures)
+    query = (f"SELECT {', '.join(list(group_by) + ['stratum', 'MAX(stratum_rows)', 'MAX(stratum_sampled)'])}, {sums} "
+             f"FROM {schema_name}.{sample_table(fact_table)}")
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    query += f" GROUP BY {', '.join(list(group_by) + ['stratum'])};"
+    cursor.execute(query, params)
+
+    # per group and measure: [estimate, variance], accumulated over strata
+    totals = {}
+    for row in cursor.fetchall():
+        key = tuple(row[:len(group_by)])
+        population, sampled = row[len(group_by) + 1], row[len(group_by) + 2]
+        accumulators = totals.setdefault(key, [[0.0, 0.0] for _ in measures])
+        for index in range(len(measures)):
+            total = float(row[len(group_by) + 3 + 2 * index] or 0)
+            squares = float(row[len(group_by) + 4 + 2 * index] or 0)
+            accumulators[index][0] += population / sampled * total
+            if sampled > 1:
+                # variance of the stratum sample, rows outside the group counting as 0
+                sample_variance = max(squares - total * total / sampled, 0.0) / (sampled - 1)
+                accumulators[index][1] += population * population * (1 - sampled / population) * sample_variance / sampled
+
+    results = []
+    for key in sorted(totals, key=_sort_key):
+        bounds = []
+        for estimate, variance in totals[key]:
+            margin = Z_95 * float(np.sqrt(variance))
+            bounds.append((estimate, estimate - margin, estimate + margin))
+        results.append((*key, *bounds))
+    return results
@@ -0,0 +1,142 @@
+import os 
+import sys
+import time 
+import configparser
+from pathlib import Path
+import logging
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from dwh.data_versions import bump_version
+from star_schema import build_dim_dates, DIM_DATES
+
+psycopg2 = lazy_import('psycopg2')
+
+# ================================================ LOGGER ================================================
+root_logger     =   logging.getLogger(__name__)
+root_logger.setLevel(logging.DEBUG)
+file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+debug           =   dict    (color  =   'white'),
+info            =   dict    (color  =   'green'),
+warning         =   dict    (color  =   'cyan'),
+error           =   dict    (color  =   'red',      bold    =   True,   bright      =   True),
+critical        =   dict    (color  =   'black',    bold    =   True,   background  =   'red')
+),
+
+field_styles=dict(
+messages            =   dict    (color  =   'white')
+)
+)
+
+# Set up file handler object for logging events to file
+current_filepath    =   Path(__file__).stem
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
+file_handler.setFormatter(file_handler_log_formatter)
+
+
+# Set up console handler object for writing event logs to console in real time (i.e. streams events to stderr)
+console_handler     =   logging.StreamHandler()
+console_handler.setFormatter(console_handler_log_formatter)
+
+
+# Add the file and console handlers 
+root_logger.addHandler(file_handler)
+
+
+# Only add the console handler if the script is running directly from this location 
+if __name__=="__main__":
+    root_logger.addHandler(console_handler)
+
+
+# ================================================ CONFIG ================================================
+
+
+# Create a config file for storing environment variables
+config  =   configparser.ConfigParser()
+
+path    =   os.path.abspath('dwh_pipelines/local_config.ini')
+config.read(path)
+
+host = config['data_filepath']['HOST']
+port = config['data_filepath']['PORT']
+database = config['data_filepath']['DWH_DB']
+username = config['data_filepath']['USERNAME']
+password = config['data_filepath']['PASSWORD']
+postgres_connection = None
+cursor = None
+
+
+def load_data_to_table(postgres_connection):
+    cursor = None
+    try:
+        db_layer_name =   database
+
+        schema_name = 'datamart'
+        src_schema_name = 'main'
+        table_name = DIM_DATES
+
+        if postgres_connection.closed == 0:
+            root_logger.debug(f"")
+            root_logger.info("=================================================================================")
+            root_logger.info(f"CONNECTION SUCCESS: Managed to connect successfully to the {db_layer_name} database!!")
+            root_logger.info(f"Connection details: {postgres_connection.dsn} ")
+            root_logger.info("=================================================================================")
+            root_logger.debug("")
+        elif postgres_connection.closed != 0:
+            raise ConnectionError("CONNECTION ERROR: Unable to connect to the demo_company database...") 
+
+        cursor      =   postgres_connection.cursor()
+
+        CREATE_TABLE_START_TIME   =   time.time()
+        total_rows_in_table = build_dim_dates(cursor, schema_name, src_schema_name)
+        CREATE_TABLE_END_TIME   =   time.time()
+        bump_version(cursor, schema_name, table_name)
+
+        if total_rows_in_table > 1:
+            root_logger.debug(f"")
+            root_logger.info(f"=============================================================================================================================================================================")
+            root_logger.info(f"TABLE CREATION SUCCESS: Managed to build {schema_name}.{table_name} in {db_layer_name} ({total_rows_in_table} rows including the 'Unknown' member) ")
+            root_logger.info(f"Total time Table Creation: {CREATE_TABLE_END_TIME - CREATE_TABLE_START_TIME} ")
+            root_logger.info(f"=============================================================================================================================================================================")
+            root_logger.debug(f"")
+        else:
+            root_logger.error(f"ERROR: No source rows were loaded into '{table_name}' dimension....")
+            raise ImportError("Trace the main.online_sales source table to highlight the root cause of the missing rows...")
+
+        root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
+        root_logger.info("Saved successfully, now terminating cursor and current session....")
+    except Exception as e:
+            root_logger.error(e)
+            raise
+    finally:
+        # Close the cursor if it exists 
+        if cursor is not None:
+            cursor.close()
+            root_logger.debug("")
+            root_logger.debug("Cursor closed successfully.")
+
+        # Close the database connection to Postgres if it exists 
+        if postgres_connection is not None:
+            postgres_connection.close()
+            root_logger.debug("Session connected to Postgres database closed.")
+
+
+def run():
+    """Pipeline stage: rebuild datamart.dim_dates."""
+    root_logger.info("Building the date dimension...")
+
+    postgres_connection = psycopg2.connect(
+    host = host,
+    port = port,
+    dbname = database,
+    user = username,
+    password = password,
+    )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection)
+
+
+if __name__=="__main__":
+    run()
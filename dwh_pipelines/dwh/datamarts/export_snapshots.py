@@ -0,0 +1,142 @@
+import os 
+import sys
+import time 
+import configparser
+from pathlib import Path
+import logging
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+
+psycopg2 = lazy_import('psycopg2')
+# numpy-backed, loaded when the tables are exported
+snapshots = lazy_import('dss.snapshots')
+
+# ================================================ LOGGER ================================================
+root_logger     =   logging.getLogger(__name__)
+root_logger.setLevel(logging.DEBUG)
+file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+debug           =   dict    (color  =   'white'),
+info            =   dict    (color  =   'green'),
+warning         =   dict    (color  =   'cyan'),
+error           =   dict    (color  =   'red',      bold    =   True,   bright      =   True),
+critical        =   dict    (color  =   'black',    bold    =   True,   background  =   'red')
+),
+
+field_styles=dict(
+messages            =   dict    (color  =   'white')
+)
+)
+
+# Set up file handler object for logging events to file
+current_filepath    =   Path(__file__).stem
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
+file_handler.setFormatter(file_handler_log_formatter)
+
+
+# Set up console handler object for writing event logs to console in real time (i.e. streams events to stderr)
+console_handler     =   logging.StreamHandler()
+console_handler.setFormatter(console_handler_log_formatter)
+
+
+# Add the file and console handlers 
+root_logger.addHandler(file_handler)
+
+
+# Only add the console handler if the script is running directly from this location 
+if __name__=="__main__":
+    root_logger.addHandler(console_handler)
+
+
+# ================================================ CONFIG ================================================
+
+
+# Create a config file for storing environment variables
+config  =   configparser.ConfigParser()
+
+path    =   os.path.abspath('dwh_pipelines/local_config.ini')
+config.read(path)
+
+host = config['data_filepath']['HOST']
+port = config['data_filepath']['PORT']
+database = config['data_filepath']['DWH_DB']
+username = config['data_filepath']['USERNAME']
+password = config['data_filepath']['PASSWORD']
+ITERSIZE = int(config['data_filepath'].get('EXTRACT_ITERSIZE', 10000))
+SNAPSHOT_DIR = config['data_filepath'].get('SNAPSHOT_DIR') or snapshots.DEFAULT_SNAPSHOT_DIR
+SNAPSHOT_FORMAT = config['data_filepath'].get('SNAPSHOT_FORMAT', 'auto')
+SNAPSHOT_KEEP = int(config['data_filepath'].get('SNAPSHOT_KEEP') or snapshots.DEFAULT_KEEP)
+SNAPSHOT_TABLES = [table.strip() for table in config['data_filepath'].get('SNAPSHOT_TABLES', 'customers_sales').split(',') if table.strip()]
+postgres_connection = None
+cursor = None
+
+
+def export_snapshots(postgres_connection):
+    cursor = None
+    try:
+        db_layer_name =   database
+
+        schema_name = 'datamart'
+
+        if postgres_connection.closed == 0:
+            root_logger.debug(f"")
+            root_logger.info("=================================================================================")
+            root_logger.info(f"CONNECTION SUCCESS: Managed to connect successfully to the {db_layer_name} database!!")
+            root_logger.info(f"Connection details: {postgres_connection.dsn} ")
+            root_logger.info("=================================================================================")
+            root_logger.debug("")
+        elif postgres_connection.closed != 0:
+            raise ConnectionError("CONNECTION ERROR: Unable to connect to the demo_company database...") 
+
+        cursor      =   postgres_connection.cursor()
+
+        for table_name in SNAPSHOT_TABLES:
+            cursor.execute("SELECT to_regclass(%s);", (f'{schema_name}.{table_name}',))
+            table_exists = cursor.fetchone()[0] is not None
+            postgres_connection.rollback()
+            if not table_exists:
+                root_logger.warning(f"{schema_name}.{table_name} does not exist, no snapshot exported")
+                continue
+
+            # One snapshot per data version: an unchanged table keeps its current snapshot
+            EXPORT_START_TIME   =   time.time()
+            snapshot_path, manifest, written = snapshots.export_table(postgres_connection, schema_name, table_name, SNAPSHOT_DIR, SNAPSHOT_FORMAT, SNAPSHOT_KEEP, ITERSIZE)
+            if written:
+                root_logger.info(f"SNAPSHOT EXPORTED: {manifest['rows']} rows of {schema_name}.{table_name} (version {manifest['data_version']}, {manifest['format']}) to {snapshot_path} in {time.time() - EXPORT_START_TIME:.3f}s ")
+            else:
+                root_logger.info(f"SNAPSHOT CURRENT: {schema_name}.{table_name} version {manifest['data_version']} already at {snapshot_path} ")
+    except Exception as e:
+            root_logger.error(e)
+            raise
+    finally:
+        # Close the cursor if it exists 
+        if cursor is not None:
+            cursor.close()
+            root_logger.debug("")
+            root_logger.debug("Cursor closed successfully.")
+
+        # Close the database connection to Postgres if it exists 
+        if postgres_connection is not None:
+            postgres_connection.close()
+            root_logger.debug("Session connected to Postgres database closed.")
+
+
+def run():
+    """Pipeline stage: export the columnar snapshots of the datamart tables."""
+    root_logger.info("Exporting columnar snapshots of the datamart tables...")
+
+    postgres_connection = psycopg2.connect(
+    host = host,
+    port = port,
+    dbname = database,
+    user = username,
+    password = password,
+    )
+    postgres_connection.set_session(readonly=True, autocommit=False)
+
+    export_snapshots(postgres_connection)
+
+
+if __name__=="__main__":
+    run()
@@ -1,15 +1,28 @@
 import os 
+import sys
 import json
 import time 
 import random
-import psycopg2
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
 
-with open(f"{os.getcwd()}{os.sep}dwh_pipelines{os.sep}extract{os.sep}load_remote_Marketing_Spend.py") as start_fetch:
-    exec(start_fetch.read())
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from dwh.data_versions import bump_versions
+from incremental_fact import join_select, refresh_fact, record_full_build
+from matview_fact import build_fact_matview, relation_kind
+from rollups import parse_grouping_sets, build_rollups, refresh_rollups
+from partitioned_fact import build_partitioned_fact
+from extract import load_remote_Marketing_Spend
+
+psycopg2 = lazy_import('psycopg2')
+# numpy-backed, loaded once the bitmap indexes or approximate aggregates are built
+approximate = lazy_import('approximate')
+columnar = lazy_import('dss.columnar')
+bitmap_index = lazy_import('dss.bitmap_index')
+
 
 src_file = 'Marketing_Spend.sql.json'
 
@@ -17,7 +30,7 @@ src_file = 'Marketing_Spend.sql.json'
 root_logger     =   logging.getLogger(__name__)
 root_logger.setLevel(logging.DEBUG)
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
 debug           =   dict    (color  =   'white'),
 info            =   dict    (color  =   'green'),
 warning         =   dict    (color  =   'cyan'),
@@ -32,7 +45,7 @@ messages            =   dict    (color  =   'white')
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -65,31 +78,19 @@ port = config['data_filepath']['PORT']
 database = config['data_filepath']['DWH_DB']
 username = config['data_filepath']['USERNAME']
 password = config['data_filepath']['PASSWORD']
+FACT_BUILD_MODE = config['data_filepath'].get('FACT_BUILD_MODE', 'full')
+ROLLUP_GROUPING_SETS = config['data_filepath'].get('ROLLUP_GROUPING_SETS', 'cube')
+BITMAP_INDEX_COLUMNS = [column.strip() for column in config['data_filepath'].get('BITMAP_INDEX_COLUMNS', '').split(',') if column.strip()]
+COLUMNAR_CACHE_DIR = config['data_filepath'].get('COLUMNAR_CACHE_DIR') or columnar.DEFAULT_CACHE_DIR
+APPROX_HLL_PRECISION = int(config['data_filepath'].get('APPROX_HLL_PRECISION', 0))
+APPROX_SAMPLE_STRATA = [column.strip() for column in config['data_filepath'].get('APPROX_SAMPLE_STRATA', 'location,product_category').split(',') if column.strip()]
+APPROX_SAMPLE_PER_STRATUM = int(config['data_filepath'].get('APPROX_SAMPLE_PER_STRATUM', 0))
+FACT_PARTITION_BY = config['data_filepath'].get('FACT_PARTITION_BY', 'month')
+FACT_HASH_PARTITIONS = int(config['data_filepath'].get('FACT_HASH_PARTITIONS', 8))
+FACT_BUILD_WORKERS = int(config['data_filepath'].get('FACT_BUILD_WORKERS', 4))
 postgres_connection = None
 cursor = None
 
-root_logger.info("Beginning the source data extraction process...")
-
-
-# with open(customer_info_path, 'r') as customer_info_file:    
-#     try:
-#         customer_info_data = json.load(customer_info_file)
-#         root_logger.info(f"Successfully located '{src_file}'")
-#         root_logger.info(f"File type: '{type(customer_info_data)}'")
-
-#     except:
-#         root_logger.error("Unable to locate source file...")
-#         raise Exception("No source file located")
-    
-
-postgres_connection = psycopg2.connect(
-host = host,
-port = port,
-dbname = database,
-user = username,
-password = password,
-)
-postgres_connection.set_session(autocommit=True)
 
 def load_data_to_table(postgres_connection):
     try:
@@ -105,13 +106,17 @@ def load_data_to_table(postgres_connection):
         join_col_tbl2 = 'customerid'
 
         table_name = 'customers_sales'
+        # signed changed rows of incremental refreshes, consumed by the rollup refresh
+        delta_table = f'{table_name}_delta' if ROLLUP_GROUPING_SETS else None
         total_null_values_in_table      =   0 
         successful_rows_upload_count    =   0 
         failed_rows_upload_count        =   0
 
         cursor      =   postgres_connection.cursor()
 
-        list_of_column_selecteds = [f"{dim_table1}.customerid",'gender', 'location', 'product_category', 'transaction_date']
+        list_of_column_selecteds = [f"{dim_table1}.customerid",'gender', 'location', 'product_category', 'transaction_date', 'quantity', 'avg_price']
+        # source row keys, one fact row per (customer row, sales row); the unique index of the matview backend
+        unique_columns_selecteds = [f"{dim_table1}.customers_data_id", f"{dim_table2}.online_sale_id"]
 
 
         if postgres_connection.closed == 0:
@@ -146,7 +151,7 @@ def load_data_to_table(postgres_connection):
         #     Online_Spend integer
         # );'''
 
-        create_tbl = f'''CREATE TABLE {schema_name}.{table_name} AS SELECT {",".join(list_of_column_selecteds)} FROM {src_schema_name}.{dim_table1} JOIN {src_schema_name}.{dim_table2} ON {src_schema_name}.{dim_table1}.{join_col_tbl1} = {src_schema_name}.{dim_table2}.{join_col_tbl2};'''
+        create_tbl = f'''CREATE TABLE {schema_name}.{table_name} AS {join_select(list_of_column_selecteds, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2)};'''
 
         print(create_tbl)
 
@@ -205,48 +210,164 @@ def load_data_to_table(postgres_connection):
 
         
 
-        # Delete table if it exists in Postgres
-        cursor.execute(delete_tbl_if_exists)
-        cursor.execute(check_if_tbl_is_deleted)
+        CREATE_TABLE_START_TIME   =   time.time()
+        refresh = {'mode': 'full'}
+
+        # Leaving the matview backend: the table builds below need a plain table
+        if FACT_BUILD_MODE != 'matview' and relation_kind(cursor, schema_name, table_name) == 'm':
+            cursor.execute(f'''DROP MATERIALIZED VIEW {schema_name}.{table_name} CASCADE;''')
+
+        # Materialized view mode: readers keep querying the fact while it is refreshed concurrently
+        if FACT_BUILD_MODE == 'matview':
+            refresh = {'mode': build_fact_matview(cursor, schema_name, table_name,
+                                                  join_select(list_of_column_selecteds + unique_columns_selecteds, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2),
+                                                  [column.split('.')[-1] for column in unique_columns_selecteds])}
+            cursor.execute(check_total_row_count_after_insert_statement)
+            successful_rows_upload_count = cursor.fetchone()[0]
 
-        sql_result = cursor.fetchone()[0]
-        if sql_result:
             root_logger.debug(f"")
             root_logger.info(f"=============================================================================================================================================================================")
-            root_logger.info(f"TABLE DELETION SUCCESS: Managed to drop {table_name} table in {db_layer_name}. Now advancing to recreating table... ")
-            root_logger.info(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
+            root_logger.info(f"MATERIALIZED VIEW {refresh['mode'].upper()}: {schema_name}.{table_name} in {db_layer_name} ")
             root_logger.info(f"=============================================================================================================================================================================")
             root_logger.debug(f"")
-        else:
-            root_logger.debug(f"")
-            root_logger.error(f"==========================================================================================================================================================================")
-            root_logger.error(f"TABLE DELETION FAILURE: Unable to delete {table_name}. This table may have objects that depend on it (use DROP TABLE ... CASCADE to resolve) or it doesn't exist. ")
-            root_logger.error(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
-            root_logger.error(f"==========================================================================================================================================================================")
-            root_logger.debug(f"")
 
-        CREATE_TABLE_START_TIME   =   time.time()
-        # Create table if it doesn't exist in Postgres  
-        cursor.execute(create_tbl)
-        cursor.execute(check_if_tbl_exists)
+        # Incremental mode: join only the sales/customer rows changed since the last build
+        if FACT_BUILD_MODE == 'incremental':
+            cursor.execute('BEGIN;')
+            refresh = refresh_fact(cursor, schema_name, table_name, list_of_column_selecteds, src_schema_name,
+                                   dim_table1, join_col_tbl1, dim_table2, join_col_tbl2, fact_key_column=join_col_tbl1, delta_table=delta_table)
+            if refresh['mode'] == 'incremental':
+                cursor.execute(check_total_row_count_after_insert_statement)
+                successful_rows_upload_count = cursor.fetchone()[0]
+            cursor.execute('COMMIT;')
+
+            if refresh['mode'] == 'incremental':
+                root_logger.debug(f"")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.info(f"INCREMENTAL REFRESH SUCCESS: {refresh['appended']} new sales rows appended, {refresh['deleted']} rows of late-arriving customer changes deleted and {refresh['reinserted']} reinserted in {table_name} ")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.debug(f"")
+            elif refresh['reason'] == 'sales reloaded':
+                root_logger.warning(f"FACT_BUILD_MODE=incremental cannot apply: {src_schema_name}.{dim_table2} was dropped and reloaded since the last build "
+                                    f"(loaded under another FACT_BUILD_MODE, with new created_at for every row), running a full rebuild... ")
+            else:
+                root_logger.warning(f"No watermark for {table_name} yet (first build), running a full rebuild... ")
+
+        # Partitioned mode: the sales are split once like the fact, then one INSERT ... SELECT per month / customerid hash partition runs concurrently over a connection pool
+        if FACT_BUILD_MODE == 'partitioned':
+            refresh = {'mode': 'partitioned'}
+            partition_timings = build_partitioned_fact(cursor, dict(host=host, port=port, dbname=database, user=username, password=password),
+                                                       schema_name, table_name, list_of_column_selecteds, src_schema_name,
+                                                       dim_table1, join_col_tbl1, dim_table2, join_col_tbl2,
+                                                       FACT_PARTITION_BY, FACT_HASH_PARTITIONS, FACT_BUILD_WORKERS)
+            successful_rows_upload_count = sum(rows for _, rows, _ in partition_timings)
+            record_full_build(cursor, schema_name, table_name, src_schema_name, dim_table1, dim_table2)
 
-        sql_result = cursor.fetchone()[0]
-        if sql_result:
             root_logger.debug(f"")
             root_logger.info(f"=============================================================================================================================================================================")
-            root_logger.info(f"TABLE CREATION SUCCESS: Managed to create {table_name} table in {db_layer_name}.  ")
-            root_logger.info(f"SQL Query for validation check:  {check_if_tbl_exists} ")
+            root_logger.info(f"PARTITIONED BUILD SUCCESS: {len(partition_timings)} partitions by {FACT_PARTITION_BY} filled by {FACT_BUILD_WORKERS} workers ")
+            for partition_table, partition_rows, partition_seconds in partition_timings:
+                root_logger.info(f"{partition_table}: {partition_rows} rows in {partition_seconds:.3f}s ")
             root_logger.info(f"=============================================================================================================================================================================")
             root_logger.debug(f"")
-        else:
-            root_logger.debug(f"")
-            root_logger.error(f"==========================================================================================================================================================================")
-            root_logger.error(f"TABLE CREATION FAILURE: Unable to create {table_name}... ")
-            root_logger.error(f"SQL Query for validation check:  {check_if_tbl_exists} ")
-            root_logger.error(f"==========================================================================================================================================================================")
-            root_logger.debug(f"")
+
+        if refresh['mode'] == 'full':
+            # Delete table if it exists in Postgres
+            cursor.execute(delete_tbl_if_exists)
+            cursor.execute(check_if_tbl_is_deleted)
+
+            sql_result = cursor.fetchone()[0]
+            if sql_result:
+                root_logger.debug(f"")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.info(f"TABLE DELETION SUCCESS: Managed to drop {table_name} table in {db_layer_name}. Now advancing to recreating table... ")
+                root_logger.info(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.debug(f"")
+            else:
+                root_logger.debug(f"")
+                root_logger.error(f"==========================================================================================================================================================================")
+                root_logger.error(f"TABLE DELETION FAILURE: Unable to delete {table_name}. This table may have objects that depend on it (use DROP TABLE ... CASCADE to resolve) or it doesn't exist. ")
+                root_logger.error(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
+                root_logger.error(f"==========================================================================================================================================================================")
+                root_logger.debug(f"")
+
+            # Create table if it doesn't exist in Postgres  
+            cursor.execute(create_tbl)
+            successful_rows_upload_count = cursor.rowcount
+            cursor.execute(check_if_tbl_exists)
+
+            sql_result = cursor.fetchone()[0]
+            if sql_result:
+                root_logger.debug(f"")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.info(f"TABLE CREATION SUCCESS: Managed to create {table_name} table in {db_layer_name}.  ")
+                root_logger.info(f"SQL Query for validation check:  {check_if_tbl_exists} ")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.debug(f"")
+            else:
+                root_logger.debug(f"")
+                root_logger.error(f"==========================================================================================================================================================================")
+                root_logger.error(f"TABLE CREATION FAILURE: Unable to create {table_name}... ")
+                root_logger.error(f"SQL Query for validation check:  {check_if_tbl_exists} ")
+                root_logger.error(f"==========================================================================================================================================================================")
+                root_logger.debug(f"")
+
+            # Baseline watermarks for the next incremental refresh
+            record_full_build(cursor, schema_name, table_name, src_schema_name, dim_table1, dim_table2)
+
         CREATE_TABLE_END_TIME   =   time.time()
 
+        # Rollups: merge the incremental delta, or rebuild them after a full / matview build
+        if ROLLUP_GROUPING_SETS:
+            ROLLUP_START_TIME   =   time.time()
+            rollup_sets = parse_grouping_sets(ROLLUP_GROUPING_SETS)
+            cursor.execute('BEGIN;')
+            if refresh['mode'] == 'incremental':
+                rollups = refresh_rollups(cursor, schema_name, table_name, delta_table, rollup_sets)
+            else:
+                cursor.execute(f'''DROP TABLE IF EXISTS {schema_name}.{delta_table};''')
+                rollups = build_rollups(cursor, schema_name, table_name, rollup_sets)
+            cursor.execute('COMMIT;')
+            root_logger.info(f"ROLLUPS {'REFRESHED' if refresh['mode'] == 'incremental' else 'BUILT'}: {len(rollups)} rollup tables in {time.time() - ROLLUP_START_TIME:.3f}s ")
+            for rollup_name, rollup_rows in rollups.items():
+                root_logger.debug(f"{rollup_name}: {rollup_rows} rows")
+
+        # New data versions for readers caching results built on the fact and its rollups
+        versions = bump_versions(cursor, [f'{schema_name}.{table_name}'] + [f'{schema_name}.{rollup_name}' for rollup_name in (rollups if ROLLUP_GROUPING_SETS else [])])
+
+        # Columnar extract of the new fact version, read by the bitmap indexes and the distinct-customer sketches
+        if BITMAP_INDEX_COLUMNS or APPROX_HLL_PRECISION:
+            extract_connection = psycopg2.connect(host=host, port=port, dbname=database, user=username, password=password)
+            try:
+                fact_extract = columnar.load_datamart_table(extract_connection, schema_name, table_name, COLUMNAR_CACHE_DIR)
+            finally:
+                extract_connection.close()
+
+        # Bitmap indexes of the low-cardinality filter columns, next to the columnar extract of the fact
+        if BITMAP_INDEX_COLUMNS:
+            BITMAP_START_TIME   =   time.time()
+            bitmap_index.save_bitmap_indexes(columnar.extract_path(COLUMNAR_CACHE_DIR, schema_name, table_name),
+                                             bitmap_index.build_bitmap_indexes(fact_extract, BITMAP_INDEX_COLUMNS), data_version=versions[f'{schema_name}.{table_name}'])
+            root_logger.info(f"BITMAP INDEXES BUILT: {', '.join(BITMAP_INDEX_COLUMNS)} over {fact_extract.rows} rows in {time.time() - BITMAP_START_TIME:.3f}s ")
+
+        # Approximate aggregates: HyperLogLog sketches of distinct customers per rollup cell and a stratified sample of the fact
+        approximate_tables = []
+        if APPROX_HLL_PRECISION or APPROX_SAMPLE_PER_STRATUM:
+            APPROX_START_TIME   =   time.time()
+            cursor.execute('BEGIN;')
+            if APPROX_HLL_PRECISION:
+                sketch_cells = approximate.build_sketches(cursor, schema_name, table_name, fact_extract, parse_grouping_sets(ROLLUP_GROUPING_SETS or 'cube'), APPROX_HLL_PRECISION)
+                approximate_tables.append(approximate.sketch_table(table_name))
+                root_logger.info(f"HLL SKETCHES BUILT: {sketch_cells} cells of {approximate.sketch_table(table_name)} at precision {APPROX_HLL_PRECISION} ")
+            if APPROX_SAMPLE_PER_STRATUM:
+                sampled_rows = approximate.build_sample(cursor, schema_name, table_name, APPROX_SAMPLE_STRATA, APPROX_SAMPLE_PER_STRATUM)
+                approximate_tables.append(approximate.sample_table(table_name))
+                root_logger.info(f"STRATIFIED SAMPLE BUILT: {sampled_rows} rows of {approximate.sample_table(table_name)}, up to {APPROX_SAMPLE_PER_STRATUM} per {', '.join(APPROX_SAMPLE_STRATA)} stratum ")
+            bump_versions(cursor, [f'{schema_name}.{approximate_table}' for approximate_table in approximate_tables])
+            cursor.execute('COMMIT;')
+            root_logger.info(f"Total time approximate aggregates: {time.time() - APPROX_START_TIME:.3f}s ")
+
         cursor.execute(check_total_row_count_after_insert_statement)
 
         total_rows_in_table = cursor.fetchone()[0]
@@ -321,7 +442,8 @@ def load_data_to_table(postgres_connection):
         root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
         root_logger.info("Saved successfully, now terminating cursor and current session....")
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
     finally:
         # Close the cursor if it exists 
         if cursor is not None:
@@ -335,4 +457,34 @@ def load_data_to_table(postgres_connection):
             # root_logger.debug("")
             root_logger.debug("Session connected to Postgres database closed.")
 
-load_data_to_table(postgres_connection)
\ No newline at end of file
+
+def run():
+    """Pipeline stage: build datamart.customers_sales with the configured backend, then its rollups, indexes and approximations."""
+    load_remote_Marketing_Spend.run()
+
+    root_logger.info("Beginning the source data extraction process...")
+
+    # with open(customer_info_path, 'r') as customer_info_file:    
+    #     try:
+    #         customer_info_data = json.load(customer_info_file)
+    #         root_logger.info(f"Successfully located '{src_file}'")
+    #         root_logger.info(f"File type: '{type(customer_info_data)}'")
+
+    #     except:
+    #         root_logger.error("Unable to locate source file...")
+    #         raise Exception("No source file located")
+
+    postgres_connection = psycopg2.connect(
+    host = host,
+    port = port,
+    dbname = database,
+    user = username,
+    password = password,
+    )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection)
+
+
+if __name__=="__main__":
+    run()
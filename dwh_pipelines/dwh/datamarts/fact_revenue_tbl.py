@@ -0,0 +1,167 @@
+import os 
+import sys
+import time 
+import configparser
+from pathlib import Path
+import logging
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from dwh.data_versions import bump_version
+
+psycopg2 = lazy_import('psycopg2')
+# numpy-backed, loaded when the fact is built
+revenue_fact = lazy_import('revenue_fact')
+
+# ================================================ LOGGER ================================================
+root_logger     =   logging.getLogger(__name__)
+root_logger.setLevel(logging.DEBUG)
+file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+debug           =   dict    (color  =   'white'),
+info            =   dict    (color  =   'green'),
+warning         =   dict    (color  =   'cyan'),
+error           =   dict    (color  =   'red',      bold    =   True,   bright      =   True),
+critical        =   dict    (color  =   'black',    bold    =   True,   background  =   'red')
+),
+
+field_styles=dict(
+messages            =   dict    (color  =   'white')
+)
+)
+
+# Set up file handler object for logging events to file
+current_filepath    =   Path(__file__).stem
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
+file_handler.setFormatter(file_handler_log_formatter)
+
+
+# Set up console handler object for writing event logs to console in real time (i.e. streams events to stderr)
+console_handler     =   logging.StreamHandler()
+console_handler.setFormatter(console_handler_log_formatter)
+
+
+# Add the file and console handlers 
+root_logger.addHandler(file_handler)
+
+
+# Only add the console handler if the script is running directly from this location 
+if __name__=="__main__":
+    root_logger.addHandler(console_handler)
+
+
+# ================================================ CONFIG ================================================
+
+
+# Create a config file for storing environment variables
+config  =   configparser.ConfigParser()
+
+path    =   os.path.abspath('dwh_pipelines/local_config.ini')
+config.read(path)
+
+host = config['data_filepath']['HOST']
+port = config['data_filepath']['PORT']
+database = config['data_filepath']['DWH_DB']
+username = config['data_filepath']['USERNAME']
+password = config['data_filepath']['PASSWORD']
+ITERSIZE = int(config['data_filepath'].get('EXTRACT_ITERSIZE', 10000))
+REVENUE_BUILD_MODE = config['data_filepath'].get('REVENUE_BUILD_MODE', 'vectorized')
+postgres_connection = None
+cursor = None
+
+
+def load_data_to_table(postgres_connection):
+    cursor = None
+    try:
+        db_layer_name =   database
+
+        schema_name = 'datamart'
+        src_schema_name = 'main'
+        table_name = revenue_fact.FACT_REVENUE
+
+        if postgres_connection.closed == 0:
+            root_logger.debug(f"")
+            root_logger.info("=================================================================================")
+            root_logger.info(f"CONNECTION SUCCESS: Managed to connect successfully to the {db_layer_name} database!!")
+            root_logger.info(f"Connection details: {postgres_connection.dsn} ")
+            root_logger.info("=================================================================================")
+            root_logger.debug("")
+        elif postgres_connection.closed != 0:
+            raise ConnectionError("CONNECTION ERROR: Unable to connect to the demo_company database...") 
+
+        cursor      =   postgres_connection.cursor()
+
+        if REVENUE_BUILD_MODE not in revenue_fact.BUILD_MODES:
+            raise ValueError(f"REVENUE_BUILD_MODE must be one of {revenue_fact.BUILD_MODES}, got '{REVENUE_BUILD_MODE}'")
+
+        # Tax and discount of every sale: in-process lookups over streamed batches, or one SQL join in Postgres
+        CREATE_TABLE_START_TIME   =   time.time()
+        if REVENUE_BUILD_MODE == 'sql':
+            successful_rows_upload_count = revenue_fact.build_fact_revenue_sql(cursor, schema_name, src_schema_name)
+        else:
+            successful_rows_upload_count = revenue_fact.build_fact_revenue_vectorized(postgres_connection, schema_name, src_schema_name, ITERSIZE)
+        revenue_fact.index_fact_revenue(cursor, schema_name)
+        bump_version(cursor, schema_name, table_name)
+        postgres_connection.commit()
+        CREATE_TABLE_END_TIME   =   time.time()
+
+        cursor.execute(f'''SELECT COUNT(*) FROM {schema_name}.{table_name}''')
+        total_rows_in_table = cursor.fetchone()[0]
+        root_logger.debug(f"")
+        root_logger.info(f"Rows after SQL insert in Postgres: {total_rows_in_table} ")
+        root_logger.info(f"Total time Table Creation ({REVENUE_BUILD_MODE}): {CREATE_TABLE_END_TIME - CREATE_TABLE_START_TIME} ")
+        root_logger.debug(f"")
+
+        cursor.execute(f'''SELECT COUNT(*) FROM {schema_name}.{table_name} WHERE gst IS NULL''')
+        untaxed_rows = cursor.fetchone()[0]
+        if untaxed_rows > 0:
+            root_logger.warning(f"{untaxed_rows} sales have a product category without a GST rate, their tax_amount is NULL")
+
+        if successful_rows_upload_count != total_rows_in_table:
+            if successful_rows_upload_count == 0:
+                root_logger.error(f"ERROR: No records were upload to '{table_name}' table....")
+                raise ImportError("Trace filepath to highlight the root cause of the missing rows...")
+            else:
+                root_logger.error(f"ERROR: There are only {successful_rows_upload_count} records upload to '{table_name}' table....")
+                raise ImportError("Trace filepath to highlight the root cause of the missing rows...")
+        else:
+            root_logger.debug("")
+            root_logger.info("DATA VALIDATION SUCCESS: All general DQ checks passed! ")
+            root_logger.debug("")
+
+        root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
+        root_logger.info("Saved successfully, now terminating cursor and current session....")
+    except Exception as e:
+            root_logger.error(e)
+            raise
+    finally:
+        # Close the cursor if it exists 
+        if cursor is not None:
+            cursor.close()
+            root_logger.debug("")
+            root_logger.debug("Cursor closed successfully.")
+
+        # Close the database connection to Postgres if it exists 
+        if postgres_connection is not None:
+            postgres_connection.close()
+            root_logger.debug("Session connected to Postgres database closed.")
+
+
+def run():
+    """Pipeline stage: rebuild datamart.fact_revenue."""
+    root_logger.info("Building the revenue fact from the tax and discount lookups...")
+
+    postgres_connection = psycopg2.connect(
+    host = host,
+    port = port,
+    dbname = database,
+    user = username,
+    password = password,
+    )
+    postgres_connection.set_session(autocommit=False)
+
+    load_data_to_table(postgres_connection)
+
+
+if __name__=="__main__":
+    run()
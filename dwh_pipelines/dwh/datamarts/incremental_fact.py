@@ -0,0 +1,137 @@
+# Incremental maintenance of a datamart fact built as "dimension JOIN sales".
+#
+# The last processed lineage timestamps are kept per fact table in
+# <schema>.fact_watermarks: max(created_at) of the sales table and max(updated_at)
+# of the dimension table. A refresh then
+#   1. deletes and re-joins the fact rows of dimension keys changed since the
+#      dimension watermark (late-arriving customer changes), for sales already
+#      processed, and
+#   2. appends the join of the sales rows created since the sales watermark,
+# so the cost follows the delta instead of the full history. With a delta table
+# every deleted and inserted fact row is also recorded there with sign -1 / +1,
+# for the rollups built on the fact (see rollups.py). With
+# FACT_BUILD_MODE=incremental the tbl_* loaders merge their reload into the kept
+# tables (dwh/table_reload.py), so only new sales rows get a new created_at and
+# only changed customers a new updated_at. When every sales row is newer than the
+# watermark the sales table was reloaded from scratch anyway (a loader run under
+# another mode) and refresh_fact reports mode 'full' (reason 'sales reloaded') so
+# the caller rebuilds the table instead.
+
+WATERMARK_TABLE = 'fact_watermarks'
+
+
+def join_select(columns, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2, predicate=None):
+    """The SELECT the fact is built from: columns of dim_table1 JOIN dim_table2 [WHERE predicate]."""
+    query = (f"SELECT {','.join(columns)} FROM {src_schema_name}.{dim_table1} JOIN {src_schema_name}.{dim_table2} "
+             f"ON {src_schema_name}.{dim_table1}.{join_col_tbl1} = {src_schema_name}.{dim_table2}.{join_col_tbl2}")
+    if predicate:
+        query += f" WHERE {predicate}"
+    return query
+
+
+def ensure_watermark_table(cursor, schema_name):
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS {schema_name}.{WATERMARK_TABLE} (
+        table_name varchar(255) PRIMARY KEY,
+        sales_watermark TIMESTAMP WITH TIME ZONE,
+        dim_watermark TIMESTAMP WITH TIME ZONE,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );''')
+
+
+def get_watermarks(cursor, schema_name, table_name):
+    """(sales_watermark, dim_watermark) of the last build, or None when the fact was never built."""
+    cursor.execute(f"SELECT sales_watermark, dim_watermark FROM {schema_name}.{WATERMARK_TABLE} WHERE table_name = %s;", (table_name,))
+    return cursor.fetchone()
+
+
+def set_watermarks(cursor, schema_name, table_name, sales_watermark, dim_watermark):
+    cursor.execute(f'''INSERT INTO {schema_name}.{WATERMARK_TABLE} (table_name, sales_watermark, dim_watermark, updated_at)
+                       VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                       ON CONFLICT (table_name) DO UPDATE SET sales_watermark = EXCLUDED.sales_watermark,
+                                                              dim_watermark = EXCLUDED.dim_watermark,
+                                                              updated_at = EXCLUDED.updated_at;''',
+                   (table_name, sales_watermark, dim_watermark))
+
+
+def source_watermarks(cursor, src_schema_name, dim_table, sales_table):
+    """Current (max sales created_at, max dimension updated_at, min sales created_at, min dimension updated_at)."""
+    cursor.execute(f'''SELECT (SELECT MAX(created_at) FROM {src_schema_name}.{sales_table}),
+                              (SELECT MAX(updated_at) FROM {src_schema_name}.{dim_table}),
+                              (SELECT MIN(created_at) FROM {src_schema_name}.{sales_table}),
+                              (SELECT MIN(updated_at) FROM {src_schema_name}.{dim_table});''')
+    return cursor.fetchone()
+
+
+def record_full_build(cursor, schema_name, table_name, src_schema_name, dim_table1, dim_table2):
+    """Store the source watermarks right after a full CREATE TABLE AS, as the baseline for later refreshes."""
+    ensure_watermark_table(cursor, schema_name)
+    sales_watermark, dim_watermark, _, _ = source_watermarks(cursor, src_schema_name, dim_table1, dim_table2)
+    set_watermarks(cursor, schema_name, table_name, sales_watermark, dim_watermark)
+
+
+def ensure_delta_table(cursor, schema_name, table_name, delta_table):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {schema_name}.{delta_table} AS SELECT 0::smallint AS sign, * FROM {schema_name}.{table_name} WITH NO DATA;")
+
+
+def _logged(statement, schema_name, delta_table, sign):
+    # run a DELETE/INSERT ... RETURNING * and copy the affected fact rows into the delta table
+    if not delta_table:
+        return statement
+    return f"WITH changed AS ({statement} RETURNING *) INSERT INTO {schema_name}.{delta_table} SELECT {sign}, * FROM changed"
+
+
+def refresh_fact(cursor, schema_name, table_name, columns, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2, fact_key_column,
+                 delta_table=None):
+    """Bring the fact up to date with the sales and dimension rows changed since the last build.
+
+    `fact_key_column` is the fact column holding the dimension key (customerid).
+    `delta_table`, when given, receives the signed changed rows.
+    Returns {'mode': 'incremental' | 'full', 'reason': None | 'first build' | 'sales reloaded', 'deleted': n, 'reinserted': n, 'appended': n};
+    with mode 'full' nothing was changed and the caller has to rebuild the table.
+    Run it inside one transaction so readers never see the deleted keys half reinserted.
+    """
+    ensure_watermark_table(cursor, schema_name)
+    watermarks = get_watermarks(cursor, schema_name, table_name)
+    sales_new, dim_new, sales_min, _ = source_watermarks(cursor, src_schema_name, dim_table1, dim_table2)
+    stats = {'mode': 'incremental', 'reason': None, 'deleted': 0, 'reinserted': 0, 'appended': 0}
+
+    cursor.execute("SELECT to_regclass(%s);", (f'{schema_name}.{table_name}',))
+    table_exists = cursor.fetchone()[0] is not None
+
+    if not table_exists or watermarks is None or watermarks[0] is None or sales_new is None:
+        stats['mode'], stats['reason'] = 'full', 'first build'
+        return stats
+    sales_watermark, dim_watermark = watermarks
+    if sales_min > sales_watermark:
+        # the sales table was truncated and reloaded: none of the fact rows can be matched to it any more
+        stats['mode'], stats['reason'] = 'full', 'sales reloaded'
+        return stats
+
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{fact_key_column}_idx ON {schema_name}.{table_name} ({fact_key_column});")
+    if delta_table:
+        ensure_delta_table(cursor, schema_name, table_name, delta_table)
+
+    dim_key = f"{src_schema_name}.{dim_table1}.{join_col_tbl1}"
+    sales_created = f"{src_schema_name}.{dim_table2}.created_at"
+    insert_into = f"INSERT INTO {schema_name}.{table_name} ({', '.join(column.split('.')[-1] for column in columns)}) "
+
+    # 1. late-arriving dimension changes: re-join the already processed sales of the changed keys
+    if dim_new is not None and dim_watermark is not None and dim_new > dim_watermark:
+        changed_keys = f"SELECT {join_col_tbl1} FROM {src_schema_name}.{dim_table1} WHERE updated_at > %s AND updated_at <= %s"
+        cursor.execute(_logged(f"DELETE FROM {schema_name}.{table_name} WHERE {fact_key_column} IN ({changed_keys})", schema_name, delta_table, -1),
+                       (dim_watermark, dim_new))
+        stats['deleted'] = cursor.rowcount
+        cursor.execute(_logged(insert_into + join_select(columns, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2,
+                                                         f"{dim_key} IN ({changed_keys}) AND {sales_created} <= %s"), schema_name, delta_table, 1),
+                       (dim_watermark, dim_new, sales_watermark))
+        stats['reinserted'] = cursor.rowcount
+
+    # 2. new sales rows: join and append
+    if sales_new > sales_watermark:
+        cursor.execute(_logged(insert_into + join_select(columns, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2,
+                                                         f"{sales_created} > %s AND {sales_created} <= %s"), schema_name, delta_table, 1),
+                       (sales_watermark, sales_new))
+        stats['appended'] = cursor.rowcount
+
+    set_watermarks(cursor, schema_name, table_name, sales_new, dim_new if dim_new is not None else dim_watermark)
+    return stats
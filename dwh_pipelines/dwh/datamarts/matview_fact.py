@@ -0,0 +1,47 @@
+# Materialized view backend for datamart facts.
+#
+# The fact is defined once as a materialized view over the same join SELECT the
+# table build uses, with a unique index on the source row keys. Later builds run
+# REFRESH MATERIALIZED VIEW CONCURRENTLY, which computes the new result aside and
+# applies the difference, so readers keep querying the old contents instead of
+# hitting the gap between DROP TABLE and the end of CREATE TABLE AS.
+# CONCURRENTLY needs the unique index and an already populated view; the first
+# build creates it. The source loaders truncate their tables instead of dropping
+# them in this mode (dwh/table_reload.py), so the view survives the tables stage.
+
+
+def relation_kind(cursor, schema_name, relation_name):
+    """'m' for a materialized view, 'r' for a table, 'p' for a partitioned table, 'v' for a view, None when missing."""
+    cursor.execute('''SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                      WHERE n.nspname = %s AND c.relname = %s;''', (schema_name, relation_name))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def create_fact_matview(cursor, schema_name, view_name, select_query, unique_columns):
+    cursor.execute(f"CREATE MATERIALIZED VIEW {schema_name}.{view_name} AS {select_query} WITH DATA;")
+    cursor.execute(f"CREATE UNIQUE INDEX {view_name}_uidx ON {schema_name}.{view_name} ({', '.join(unique_columns)});")
+
+
+def refresh_fact_matview(cursor, schema_name, view_name):
+    cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {schema_name}.{view_name};")
+
+
+def build_fact_matview(cursor, schema_name, view_name, select_query, unique_columns):
+    """Create the fact materialized view, or refresh it concurrently when it already exists.
+
+    A plain table of the same name (left by the table backend) is replaced.
+    `unique_columns` must identify a row of `select_query`.
+    Returns 'created' or 'refreshed'.
+    """
+    kind = relation_kind(cursor, schema_name, view_name)
+    if kind == 'm':
+        refresh_fact_matview(cursor, schema_name, view_name)
+        return 'refreshed'
+
+    if kind in ('r', 'p'):
+        cursor.execute(f"DROP TABLE {schema_name}.{view_name} CASCADE;")
+    elif kind == 'v':
+        cursor.execute(f"DROP VIEW {schema_name}.{view_name} CASCADE;")
+    create_fact_matview(cursor, schema_name, view_name, select_query, unique_columns)
+    return 'created'
@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from incremental_fact import join_select
+
+# Partitioned, parallel build of a datamart fact.
+#
+# The fact becomes a declaratively partitioned table, LIST partitioned by the
+# transaction month (one partition per transaction_date value, plus a DEFAULT one)
+# or HASH partitioned by customerid. The sales table is first split, in one
+# routed INSERT, into an unlogged copy partitioned the same way; every fact
+# partition is then filled by its own INSERT ... SELECT joining only its slice of
+# the sales to the customers, running concurrently on connections taken from a
+# pool, so the build uses one backend per partition instead of a single CREATE
+# TABLE AS and no job reads the sales of another partition. Rows go straight into
+# the partition, the parent does not have to route them.
+
+DEFAULT_WORKERS = 4
+DEFAULT_HASH_PARTITIONS = 8
+
+
+def column_definitions(cursor, select_query):
+    """'name type' definitions of the columns `select_query` returns, read from an empty temp table."""
+    cursor.execute("DROP TABLE IF EXISTS pg_temp.fact_columns;")
+    cursor.execute(f"CREATE TEMP TABLE fact_columns AS {select_query} WITH NO DATA;")
+    cursor.execute('''SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+                      WHERE attrelid = 'pg_temp.fact_columns'::regclass AND attnum > 0 AND NOT attisdropped
+                      ORDER BY attnum;''')
+    definitions = [f'{name} {sql_type}' for name, sql_type in cursor.fetchall()]
+    cursor.execute("DROP TABLE pg_temp.fact_columns;")
+    return definitions
+
+
+def month_partitions(cursor, src_schema_name, sales_table, month_column):
+    """(suffix, partition bound) per transaction month, plus the DEFAULT partition."""
+    cursor.execute(f"SELECT DISTINCT {month_column} FROM {src_schema_name}.{sales_table} WHERE {month_column} IS NOT NULL ORDER BY 1;")
+    months = [month for (month,) in cursor.fetchall()]
+
+    partitions = [(f'm{index:03d}', cursor.mogrify('FOR VALUES IN (%s)', (month,)).decode()) for index, month in enumerate(months)]
+    # NULL and months loaded after the partitions were laid out
+    partitions.append(('default', 'DEFAULT'))
+    return partitions
+
+
+def hash_partitions(modulus):
+    """(suffix, partition bound) per hash partition."""
+    return [(f'h{remainder:03d}', f'FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})') for remainder in range(modulus)]
+
+
+def split_source(cursor, src_schema_name, sales_table, source_parent, strategy, layout):
+    """Copy the sales table into `source_parent`, partitioned like the fact, in a single pass routed by Postgres."""
+    cursor.execute(f"DROP TABLE IF EXISTS {source_parent};")
+    cursor.execute(f"CREATE TABLE {source_parent} (LIKE {src_schema_name}.{sales_table}) PARTITION BY {strategy};")
+    for suffix, bound in layout:
+        # scratch copy, dropped once the fact is filled
+        cursor.execute(f"CREATE UNLOGGED TABLE {source_parent}_{suffix} PARTITION OF {source_parent} {bound};")
+    cursor.execute(f"INSERT INTO {source_parent} SELECT * FROM {src_schema_name}.{sales_table};")
+    cursor.execute(f"ANALYZE {source_parent};")
+
+
+def partition_select(columns, src_schema_name, dim_table1, join_col_tbl1, source_partition, dim_table2, join_col_tbl2):
+    """join_select() with the sales table replaced by one partition of its split copy (aliased to the sales table name)."""
+    return (f"SELECT {','.join(columns)} FROM {src_schema_name}.{dim_table1} JOIN {source_partition} AS {dim_table2} "
+            f"ON {src_schema_name}.{dim_table1}.{join_col_tbl1} = {dim_table2}.{join_col_tbl2}")
+
+
+def _build_partition(pool, insert_query, params=None):
+    connection = pool.getconn()
+    try:
+        connection.set_session(autocommit=True)
+        start_time = time.time()
+        with connection.cursor() as cursor:
+            cursor.execute(insert_query, params)
+            return cursor.rowcount, time.time() - start_time
+    finally:
+        pool.putconn(connection)
+
+
+def build_partitioned_fact(cursor, connection_params, schema_name, table_name, columns, src_schema_name, dim_table1, join_col_tbl1,
+                           dim_table2, join_col_tbl2, partition_by='month', partitions=DEFAULT_HASH_PARTITIONS, workers=DEFAULT_WORKERS,
+                           month_column='transaction_date'):
+    """Recreate the fact as a partitioned table and fill its partitions concurrently.
+
+    `cursor` (autocommit) lays out the parent and the partitions; the fills run on a
+    pool of `workers` connections. Returns [(partition table, rows, seconds)] in partition order.
+    """
+    select_query = join_select(columns, src_schema_name, dim_table1, join_col_tbl1, dim_table2, join_col_tbl2)
+    definitions = column_definitions(cursor, select_query)
+    parent = f'{schema_name}.{table_name}'
+
+    # the fact key and the sales column it comes from: customerid is the join column, transaction_date a sales column
+    if partition_by == 'hash':
+        key_column, source_key_column = join_col_tbl1, join_col_tbl2
+        strategy, source_strategy = f'HASH ({key_column})', f'HASH ({source_key_column})'
+    else:
+        key_column = source_key_column = month_column
+        strategy = source_strategy = f'LIST ({month_column})'
+
+    cursor.execute(f"DROP TABLE IF EXISTS {parent} CASCADE;")
+    cursor.execute(f"CREATE TABLE {parent} ({', '.join(definitions)}) PARTITION BY {strategy};")
+
+    if partition_by == 'hash':
+        layout = hash_partitions(partitions)
+    else:
+        layout = month_partitions(cursor, src_schema_name, dim_table2, month_column)
+
+    source_parent = f'{parent}_source'
+    split_source(cursor, src_schema_name, dim_table2, source_parent, source_strategy, layout)
+
+    jobs = []
+    for suffix, bound in layout:
+        partition_table = f'{parent}_{suffix}'
+        cursor.execute(f"CREATE TABLE {partition_table} PARTITION OF {parent} {bound};")
+        insert_query = (f"INSERT INTO {partition_table} ({', '.join(column.split('.')[-1] for column in columns)}) "
+                        + partition_select(columns, src_schema_name, dim_table1, join_col_tbl1, f'{source_parent}_{suffix}', dim_table2, join_col_tbl2))
+        jobs.append((partition_table, insert_query))
+
+    from psycopg2.pool import ThreadedConnectionPool
+    pool = ThreadedConnectionPool(1, max(1, min(workers, len(jobs))), **connection_params)
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(jobs))), thread_name_prefix=f'{table_name}_partition') as executor:
+            futures = [executor.submit(_build_partition, pool, insert_query) for _, insert_query in jobs]
+            timings = [(partition_table, *future.result()) for (partition_table, _), future in zip(jobs, futures)]
+    finally:
+        pool.closeall()
+        cursor.execute(f"DROP TABLE IF EXISTS {source_parent};")
+
+    cursor.execute(f"CREATE INDEX {table_name}_{key_column}_idx ON {parent} ({key_column});")
+    cursor.execute(f"ANALYZE {parent};")
+    return timings
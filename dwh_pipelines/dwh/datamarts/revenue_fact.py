@@ -0,0 +1,162 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from extract.oltp_extract import stream_query, DEFAULT_ITERSIZE
+from staging.copy_stream import copy_rows
+from star_schema import FULL_MONTHS, month_key
+
+# Revenue fact of the datamart: every sale with its tax and discount worked out.
+#
+#     gross_amount    = quantity * avg_price
+#     discount_amount = gross_amount * discount_pct / 100   (only when the coupon was 'Used')
+#     net_amount      = gross_amount - discount_amount
+#     tax_amount      = net_amount * gst
+#     invoice_amount  = net_amount + tax_amount + delivery_charges
+#
+# GST comes from tax_amount by product category, the discount from discount_coupon
+# by (month name, product category). Both tables have a few dozen rows, so the
+# 'vectorized' build loads them once into dicts and enriches streamed batches of
+# sales with array lookups: each distinct category / (month, category) of a batch
+# is looked up once and the result gathered back to its rows. The 'sql' build
+# pushes the same lookups down as one INSERT ... SELECT with the two small tables
+# joined in. Both write the same rows.
+
+FACT_REVENUE = 'fact_revenue'
+BUILD_MODES = ('vectorized', 'sql')
+
+FACT_REVENUE_COLUMNS = [
+    ('online_sale_id', 'integer PRIMARY KEY'),
+    ('customerid', 'varchar(255)'),
+    ('transaction_date', 'varchar(255)'),
+    ('product_category', 'varchar(255)'),
+    ('coupon_status', 'varchar(255)'),
+    ('quantity', 'integer'),
+    ('avg_price', 'numeric(10,4)'),
+    ('gst', 'numeric(6,4)'),
+    ('discount_pct', 'smallint'),
+    ('gross_amount', 'numeric(14,4)'),
+    ('discount_amount', 'numeric(14,4)'),
+    ('net_amount', 'numeric(14,4)'),
+    ('tax_amount', 'numeric(14,4)'),
+    ('delivery_charges', 'numeric(10,4)'),
+    ('invoice_amount', 'numeric(14,4)'),
+]
+FACT_REVENUE_COLUMN_NAMES = [name for name, _ in FACT_REVENUE_COLUMNS]
+
+SOURCE_COLUMNS = ['online_sale_id', 'customerid', 'transaction_date', 'product_category', 'coupon_status', 'quantity', 'avg_price', 'delivery_charges']
+
+
+def tax_rates_query(src_schema_name):
+    return f"SELECT product_category, MAX(gst)::numeric AS gst FROM {src_schema_name}.tax_amount WHERE product_category IS NOT NULL GROUP BY product_category"
+
+
+def discounts_query(src_schema_name):
+    # the first coupon of a (month, category), as in dim_coupons
+    return (f"SELECT DISTINCT ON (month, product_category) month, product_category, discount_pct FROM {src_schema_name}.discount_coupon "
+            f"WHERE month IS NOT NULL AND product_category IS NOT NULL ORDER BY month, product_category, coupon_id")
+
+
+def load_tax_rates(cursor, src_schema_name):
+    """{product_category: gst}"""
+    cursor.execute(tax_rates_query(src_schema_name))
+    return {product_category: float(gst) for product_category, gst in cursor.fetchall() if gst is not None}
+
+
+def load_discounts(cursor, src_schema_name):
+    """{(month name, product_category): discount_pct}"""
+    cursor.execute(discounts_query(src_schema_name))
+    return {(month, product_category): discount_pct for month, product_category, discount_pct in cursor.fetchall() if discount_pct is not None}
+
+
+def _floats(values):
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def _nullable(values, decimals=4):
+    return [None if np.isnan(value) else round(float(value), decimals) for value in values]
+
+
+def enrich_batch(batch, tax_rates, discounts):
+    """Revenue fact rows of a batch of SOURCE_COLUMNS rows."""
+    if not batch:
+        return []
+    online_sale_ids, customerids, transaction_dates, categories, coupon_statuses, quantities, avg_prices, delivery_charges = zip(*batch)
+
+    # every distinct category, and (month, category) pair, of the batch is looked up once
+    distinct_categories, category_codes = np.unique(['' if category is None else category for category in categories], return_inverse=True)
+    category_codes = category_codes.reshape(-1)
+    gst = np.array([tax_rates.get(category, np.nan) for category in distinct_categories], dtype=np.float64)[category_codes]
+
+    months = np.array([month_key(transaction_date) % 100 for transaction_date in transaction_dates], dtype=np.int64)
+    pairs, pair_codes = np.unique(months * len(distinct_categories) + category_codes, return_inverse=True)
+    pair_discounts = np.array([discounts.get((FULL_MONTHS[pair // len(distinct_categories) - 1] if pair // len(distinct_categories) else None,
+                                              distinct_categories[pair % len(distinct_categories)]), 0) for pair in pairs], dtype=np.float64)
+    used = np.array([status == 'Used' for status in coupon_statuses], dtype=bool)
+    discount_pct = np.where(used, pair_discounts[pair_codes.reshape(-1)], 0.0)
+
+    gross = _floats(quantities) * _floats(avg_prices)
+    discount = gross * discount_pct / 100
+    net = gross - discount
+    tax = net * gst
+    invoice = net + np.nan_to_num(tax) + np.nan_to_num(_floats(delivery_charges))
+
+    return list(zip(online_sale_ids, customerids, transaction_dates, categories, coupon_statuses, quantities, avg_prices,
+                    _nullable(gst), [int(value) for value in discount_pct],
+                    _nullable(gross), _nullable(discount), _nullable(net), _nullable(tax), delivery_charges, _nullable(invoice)))
+
+
+def recreate_fact_revenue(cursor, schema_name):
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
+    cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{FACT_REVENUE} CASCADE;")
+    cursor.execute(f"CREATE TABLE {schema_name}.{FACT_REVENUE} ({', '.join(f'{name} {sql_type}' for name, sql_type in FACT_REVENUE_COLUMNS)});")
+
+
+def build_fact_revenue_vectorized(connection, schema_name, src_schema_name, itersize=DEFAULT_ITERSIZE):
+    """Stream the sales, enrich each batch against the in-memory tax / discount maps and COPY it in.
+    `connection` must not be in autocommit mode; the caller commits. Returns the rows loaded."""
+    cursor = connection.cursor()
+    recreate_fact_revenue(cursor, schema_name)
+    tax_rates = load_tax_rates(cursor, src_schema_name)
+    discounts = load_discounts(cursor, src_schema_name)
+
+    rows_loaded = 0
+    query = f"SELECT {', '.join(SOURCE_COLUMNS)} FROM {src_schema_name}.online_sales"
+    for _, batch in stream_query(connection, query, itersize=itersize, cursor_name='fact_revenue_source'):
+        rows_loaded += copy_rows(cursor, f'{schema_name}.{FACT_REVENUE}', FACT_REVENUE_COLUMN_NAMES, enrich_batch(batch, tax_rates, discounts))
+    cursor.close()
+    return rows_loaded
+
+
+def fact_revenue_select(src_schema_name):
+    """The enrichment as one SELECT joining the sales to the tax and discount tables."""
+    months = ', '.join(f"({number}, '{name}')" for number, name in enumerate(FULL_MONTHS, start=1))
+    gross = "s.quantity * s.avg_price"
+    discount = f"{gross} * COALESCE(d.discount_pct, 0) / 100.0"
+    net = f"({gross} - {discount})"
+    tax = f"{net} * t.gst"
+    return f'''SELECT s.online_sale_id, s.customerid, s.transaction_date, s.product_category, s.coupon_status, s.quantity, s.avg_price,
+                      t.gst, COALESCE(d.discount_pct, 0),
+                      ROUND({gross}, 4), ROUND({discount}, 4), ROUND({net}, 4), ROUND({tax}, 4),
+                      s.delivery_charges, ROUND({net} + COALESCE({tax}, 0) + COALESCE(s.delivery_charges, 0), 4)
+               FROM {src_schema_name}.online_sales s
+               LEFT JOIN (VALUES {months}) AS months(month_number, month_name)
+                      ON months.month_number::text = ltrim(split_part(replace(s.transaction_date, '/', '-'), '-', 1), '0')
+               LEFT JOIN ({tax_rates_query(src_schema_name)}) AS t ON t.product_category = s.product_category
+               LEFT JOIN ({discounts_query(src_schema_name)}) AS d
+                      ON s.coupon_status = 'Used' AND d.month = months.month_name AND d.product_category = s.product_category'''
+
+
+def build_fact_revenue_sql(cursor, schema_name, src_schema_name):
+    """Build the revenue fact inside Postgres with one INSERT ... SELECT; returns the rows loaded."""
+    recreate_fact_revenue(cursor, schema_name)
+    cursor.execute(f"INSERT INTO {schema_name}.{FACT_REVENUE} ({', '.join(FACT_REVENUE_COLUMN_NAMES)}) {fact_revenue_select(src_schema_name)};")
+    return cursor.rowcount
+
+
+def index_fact_revenue(cursor, schema_name):
+    for column in ['customerid', 'product_category', 'transaction_date']:
+        cursor.execute(f"CREATE INDEX {FACT_REVENUE}_{column}_idx ON {schema_name}.{FACT_REVENUE} ({column});")
+    cursor.execute(f"ANALYZE {schema_name}.{FACT_REVENUE};")
@@ -0,0 +1,181 @@
+from itertools import combinations
+
+# Pre-aggregated rollups of a datamart fact, and an aggregate-aware query API.
+#
+# Every configured grouping set of the dimension columns gets its own table
+# (<fact>_by_<columns>, <fact>_total for the empty set) holding sales_count,
+# quantity and revenue per cell. A full build computes all of them with one
+# GROUPING SETS scan of the fact. An incremental refresh aggregates only the
+# signed change rows of the fact (<fact>_delta, +1 inserted / -1 deleted, written
+# by incremental_fact.refresh_fact) and merges them into the cells, so its cost
+# follows the delta. <schema>.rollup_catalog lists the rollups with their sizes;
+# query_aggregate answers a request from the smallest rollup that covers it.
+
+ROLLUP_CATALOG = 'rollup_catalog'
+DIMENSIONS = ['gender', 'location', 'product_category', 'transaction_date']
+
+# name, aggregate over the fact, aggregate over the signed delta rows
+MEASURES = [
+    ('sales_count', 'COUNT(*)', 'SUM(sign)'),
+    ('quantity', 'SUM(quantity)', 'SUM(sign * quantity)'),
+    ('revenue', 'SUM(quantity * avg_price)', 'SUM(sign * quantity * avg_price)'),
+]
+MEASURE_NAMES = [name for name, _, _ in MEASURES]
+
+
+def parse_grouping_sets(spec, dimensions=DIMENSIONS):
+    """'cube' -> every subset of the dimensions; 'a,b;a;' -> [['a', 'b'], ['a'], []]"""
+    if spec.strip().lower() == 'cube':
+        return [list(columns) for size in range(len(dimensions), -1, -1) for columns in combinations(dimensions, size)]
+    sets = []
+    for item in spec.split(';'):
+        columns = [column.strip() for column in item.split(',') if column.strip()]
+        unknown = set(columns) - set(dimensions)
+        if unknown:
+            raise ValueError(f"Unknown rollup columns {sorted(unknown)}, expected a subset of {dimensions}")
+        if columns not in sets:
+            sets.append(columns)
+    return sets
+
+
+def rollup_name(fact_table, columns):
+    return f"{fact_table}_by_{'_'.join(columns)}" if columns else f"{fact_table}_total"
+
+
+def grouping_id(columns, dimensions=DIMENSIONS):
+    # bit i (from the left) of GROUPING(d1, ..., dn) is set when d(i) is not grouped
+    return sum(1 << (len(dimensions) - 1 - index) for index, dimension in enumerate(dimensions) if dimension not in columns)
+
+
+def grouping_sets_select(source, sets, delta=False, dimensions=DIMENSIONS):
+    """One scan of `source` aggregated at every grouping set, tagged with its grouping_id."""
+    measures = ', '.join(f"{delta_sql if delta else fact_sql} AS {name}" for name, fact_sql, delta_sql in MEASURES)
+    grouping_sets = ', '.join(f"({', '.join(columns)})" for columns in sets)
+    return (f"SELECT GROUPING({', '.join(dimensions)}) AS grouping_id, {', '.join(dimensions)}, {measures} "
+            f"FROM {source} GROUP BY GROUPING SETS ({grouping_sets})")
+
+
+def ensure_catalog(cursor, schema_name):
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS {schema_name}.{ROLLUP_CATALOG} (
+        rollup_name varchar(255) PRIMARY KEY,
+        fact_table varchar(255),
+        group_columns text[],
+        row_count bigint,
+        refreshed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );''')
+
+
+def _register(cursor, schema_name, fact_table, columns):
+    name = rollup_name(fact_table, columns)
+    cursor.execute(f"SELECT COUNT(*) FROM {schema_name}.{name};")
+    row_count = cursor.fetchone()[0]
+    cursor.execute(f'''INSERT INTO {schema_name}.{ROLLUP_CATALOG} (rollup_name, fact_table, group_columns, row_count, refreshed_at)
+                       VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                       ON CONFLICT (rollup_name) DO UPDATE SET group_columns = EXCLUDED.group_columns,
+                                                               row_count = EXCLUDED.row_count,
+                                                               refreshed_at = EXCLUDED.refreshed_at;''',
+                   (name, fact_table, columns, row_count))
+    return row_count
+
+
+def build_rollups(cursor, schema_name, fact_table, sets, dimensions=DIMENSIONS):
+    """Rebuild every rollup from one GROUPING SETS scan of the fact; returns {rollup name: rows}."""
+    ensure_catalog(cursor, schema_name)
+    cursor.execute(f"DELETE FROM {schema_name}.{ROLLUP_CATALOG} WHERE fact_table = %s;", (fact_table,))
+    cursor.execute(f"DROP TABLE IF EXISTS pg_temp.rollup_cells; CREATE TEMP TABLE rollup_cells AS {grouping_sets_select(f'{schema_name}.{fact_table}', sets, dimensions=dimensions)};")
+
+    built = {}
+    for columns in sets:
+        name = rollup_name(fact_table, columns)
+        selected = ', '.join(columns + MEASURE_NAMES)
+        cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{name};")
+        cursor.execute(f"CREATE TABLE {schema_name}.{name} AS SELECT {selected} FROM rollup_cells WHERE grouping_id = {grouping_id(columns, dimensions)};")
+        if columns:
+            cursor.execute(f"CREATE INDEX {name}_idx ON {schema_name}.{name} ({', '.join(columns)});")
+        built[name] = _register(cursor, schema_name, fact_table, columns)
+    cursor.execute("DROP TABLE rollup_cells;")
+    return built
+
+
+def refresh_rollups(cursor, schema_name, fact_table, delta_table, sets, dimensions=DIMENSIONS):
+    """Merge the signed rows of `delta_table` into every rollup, then empty it; returns {rollup name: rows}.
+
+    Falls back to build_rollups when a rollup is missing (first run or new grouping sets).
+    """
+    ensure_catalog(cursor, schema_name)
+    cursor.execute(f"SELECT rollup_name FROM {schema_name}.{ROLLUP_CATALOG} WHERE fact_table = %s;", (fact_table,))
+    existing = {name for (name,) in cursor.fetchall()}
+    cursor.execute("SELECT to_regclass(%s);", (f'{schema_name}.{delta_table}',))
+    if cursor.fetchone()[0] is None or any(rollup_name(fact_table, columns) not in existing for columns in sets):
+        built = build_rollups(cursor, schema_name, fact_table, sets, dimensions)
+        cursor.execute("SELECT to_regclass(%s);", (f'{schema_name}.{delta_table}',))
+        if cursor.fetchone()[0] is not None:
+            cursor.execute(f"TRUNCATE {schema_name}.{delta_table};")
+        return built
+
+    cursor.execute(f"DROP TABLE IF EXISTS pg_temp.rollup_delta; CREATE TEMP TABLE rollup_delta AS {grouping_sets_select(f'{schema_name}.{delta_table}', sets, delta=True, dimensions=dimensions)};")
+
+    refreshed = {}
+    for columns in sets:
+        name = rollup_name(fact_table, columns)
+        matches = ' AND '.join(f"{name}.{column} IS NOT DISTINCT FROM d.{column}" for column in columns) or 'TRUE'
+        delta_cells = f"SELECT * FROM rollup_delta WHERE grouping_id = {grouping_id(columns, dimensions)}"
+
+        cursor.execute(f'''UPDATE {schema_name}.{name} SET {', '.join(f"{measure} = {name}.{measure} + d.{measure}" for measure in MEASURE_NAMES)}
+                           FROM ({delta_cells}) AS d WHERE {matches};''')
+        cursor.execute(f'''INSERT INTO {schema_name}.{name} ({', '.join(columns + MEASURE_NAMES)})
+                           SELECT {', '.join(f'd.{column}' for column in columns + MEASURE_NAMES)} FROM ({delta_cells}) AS d
+                           WHERE NOT EXISTS (SELECT 1 FROM {schema_name}.{name} WHERE {matches});''')
+        cursor.execute(f"DELETE FROM {schema_name}.{name} WHERE sales_count = 0;")
+        refreshed[name] = _register(cursor, schema_name, fact_table, columns)
+
+    cursor.execute(f"DROP TABLE rollup_delta; TRUNCATE {schema_name}.{delta_table};")
+    return refreshed
+
+
+def route(cursor, schema_name, fact_table, needed_columns):
+    """The smallest rollup grouping at least `needed_columns`, or the fact table itself; returns (table, is_rollup)."""
+    cursor.execute("SELECT to_regclass(%s);", (f'{schema_name}.{ROLLUP_CATALOG}',))
+    if cursor.fetchone()[0] is not None:
+        cursor.execute(f'''SELECT rollup_name FROM {schema_name}.{ROLLUP_CATALOG}
+                           WHERE fact_table = %s AND group_columns @> %s::text[]
+                           ORDER BY row_count LIMIT 1;''', (fact_table, sorted(needed_columns)))
+        row = cursor.fetchone()
+        if row:
+            return row[0], True
+    return fact_table, False
+
+
+def aggregate_query(cursor, group_by, measures=MEASURE_NAMES, filters=None, schema_name='datamart', fact_table='customers_sales'):
+    """(query, params, table used) aggregating `measures` of the fact by `group_by`,
+    with optional {column: value or list of values} filters.
+
+    The query reads the smallest rollup holding every group-by and filter column
+    (summing its cells), or the fact table when none does.
+    """
+    filters = filters or {}
+    table, is_rollup = route(cursor, schema_name, fact_table, set(group_by) | set(filters))
+    aggregates = {name: (f"SUM({name})" if is_rollup else fact_sql) for name, fact_sql, _ in MEASURES}
+
+    conditions, params = [], []
+    for column, value in filters.items():
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f"{column} = ANY(%s)")
+            params.append(sorted(value))
+        else:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+
+    query = f"SELECT {', '.join(list(group_by) + [f'{aggregates[name]} AS {name}' for name in measures])} FROM {schema_name}.{table}"
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+    if group_by:
+        query += f" GROUP BY {', '.join(group_by)} ORDER BY {', '.join(group_by)}"
+    return query, params, table
+
+
+def query_aggregate(cursor, group_by, measures=MEASURE_NAMES, filters=None, schema_name='datamart', fact_table='customers_sales'):
+    """Run aggregate_query; returns (headers, rows, table used)."""
+    query, params, table = aggregate_query(cursor, group_by, measures, filters, schema_name, fact_table)
+    cursor.execute(query, params)
+    return list(group_by) + list(measures), cursor.fetchall(), table
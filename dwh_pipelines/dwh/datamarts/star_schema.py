@@ -0,0 +1,208 @@
+import os
+import sys
+import calendar
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from extract.oltp_extract import stream_query, DEFAULT_ITERSIZE
+from staging.copy_stream import copy_rows
+
+# Star schema of the datamart: customer, product category, date and coupon
+# dimensions with int4 surrogate keys, and datamart.fact_sales whose rows are
+# narrow tuples of those keys plus the sales measures.
+#
+# The fact loader reads every dimension once into an in-process lookup cache
+# (natural key -> surrogate key dict) and resolves the keys of each streamed batch
+# of sales rows in Python, so the sales history is never joined against the
+# varchar dimension attributes in SQL. Key 0 of every dimension is the 'Unknown'
+# member that unmatched natural keys resolve to.
+
+UNKNOWN_KEY = 0
+FULL_MONTHS = list(calendar.month_name)[1:]
+
+DIM_CUSTOMERS = 'dim_customers'
+DIM_PRODUCT_CATEGORIES = 'dim_product_categories'
+DIM_DATES = 'dim_dates'
+DIM_COUPONS = 'dim_coupons'
+FACT_SALES = 'fact_sales'
+
+
+def _recreate(cursor, schema_name, table_name, columns_ddl):
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
+    cursor.execute(f"DROP TABLE IF EXISTS {schema_name}.{table_name} CASCADE;")
+    cursor.execute(f"CREATE TABLE {schema_name}.{table_name} ({columns_ddl});")
+
+
+def _row_count(cursor, schema_name, table_name):
+    cursor.execute(f"SELECT COUNT(*) FROM {schema_name}.{table_name};")
+    return cursor.fetchone()[0]
+
+
+def build_dim_customers(cursor, schema_name, src_schema_name):
+    """One row per customerid (latest version by updated_at); returns the number of rows."""
+    _recreate(cursor, schema_name, DIM_CUSTOMERS, '''
+        customer_key integer PRIMARY KEY,
+        customerid varchar(255) UNIQUE,
+        gender varchar(16),
+        location varchar(255),
+        tenure_months integer''')
+    cursor.execute(f"INSERT INTO {schema_name}.{DIM_CUSTOMERS} VALUES ({UNKNOWN_KEY}, NULL, 'Unknown', 'Unknown', NULL);")
+    cursor.execute(f'''INSERT INTO {schema_name}.{DIM_CUSTOMERS} (customer_key, customerid, gender, location, tenure_months)
+                       SELECT row_number() OVER (ORDER BY customerid)::integer, customerid, gender, location, tenure_months
+                       FROM (SELECT DISTINCT ON (customerid) customerid, gender, location, tenure_months
+                             FROM {src_schema_name}.customers_data
+                             WHERE customerid IS NOT NULL
+                             ORDER BY customerid, updated_at DESC) AS latest;''')
+    return _row_count(cursor, schema_name, DIM_CUSTOMERS)
+
+
+def build_dim_product_categories(cursor, schema_name, src_schema_name):
+    """Every category seen in sales, tax or coupons, with its GST rate; returns the number of rows."""
+    _recreate(cursor, schema_name, DIM_PRODUCT_CATEGORIES, '''
+        product_category_key integer PRIMARY KEY,
+        product_category varchar(255) UNIQUE,
+        gst float''')
+    cursor.execute(f"INSERT INTO {schema_name}.{DIM_PRODUCT_CATEGORIES} VALUES ({UNKNOWN_KEY}, NULL, NULL);")
+    cursor.execute(f'''INSERT INTO {schema_name}.{DIM_PRODUCT_CATEGORIES} (product_category_key, product_category, gst)
+                       SELECT row_number() OVER (ORDER BY categories.product_category)::integer, categories.product_category, tax.gst
+                       FROM (SELECT product_category FROM {src_schema_name}.online_sales
+                             UNION SELECT product_category FROM {src_schema_name}.tax_amount
+                             UNION SELECT product_category FROM {src_schema_name}.discount_coupon) AS categories
+                       LEFT JOIN (SELECT product_category, MAX(gst) AS gst FROM {src_schema_name}.tax_amount GROUP BY product_category) AS tax
+                              ON tax.product_category = categories.product_category
+                       WHERE categories.product_category IS NOT NULL;''')
+    return _row_count(cursor, schema_name, DIM_PRODUCT_CATEGORIES)
+
+
+def month_key(transaction_date):
+    """Surrogate date key (YYYYMM) of a transaction_date, which the transform stage
+    formats as 'M-YYYY' ('M/D/YYYY' when the source was loaded unformatted); 0 when unparseable."""
+    if not transaction_date:
+        return UNKNOWN_KEY
+    parts = transaction_date.replace('/', '-').split('-')
+    if len(parts) < 2:
+        return UNKNOWN_KEY
+    try:
+        month, year = int(parts[0]), int(parts[-1])
+    except ValueError:
+        return UNKNOWN_KEY
+    if not 1 <= month <= 12:
+        return UNKNOWN_KEY
+    return year * 100 + month
+
+
+def build_dim_dates(cursor, schema_name, src_schema_name):
+    """Month calendar covering all sales (the grain of transaction_date); returns the number of rows."""
+    _recreate(cursor, schema_name, DIM_DATES, '''
+        date_key integer PRIMARY KEY,
+        year smallint,
+        quarter smallint,
+        month smallint,
+        month_name varchar(16),
+        first_day date''')
+    cursor.execute(f"INSERT INTO {schema_name}.{DIM_DATES} VALUES ({UNKNOWN_KEY}, NULL, NULL, NULL, 'Unknown', NULL);")
+
+    cursor.execute(f"SELECT DISTINCT transaction_date FROM {src_schema_name}.online_sales;")
+    keys = {month_key(transaction_date) for (transaction_date,) in cursor.fetchall()} - {UNKNOWN_KEY}
+    if keys:
+        months = []
+        year, month = divmod(min(keys), 100)
+        while year * 100 + month <= max(keys):
+            months.append((year * 100 + month, year, (month - 1) // 3 + 1, month, FULL_MONTHS[month - 1], f'{year}-{month:02d}-01'))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        copy_rows(cursor, f'{schema_name}.{DIM_DATES}', ['date_key', 'year', 'quarter', 'month', 'month_name', 'first_day'], months)
+    return _row_count(cursor, schema_name, DIM_DATES)
+
+
+def build_dim_coupons(cursor, schema_name, src_schema_name):
+    """One coupon per (month name, product category); returns the number of rows."""
+    _recreate(cursor, schema_name, DIM_COUPONS, '''
+        coupon_key integer PRIMARY KEY,
+        month varchar(16),
+        product_category varchar(255),
+        coupon_code varchar(255),
+        discount_pct smallint,
+        UNIQUE (month, product_category)''')
+    cursor.execute(f"INSERT INTO {schema_name}.{DIM_COUPONS} VALUES ({UNKNOWN_KEY}, NULL, NULL, 'Unknown', 0);")
+    cursor.execute(f'''INSERT INTO {schema_name}.{DIM_COUPONS} (coupon_key, month, product_category, coupon_code, discount_pct)
+                       SELECT row_number() OVER (ORDER BY product_category, month)::integer, month, product_category, coupon_code, discount_pct
+                       FROM (SELECT DISTINCT ON (month, product_category) month, product_category, coupon_code, discount_pct
+                             FROM {src_schema_name}.discount_coupon
+                             WHERE month IS NOT NULL AND product_category IS NOT NULL
+                             ORDER BY month, product_category, coupon_id) AS coupons;''')
+    return _row_count(cursor, schema_name, DIM_COUPONS)
+
+
+def load_key_cache(cursor, schema_name, dim_table, key_column, natural_columns):
+    """{natural key: surrogate key} of a dimension; composite natural keys become tuples."""
+    cursor.execute(f"SELECT {key_column}, {', '.join(natural_columns)} FROM {schema_name}.{dim_table} WHERE {key_column} <> {UNKNOWN_KEY};")
+    if len(natural_columns) == 1:
+        return {row[1]: row[0] for row in cursor.fetchall()}
+    return {tuple(row[1:]): row[0] for row in cursor.fetchall()}
+
+
+def load_key_caches(cursor, schema_name):
+    # date keys are computed from transaction_date (YYYYMM), their cache only checks membership
+    cursor.execute(f"SELECT date_key FROM {schema_name}.{DIM_DATES} WHERE date_key <> {UNKNOWN_KEY};")
+    date_keys = {date_key for (date_key,) in cursor.fetchall()}
+    return {
+        'customer': load_key_cache(cursor, schema_name, DIM_CUSTOMERS, 'customer_key', ['customerid']),
+        'product_category': load_key_cache(cursor, schema_name, DIM_PRODUCT_CATEGORIES, 'product_category_key', ['product_category']),
+        'date': date_keys,
+        'coupon': load_key_cache(cursor, schema_name, DIM_COUPONS, 'coupon_key', ['month', 'product_category']),
+    }
+
+
+def resolve_fact_rows(batch, caches, misses):
+    """Map sales rows to fact rows of surrogate keys; unmatched natural keys count in `misses` and resolve to 0."""
+    customers, categories, dates, coupons = caches['customer'], caches['product_category'], caches['date'], caches['coupon']
+    for online_sale_id, customerid, transaction_date, product_category, coupon_status, quantity, avg_price, delivery_charges in batch:
+        customer_key = customers.get(customerid, UNKNOWN_KEY)
+        product_category_key = categories.get(product_category, UNKNOWN_KEY)
+        date_key = month_key(transaction_date)
+        if date_key not in dates:
+            date_key = UNKNOWN_KEY
+
+        # a coupon only applies to the sale when it was used
+        coupon_key = None
+        if coupon_status == 'Used':
+            month_name = FULL_MONTHS[date_key % 100 - 1] if date_key else None
+            coupon_key = coupons.get((month_name, product_category), UNKNOWN_KEY)
+            misses['coupon'] += coupon_key == UNKNOWN_KEY
+
+        misses['customer'] += customer_key == UNKNOWN_KEY
+        misses['product_category'] += product_category_key == UNKNOWN_KEY
+        misses['date'] += date_key == UNKNOWN_KEY
+        yield online_sale_id, customer_key, product_category_key, date_key, coupon_key, quantity, avg_price, delivery_charges
+
+
+def build_fact_sales(connection, schema_name, src_schema_name, itersize=DEFAULT_ITERSIZE):
+    """Rebuild datamart.fact_sales from the sales rows, resolving surrogate keys through the dimension caches.
+
+    `connection` must not be in autocommit mode (the sales are read through a named cursor);
+    the caller commits. Returns (rows loaded, {dimension: unmatched rows}).
+    """
+    cursor = connection.cursor()
+    _recreate(cursor, schema_name, FACT_SALES, f'''
+        online_sale_id integer PRIMARY KEY,
+        customer_key integer NOT NULL REFERENCES {schema_name}.{DIM_CUSTOMERS},
+        product_category_key integer NOT NULL REFERENCES {schema_name}.{DIM_PRODUCT_CATEGORIES},
+        date_key integer NOT NULL REFERENCES {schema_name}.{DIM_DATES},
+        coupon_key integer REFERENCES {schema_name}.{DIM_COUPONS},
+        quantity integer,
+        avg_price numeric(10,4),
+        delivery_charges numeric(10,4)''')
+
+    caches = load_key_caches(cursor, schema_name)
+    misses = dict.fromkeys(caches, 0)
+    fact_columns = ['online_sale_id', 'customer_key', 'product_category_key', 'date_key', 'coupon_key', 'quantity', 'avg_price', 'delivery_charges']
+
+    rows_loaded = 0
+    query = (f"SELECT online_sale_id, customerid, transaction_date, product_category, coupon_status, quantity, avg_price, delivery_charges "
+             f"FROM {src_schema_name}.online_sales")
+    for _, batch in stream_query(connection, query, itersize=itersize, cursor_name='fact_sales_source'):
+        rows_loaded += copy_rows(cursor, f'{schema_name}.{FACT_SALES}', fact_columns, resolve_fact_rows(batch, caches, misses))
+
+    for key_column in ['customer_key', 'product_category_key', 'date_key', 'coupon_key']:
+        cursor.execute(f"CREATE INDEX {FACT_SALES}_{key_column}_idx ON {schema_name}.{FACT_SALES} ({key_column});")
+    cursor.close()
+    return rows_loaded, misses
@@ -0,0 +1,83 @@
+# How the tbl_* loaders of the fact sources replace their rows.
+#
+# A loader drops and recreates its table (DROP TABLE ... CASCADE) by default,
+# which also drops every object built on it. The materialized view backend of
+# datamart.customers_sales (FACT_BUILD_MODE=matview) has to outlive the tables
+# stage, or the facts stage can never refresh it concurrently and readers lose
+# the fact in between: in that mode the loaders keep their table and TRUNCATE it
+# before the reload, and check that no materialized view was lost on the way.
+# The incremental backend (FACT_BUILD_MODE=incremental) follows the created_at /
+# updated_at lineage of the source rows, which a reload from scratch resets for
+# every row: there the loaders insert into a temp table and merge it into the
+# kept table instead. Rows already present keep their lineage, new rows are
+# appended and rows whose values changed get the updated_at of the reload.
+
+RELOAD_MODES = {
+    'matview': 'truncate',
+    'incremental': 'merge',
+}
+
+LINEAGE_COLUMNS = ['created_at', 'updated_at', 'source']
+
+
+def reload_mode(fact_build_mode):
+    """'drop', 'truncate' or 'merge': how a fact source loader replaces its rows under FACT_BUILD_MODE."""
+    return RELOAD_MODES.get(fact_build_mode, 'drop')
+
+
+def dependent_matviews(cursor, schema_name, table_name):
+    """Sorted 'schema.view' names of the materialized views reading schema_name.table_name."""
+    cursor.execute('''SELECT DISTINCT v.oid::regclass::text
+                      FROM pg_depend d
+                      JOIN pg_rewrite r ON r.oid = d.objid
+                      JOIN pg_class v ON v.oid = r.ev_class AND v.relkind = 'm'
+                      WHERE d.classid = 'pg_rewrite'::regclass AND d.refobjid = to_regclass(%s)
+                      ORDER BY 1;''', (f'{schema_name}.{table_name}',))
+    return [view for (view,) in cursor.fetchall()]
+
+
+def truncate_table(cursor, schema_name, table_name):
+    """Empty the table in place, restarting its SERIAL ids so a reload numbers its rows as a fresh table would."""
+    cursor.execute(f"TRUNCATE {schema_name}.{table_name} RESTART IDENTITY;")
+
+
+def check_matviews_kept(cursor, schema_name, table_name, matviews):
+    """Raise when a materialized view of `matviews` (as listed before the reload) no longer reads the table."""
+    lost = sorted(set(matviews) - set(dependent_matviews(cursor, schema_name, table_name)))
+    if lost:
+        raise RuntimeError(f"Reloading {schema_name}.{table_name} dropped the materialized view(s) {', '.join(lost)}")
+
+
+def create_load_table(cursor, schema_name, table_name, columns):
+    """Empty temp table pg_temp.<table_name>_load with `columns` and the lineage columns of the table, for the rows of a merge reload;
+    returns its name."""
+    load_table_name = f'{table_name}_load'
+    cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{load_table_name};")
+    cursor.execute(f"CREATE TEMP TABLE {load_table_name} AS SELECT {', '.join(list(columns) + LINEAGE_COLUMNS)} FROM {schema_name}.{table_name} WITH NO DATA;")
+    return load_table_name
+
+
+def merge_load_table(cursor, schema_name, table_name, load_table_name, key_columns, value_columns=()):
+    """Merge pg_temp.load_table_name into the table; returns (rows inserted, rows updated).
+
+    Rows with a key not in the table are appended. Rows whose `value_columns` changed
+    take the new values with the updated_at and source of the reload. Unchanged rows
+    keep their lineage, and rows missing from the reload are kept (the sources are
+    append-only histories).
+    """
+    target = f'{schema_name}.{table_name}'
+    key_match = ' AND '.join(f"t.{column} = l.{column}" for column in key_columns)
+
+    updated = 0
+    if value_columns:
+        assignments = ', '.join(f"{column} = l.{column}" for column in list(value_columns) + ['updated_at', 'source'])
+        changed = (f"({', '.join(f't.{column}' for column in value_columns)}) IS DISTINCT FROM "
+                   f"({', '.join(f'l.{column}' for column in value_columns)})")
+        cursor.execute(f"UPDATE {target} AS t SET {assignments} FROM pg_temp.{load_table_name} AS l WHERE {key_match} AND {changed};")
+        updated = cursor.rowcount
+
+    columns = list(key_columns) + list(value_columns) + LINEAGE_COLUMNS
+    cursor.execute(f'''INSERT INTO {target} ({', '.join(columns)})
+                       SELECT {', '.join(f'l.{column}' for column in columns)} FROM pg_temp.{load_table_name} AS l
+                       WHERE NOT EXISTS (SELECT 1 FROM {target} AS t WHERE {key_match});''')
+    return cursor.rowcount, updated
@@ -0,0 +1,74 @@
+import os
+import threading
+
+# Direct OLTP -> DWH transfer: `COPY (SELECT ...) TO STDOUT` on the source
+# connection is streamed through an OS pipe into `COPY ... FROM STDIN` on the
+# destination connection. The producer runs in a background thread, the pipe
+# bounds the data in flight, and no Python row objects or intermediate files are created.
+
+DEFAULT_PIPE_BUFFER = 1 << 20
+
+
+class _PipeReader:
+    """Read end of the transfer pipe handed to copy_expert on the destination.
+
+    At end of stream it waits for the producer and re-raises its error, which
+    makes psycopg2 abort the COPY FROM instead of committing a partial table.
+    """
+
+    def __init__(self, pipe_in, producer, errors):
+        self._pipe_in = pipe_in
+        self._producer = producer
+        self._errors = errors
+
+    def read(self, size=-1):
+        data = self._pipe_in.read(size)
+        if not data:
+            self._producer.join()
+            if self._errors:
+                raise self._errors[0]
+        return data
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def copy_between(src_connection, dst_connection, copy_out_sql, copy_in_sql, buffer_size=DEFAULT_PIPE_BUFFER):
+    """Pipe a COPY TO STDOUT on src_connection into a COPY FROM STDIN on dst_connection.
+
+    Returns the number of rows copied into the destination.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        pipe_out = os.fdopen(write_fd, 'wb', buffering=buffer_size)
+        try:
+            with src_connection.cursor() as cursor:
+                cursor.copy_expert(copy_out_sql, pipe_out, buffer_size)
+        except Exception as err:
+            # recorded before the pipe is closed, so the reader sees it at end of stream
+            errors.append(err)
+        finally:
+            try:
+                pipe_out.close()
+            except OSError:
+                # the destination stopped reading, its own error is what gets reported
+                pass
+
+    producer = threading.Thread(target=produce, name='copy_transfer_producer', daemon=True)
+    producer.start()
+
+    try:
+        with os.fdopen(read_fd, 'rb', buffering=buffer_size) as pipe_in, dst_connection.cursor() as cursor:
+            cursor.copy_expert(copy_in_sql, _PipeReader(pipe_in, producer, errors), buffer_size)
+            return cursor.rowcount
+    finally:
+        producer.join()
+
+
+def transfer_table(src_connection, dst_connection, src_select, dst_table, dst_columns, buffer_size=DEFAULT_PIPE_BUFFER):
+    """Copy the rows of `src_select` (run on the OLTP side) into dst_table(dst_columns) on the DWH side."""
+    copy_out_sql = f"COPY ({src_select}) TO STDOUT"
+    copy_in_sql = f"COPY {dst_table} ({', '.join(dst_columns)}) FROM STDIN"
+    return copy_between(src_connection, dst_connection, copy_out_sql, copy_in_sql, buffer_size)
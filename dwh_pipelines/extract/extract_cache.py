@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import configparser
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from extract.oltp_extract import build_select, extract_to_json, DEFAULT_ITERSIZE
+
+# Extraction result cache shared by every stage of a pipeline run.
+#
+# An entry is keyed by source table, column list, predicate and a snapshot of
+# the source (max of a snapshot column + row count), and holds the staged JSON
+# file plus a small .meta.json next to it. Repeated extractions of an unchanged
+# table within the TTL are served by copying the cached staged file.
+# Updates that change neither the snapshot column nor the row count are only
+# picked up once the TTL expires, or after invalidate().
+
+DEFAULT_CACHE_DIR = 'extract_cache'
+DEFAULT_TTL = 3600
+
+
+def cache_settings(config):
+    """(cache_dir, ttl) from local_config.ini."""
+    return (config['data_filepath'].get('EXTRACT_CACHE_DIR', DEFAULT_CACHE_DIR),
+            int(config['data_filepath'].get('EXTRACT_CACHE_TTL', DEFAULT_TTL)))
+
+
+def source_snapshot(cursor, schema_name, table_name, snapshot_column=None, predicate=None):
+    """Cheap fingerprint of the source rows: row count, plus max(snapshot_column) when given."""
+    aggregates = ['COUNT(*)']
+    if snapshot_column:
+        aggregates.append(f'MAX({snapshot_column})')
+    cursor.execute(build_select(schema_name, table_name, aggregates, predicate))
+    return [str(value) for value in cursor.fetchone()]
+
+
+def cache_key(schema_name, table_name, columns, predicate, snapshot):
+    key = json.dumps({
+        'table': f'{schema_name}.{table_name}',
+        'columns': list(columns),
+        'predicate': predicate,
+        'snapshot': snapshot,
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _entry_paths(cache_dir, key):
+    return os.path.join(cache_dir, f'{key}.json'), os.path.join(cache_dir, f'{key}.meta.json')
+
+
+def lookup(cache_dir, key, ttl=DEFAULT_TTL):
+    """Return the metadata of a live cache entry, or None (expired entries are removed)."""
+    data_path, meta_path = _entry_paths(cache_dir, key)
+    try:
+        with open(meta_path, encoding='utf-8') as metaf:
+            meta = json.load(metaf)
+    except (OSError, ValueError):
+        return None
+
+    if time.time() - meta['created_at'] > ttl or not os.path.exists(data_path):
+        _remove_entry(cache_dir, key)
+        return None
+
+    return meta
+
+
+def store(cache_dir, key, table, write_fn):
+    """Create a cache entry; `write_fn(path)` writes the staged file to `path`."""
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path, meta_path = _entry_paths(cache_dir, key)
+
+    temp_path = f'{data_path}.{os.getpid()}.tmp'
+    try:
+        row_count = write_fn(temp_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, data_path)
+
+    with open(f'{meta_path}.{os.getpid()}.tmp', 'w', encoding='utf-8') as metaf:
+        json.dump({'table': table, 'rows': row_count, 'created_at': time.time()}, metaf)
+    os.replace(f'{meta_path}.{os.getpid()}.tmp', meta_path)
+
+    return row_count
+
+
+def _remove_entry(cache_dir, key):
+    for path in _entry_paths(cache_dir, key):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def invalidate(cache_dir=DEFAULT_CACHE_DIR, table=None):
+    """Drop the cached extractions of `table` ('schema.table'), or every entry when table is None.
+
+    Returns the number of entries removed.
+    """
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    removed = 0
+    for filename in os.listdir(cache_dir):
+        if not filename.endswith('.meta.json'):
+            continue
+        key = filename[:-len('.meta.json')]
+        if table is not None:
+            try:
+                with open(os.path.join(cache_dir, filename), encoding='utf-8') as metaf:
+                    if json.load(metaf)['table'] != table:
+                        continue
+            except (OSError, ValueError):
+                pass
+        _remove_entry(cache_dir, key)
+        removed += 1
+
+    return removed
+
+
+def cached_extract(connection, schema_name, table_name, columns, jsonFilePath, predicate=None, snapshot_column=None,
+                   cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, itersize=DEFAULT_ITERSIZE, cursor_name='oltp_extract', extract_fn=None):
+    """Extract a source table into jsonFilePath, reusing a cached extraction when the source is unchanged.
+
+    Run it in a REPEATABLE READ transaction so the snapshot and the extraction see the same rows.
+    `extract_fn(path)` replaces the default single-cursor extraction on a cache miss.
+    With cache_dir=None the cache is bypassed: the table is extracted straight into jsonFilePath.
+    Returns (row_count, cache_hit).
+    """
+    if extract_fn is None:
+        query = build_select(schema_name, table_name, columns, predicate)
+        extract_fn = lambda path: extract_to_json(connection, query, path, itersize=itersize, cursor_name=cursor_name)
+    if cache_dir is None:
+        return extract_fn(jsonFilePath), False
+
+    with connection.cursor() as cursor:
+        snapshot = source_snapshot(cursor, schema_name, table_name, snapshot_column, predicate)
+
+    key = cache_key(schema_name, table_name, columns, predicate, snapshot)
+    meta = lookup(cache_dir, key, ttl)
+    cache_hit = meta is not None
+
+    if cache_hit:
+        row_count = meta['rows']
+    else:
+        row_count = store(cache_dir, key, f'{schema_name}.{table_name}', extract_fn)
+
+    # stages downstream rewrite the staged file in place, so they get their own copy
+    shutil.copyfile(_entry_paths(cache_dir, key)[0], jsonFilePath)
+    return row_count, cache_hit
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Invalidate cached OLTP extractions")
+    parser.add_argument("table", nargs="?", help="schema.table to invalidate, every entry when omitted")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+    cache_dir, _ = cache_settings(config)
+
+    print("\033[92m {}\033[00m".format(f"Removed {invalidate(cache_dir, args.table)} cached extraction(s)"))
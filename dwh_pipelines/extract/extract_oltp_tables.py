@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import configparser
+from pathlib import Path
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from extract.oltp_extract import oltp_connection_params, DEFAULT_ITERSIZE
+from extract.extract_cache import cached_extract, cache_settings, DEFAULT_CACHE_DIR, DEFAULT_TTL
+from extract.partitioned_extract import extract_partitioned
+
+psycopg2 = lazy_import('psycopg2')
+
+# Concurrent extraction driver: every OLTP source table is extracted on its own
+# connection from a thread pool and streamed to its own staging file.
+# psycopg2 releases the GIL while it waits on the server, so the threads overlap
+# their queries and the total time approaches that of the slowest table.
+# Sources with a split_column are additionally read as EXTRACT_PARTITIONS
+# concurrent range scans (see partitioned_extract.py).
+
+EXTRACT_SOURCES = [
+    { "schema": "main", "table": "marketing_spend", "columns": ["dateh", "offs", "ons"], "snapshot_column": "dateh", "split_column": "dateh", "filename": "Marketing_Spend.sql.json" },
+]
+
+# ================================================ LOGGER ================================================
+root_logger     =   logging.getLogger(__name__)
+root_logger.setLevel(logging.DEBUG)
+file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+debug           =   dict    (color  =   'white'),
+info            =   dict    (color  =   'green'),
+warning         =   dict    (color  =   'cyan'),
+error           =   dict    (color  =   'red',      bold    =   True,   bright      =   True),
+critical        =   dict    (color  =   'black',    bold    =   True,   background  =   'red')
+),
+
+field_styles=dict(
+messages            =   dict    (color  =   'white')
+)
+)
+
+current_filepath    =   Path(__file__).stem
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
+file_handler.setFormatter(file_handler_log_formatter)
+
+console_handler     =   logging.StreamHandler()
+console_handler.setFormatter(console_handler_log_formatter)
+
+root_logger.addHandler(file_handler)
+
+if __name__=="__main__":
+    root_logger.addHandler(console_handler)
+
+
+def extract_source(connection_params, source, json_dir, itersize, cache_dir, ttl, partitions=1, split_method='minmax'):
+    """Extract one source table on a dedicated connection; returns (rows, cache_hit, seconds)."""
+    start_time = time.time()
+    connection = psycopg2.connect(**connection_params)
+    try:
+        connection.set_session(isolation_level='REPEATABLE READ', readonly=True, autocommit=False)
+
+        extract_fn = None
+        if partitions > 1 and source.get('split_column'):
+            extract_fn = lambda path: extract_partitioned(connection, connection_params, source['schema'], source['table'], source['columns'],
+                                                          source['split_column'], partitions, path, predicate=source.get('predicate'),
+                                                          split_method=split_method, itersize=itersize, cursor_name=f"{source['table']}_extract")
+
+        rows, cache_hit = cached_extract(connection, source['schema'], source['table'], source['columns'], f"{json_dir}{os.sep}{source['filename']}",
+                                         predicate=source.get('predicate'), snapshot_column=source.get('snapshot_column'),
+                                         cache_dir=cache_dir, ttl=ttl, itersize=itersize, cursor_name=f"{source['table']}_extract",
+                                         extract_fn=extract_fn)
+    finally:
+        connection.close()
+    return rows, cache_hit, time.time() - start_time
+
+
+def extract_tables(connection_params, sources, json_dir, workers, itersize=DEFAULT_ITERSIZE, cache_dir=DEFAULT_CACHE_DIR, ttl=DEFAULT_TTL, partitions=1, split_method='minmax'):
+    """Extract all `sources` concurrently; returns {schema.table: (rows, cache_hit, seconds)}.
+
+    A failing table is logged and left out of the result, the others still complete.
+    cache_dir=None extracts every table from the source, bypassing the extraction cache.
+    """
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='oltp_extract') as executor:
+        futures = {
+            executor.submit(extract_source, connection_params, source, json_dir, itersize, cache_dir, ttl, partitions, split_method): f"{source['schema']}.{source['table']}"
+            for source in sources
+        }
+        for future in as_completed(futures):
+            table = futures[future]
+            try:
+                results[table] = future.result()
+            except Exception as e:
+                root_logger.error(f"EXTRACT FAILED: {table}: {e}")
+    return results
+
+
+if __name__=="__main__":
+    config  =   configparser.ConfigParser()
+    config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+
+    JSONDATA            =   config['data_filepath']['JSONDATA']
+    ITERSIZE            =   int(config['data_filepath'].get('EXTRACT_ITERSIZE', DEFAULT_ITERSIZE))
+    EXTRACT_WORKERS     =   int(config['data_filepath'].get('EXTRACT_WORKERS', 4))
+    EXTRACT_PARTITIONS  =   int(config['data_filepath'].get('EXTRACT_PARTITIONS', 1))
+    EXTRACT_SPLIT_METHOD =  config['data_filepath'].get('EXTRACT_SPLIT_METHOD', 'minmax')
+    EXTRACT_CACHE_DIR, EXTRACT_CACHE_TTL = cache_settings(config)
+
+    root_logger.info("")
+    root_logger.info("---------------------------------------------")
+    root_logger.info(f"Extracting {len(EXTRACT_SOURCES)} OLTP table(s) with {EXTRACT_WORKERS} worker(s)...")
+
+    EXTRACT_START_TIME = time.time()
+    results = extract_tables(oltp_connection_params(config), EXTRACT_SOURCES, JSONDATA, EXTRACT_WORKERS, ITERSIZE, EXTRACT_CACHE_DIR, EXTRACT_CACHE_TTL,
+                             EXTRACT_PARTITIONS, EXTRACT_SPLIT_METHOD)
+    EXTRACT_END_TIME = time.time()
+
+    for table, (rows, cache_hit, seconds) in sorted(results.items()):
+        root_logger.info(f"{table}: {rows} rows in {seconds:.3f}s{' (extraction cache)' if cache_hit else ''}")
+
+    root_logger.info('================================================')
+    root_logger.info(f"Total time Extraction: {EXTRACT_END_TIME - EXTRACT_START_TIME:.3f}s (sum of per-table times: {sum(result[2] for result in results.values()):.3f}s)")
+
+    if len(results) != len(EXTRACT_SOURCES):
+        raise ImportError("Trace the extract log to highlight the tables that failed to extract...")
@@ -0,0 +1,66 @@
+# Federated extraction: the DWH reaches the OLTP database through postgres_fdw,
+# so sources are materialized with INSERT INTO ... SELECT from a foreign table and
+# bulk movement stays server-to-server. Shippable WHERE clauses are pushed down
+# to the OLTP side by postgres_fdw (check the "Remote SQL" line of explain_remote).
+
+FOREIGN_SERVER = 'oltp_server'
+FOREIGN_SCHEMA = 'oltp_foreign'
+
+
+def setup_foreign_server(cursor, oltp_params, foreign_server=FOREIGN_SERVER):
+    """Create the postgres_fdw server and user mapping pointing at the OLTP database (idempotent)."""
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw;")
+    cursor.execute(f"""CREATE SERVER IF NOT EXISTS {foreign_server} FOREIGN DATA WRAPPER postgres_fdw
+                       OPTIONS (host %s, port %s, dbname %s);""",
+                   (oltp_params['host'], str(oltp_params['port']), oltp_params['dbname']))
+    # keep the options in sync with local_config.ini when the server already existed
+    cursor.execute(f"ALTER SERVER {foreign_server} OPTIONS (SET host %s, SET port %s, SET dbname %s);",
+                   (oltp_params['host'], str(oltp_params['port']), oltp_params['dbname']))
+
+    cursor.execute(f"DROP USER MAPPING IF EXISTS FOR CURRENT_USER SERVER {foreign_server};")
+    cursor.execute(f"CREATE USER MAPPING FOR CURRENT_USER SERVER {foreign_server} OPTIONS (user %s, password %s);",
+                   (oltp_params['user'], oltp_params['password']))
+
+
+def import_foreign_tables(cursor, remote_schema, table_names, foreign_server=FOREIGN_SERVER, foreign_schema=FOREIGN_SCHEMA):
+    """IMPORT FOREIGN SCHEMA for the given OLTP tables, replacing earlier imports so column changes are picked up."""
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {foreign_schema};")
+    for table_name in table_names:
+        cursor.execute(f"DROP FOREIGN TABLE IF EXISTS {foreign_schema}.{table_name};")
+    cursor.execute(f"IMPORT FOREIGN SCHEMA {remote_schema} LIMIT TO ({', '.join(table_names)}) "
+                   f"FROM SERVER {foreign_server} INTO {foreign_schema};")
+
+
+def _where(predicate, params):
+    # the predicate is literal SQL (EXTRACT_PREDICATE): when the query is run with params,
+    # psycopg2 reads every % in it as a placeholder, so a LIKE 'abc%' has to become 'abc%%'
+    if not predicate:
+        return ''
+    return f" WHERE {predicate.replace('%', '%%') if params is not None else predicate}"
+
+
+def materialize_select(src_table, src_expressions, dst_table, dst_columns, predicate=None, foreign_schema=FOREIGN_SCHEMA, params=None):
+    """INSERT INTO dst_table (dst_columns) SELECT src_expressions FROM the foreign table [WHERE predicate],
+    for cursor.execute(query, params)."""
+    return (f"INSERT INTO {dst_table} ({', '.join(dst_columns)}) "
+            f"SELECT {', '.join(src_expressions)} FROM {foreign_schema}.{src_table}{_where(predicate, params)}")
+
+
+def explain_remote(cursor, src_table, src_expressions, predicate=None, params=None, foreign_schema=FOREIGN_SCHEMA):
+    """Return the 'Remote SQL' postgres_fdw sends to the OLTP server, to check predicate pushdown."""
+    query = f"SELECT {', '.join(src_expressions)} FROM {foreign_schema}.{src_table}{_where(predicate, params)}"
+    cursor.execute(f"EXPLAIN (VERBOSE, COSTS OFF) {query}", params)
+    return [line.strip() for (line,) in cursor.fetchall() if 'Remote SQL' in line]
+
+
+def fdw_extract(cursor, oltp_params, remote_schema, src_table, src_expressions, dst_table, dst_columns, predicate=None, params=None):
+    """Set up postgres_fdw, import the OLTP table and materialize it into dst_table.
+
+    `params` fill the %s placeholders of src_expressions (e.g. lineage values).
+    Returns (rows inserted, remote SQL lines).
+    """
+    setup_foreign_server(cursor, oltp_params)
+    import_foreign_tables(cursor, remote_schema, [src_table])
+    remote_sql = explain_remote(cursor, src_table, src_expressions, predicate, params)
+    cursor.execute(materialize_select(src_table, src_expressions, dst_table, dst_columns, predicate, params=params), params)
+    return cursor.rowcount, remote_sql
@@ -1,14 +1,19 @@
 import os 
-import json
+import sys
 import time 
 import random
-import psycopg2
-import pandas as pd
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
 
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from extract.oltp_extract import build_select, DEFAULT_ITERSIZE
+from extract.extract_cache import cached_extract, cache_settings
+
+psycopg2 = lazy_import('psycopg2')
+
 FILENAME = "Marketing_Spend.sql.json"
 # ================================================ LOGGER ================================================
 
@@ -20,7 +25,7 @@ root_logger.setLevel(logging.DEBUG)
 
 # Set up formatter for logs 
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
                                                                                                 debug           =   dict    (color  =   'white'),
                                                                                                 info            =   dict    (color  =   'green'),
                                                                                                 warning         =   dict    (color  =   'cyan'),
@@ -36,7 +41,7 @@ console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(m
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -59,6 +64,9 @@ config  =   configparser.ConfigParser()
 path    =   os.path.abspath('dwh_pipelines/local_config.ini')
 config.read(path)
 JSONDATA     =   config['data_filepath']['JSONDATA']
+ITERSIZE     =   int(config['data_filepath'].get('EXTRACT_ITERSIZE', DEFAULT_ITERSIZE))
+EXTRACT_CACHE_DIR, EXTRACT_CACHE_TTL = cache_settings(config)
+EXTRACT_PREDICATE = config['data_filepath'].get('EXTRACT_PREDICATE', '') or None
 
 host = config['data_filepath']['OLTP_HOST']
 port =   config['data_filepath']['PORT']
@@ -71,20 +79,6 @@ cursor                  =   None
 
 
 # Begin the data extraction process
-root_logger.info("")
-root_logger.info("---------------------------------------------")
-root_logger.info("Beginning the staging process...")
-
-
-postgres_connection = psycopg2.connect(
-                host        =   host,
-                port        =   port,
-                dbname      =   database,
-                user        =   username,
-                password    =   password,
-        )
-postgres_connection.set_session(autocommit=True)
-
 
 
 def load_data_to_flight_schedules_table(postgres_connection):
@@ -116,49 +110,29 @@ def load_data_to_flight_schedules_table(postgres_connection):
 
             # root_logger.info(f'{desired_sql_columns}')
         desired_sql_columns = ['dateh', 'offs', 'ons']
+        snapshot_column = 'dateh'
 
 
-        # Pull flight_schedules_tbl data from staging tables in Postgres database 
-        try:
-            fetch_flight_schedules_tbl = f'''SELECT { ', '.join(desired_sql_columns) } FROM {active_schema_name}.{src_table_name};  
-            '''
-            root_logger.debug(fetch_flight_schedules_tbl)
-            root_logger.info("")
-            root_logger.info(f"Successfully IMPORTED the '{src_table_name}' virtual table from the '{foreign_server}' server into the '{active_schema_name}' schema for '{database}' database. Now advancing to data cleaning stage...")
-            root_logger.info("")
+        # Stream flight_schedules_tbl data through a server-side cursor straight into the staging file
+        fetch_flight_schedules_tbl = build_select(active_schema_name, src_table_name, desired_sql_columns, EXTRACT_PREDICATE)
+        root_logger.debug(fetch_flight_schedules_tbl)
+        root_logger.info("")
+        root_logger.info(f"Streaming the '{src_table_name}' table from the '{foreign_server}' server ({active_schema_name} schema, '{database}' database) in batches of {ITERSIZE} rows. Now advancing to data cleaning stage...")
+        root_logger.info("")
 
+        # Stages of the same pipeline run that ask for an unchanged table are served from the extraction cache
+        EXTRACT_START_TIME = time.time()
+        total_rows_extracted, cache_hit = cached_extract(postgres_connection, active_schema_name, src_table_name, desired_sql_columns, f'{JSONDATA}{os.sep}{FILENAME}',
+                                                         predicate=EXTRACT_PREDICATE, snapshot_column=snapshot_column, cache_dir=EXTRACT_CACHE_DIR, ttl=EXTRACT_CACHE_TTL,
+                                                         itersize=ITERSIZE, cursor_name=f'{src_table_name}_extract')
+        EXTRACT_END_TIME = time.time()
 
-            # Execute SQL command to interact with Postgres database
-            cursor.execute(fetch_flight_schedules_tbl)
-
-            # Extract header names from cursor's description
-            postgres_table_headers = [header[0] for header in cursor.description]
-
-
-            # Execute script 
-            postgres_table_results = cursor.fetchall()
-            
-
-            # Use Postgres results to create data frame for flight_schedules_tbl
-            flight_schedules_tbl_df = pd.DataFrame(data=postgres_table_results, columns=postgres_table_headers)
-
-
-            # Create temporary data frame     
-            temp_df = flight_schedules_tbl_df
-
-        except Exception as e:
-            print(e)
-
-        print(temp_df)
-        print(temp_df.columns)
-        
-        # Write results to temp file for data validation checks 
-        with open(f'{JSONDATA}{os.sep}{FILENAME}', 'w') as temp_results_file:
-            temp_results_file_df_to_json = temp_df.to_json(orient="records")
-            temp_results_file.write(json.dumps(json.loads(temp_results_file_df_to_json), indent=4, sort_keys=True)) 
+        root_logger.info(f"Rows extracted to '{FILENAME}': {total_rows_extracted} ({'served from the extraction cache' if cache_hit else 'fresh extraction'}) ")
+        root_logger.info(f"Total time Extraction: {EXTRACT_END_TIME - EXTRACT_START_TIME} ")
 
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
         
     finally:
         
@@ -175,5 +149,25 @@ def load_data_to_flight_schedules_table(postgres_connection):
             root_logger.debug("Session connected to Postgres database closed.")
 
 
+def run():
+    """Pipeline stage: stream main.marketing_spend from the OLTP database into the staged JSON file."""
+    root_logger.info("")
+    root_logger.info("---------------------------------------------")
+    root_logger.info("Beginning the staging process...")
 
-load_data_to_flight_schedules_table(postgres_connection)
\ No newline at end of file
+    postgres_connection = psycopg2.connect(
+                    host        =   host,
+                    port        =   port,
+                    dbname      =   database,
+                    user        =   username,
+                    password    =   password,
+            )
+    # the server-side cursor used for extraction has to run inside a (read-only) transaction,
+    # repeatable read so the cache snapshot and the extracted rows agree
+    postgres_connection.set_session(isolation_level='REPEATABLE READ', readonly=True, autocommit=False)
+
+    load_data_to_flight_schedules_table(postgres_connection)
+
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,77 @@
+import os
+import sys
+import calendar
+from decimal import Decimal
+from datetime import date, datetime
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from staging.json_stream import JsonArrayWriter
+
+# Streaming extraction from the OLTP database: rows are pulled through a named
+# (server-side) cursor in batches of `itersize` and handed straight to the staging
+# writer, so memory stays constant whatever the size of the source table.
+
+DEFAULT_ITERSIZE = 10000
+
+
+def to_json_value(value):
+    """Convert a value returned by psycopg2 to what df.to_json(orient="records") used to write."""
+    if isinstance(value, datetime):
+        return int(calendar.timegm(value.utctimetuple()) * 1000 + value.microsecond // 1000)
+    if isinstance(value, date):
+        return calendar.timegm(value.timetuple()) * 1000
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def oltp_connection_params(config):
+    """psycopg2.connect keyword arguments for the OLTP database described in local_config.ini."""
+    return dict(
+        host        =   config['data_filepath']['OLTP_HOST'],
+        port        =   config['data_filepath']['OLTP_PORT'],
+        dbname      =   config['data_filepath']['OLTP_DB'],
+        user        =   config['data_filepath']['OLTP_USERNAME'],
+        password    =   config['data_filepath']['OLTP_PASSWORD'],
+    )
+
+
+def build_select(schema_name, table_name, columns, predicate=None, order_by=None):
+    query = f"SELECT {', '.join(columns)} FROM {schema_name}.{table_name}"
+    if predicate:
+        query += f" WHERE {predicate}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    return query
+
+
+def stream_query(connection, query, params=None, itersize=DEFAULT_ITERSIZE, cursor_name='oltp_extract'):
+    """Yield (headers, batch) pairs for a query run through a server-side cursor.
+
+    Named cursors only live inside a transaction, so `connection` must not be in autocommit mode.
+    """
+    with connection.cursor(name=cursor_name) as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query, params)
+
+        while True:
+            batch = cursor.fetchmany(itersize)
+            if not batch:
+                break
+            yield [header[0] for header in cursor.description], batch
+
+
+def write_batches(writer, batches):
+    """Write (headers, batch) pairs to a JsonArrayWriter; returns the number of rows written."""
+    row_count = 0
+    for headers, batch in batches:
+        for row in batch:
+            writer.write_record({header: to_json_value(value) for header, value in zip(headers, row)})
+        row_count += len(batch)
+    return row_count
+
+
+def extract_to_json(connection, query, jsonFilePath, params=None, itersize=DEFAULT_ITERSIZE, cursor_name='oltp_extract', fragment=False):
+    """Stream the result of `query` into a staged JSON file; returns the number of rows extracted."""
+    with JsonArrayWriter(jsonFilePath, sort_keys=True, fragment=fragment) as writer:
+        return write_batches(writer, stream_query(connection, query, params, itersize, cursor_name))
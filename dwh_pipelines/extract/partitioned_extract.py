@@ -0,0 +1,127 @@
+import os
+import sys
+import tempfile
+from decimal import Decimal
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from extract.oltp_extract import build_select, extract_to_json, DEFAULT_ITERSIZE
+from staging.json_stream import concat_json_fragments
+from lazy_imports import lazy_import
+
+psycopg2 = lazy_import('psycopg2')
+
+# Range-partitioned extraction of a single large OLTP table.
+#
+# The table is split into N ranges of a split column (dateh for marketing spend),
+# with boundaries taken from min/max or from the pg_stats histogram. Every range
+# is read concurrently on its own connection, all of them inside the snapshot
+# exported by the coordinating transaction (pg_export_snapshot), so together they
+# see exactly one consistent version of the table. Each range is ordered by the
+# split column and the parts are concatenated in range order.
+
+
+def split_bounds_minmax(cursor, schema_name, table_name, split_column, partitions, predicate=None):
+    """N-1 inner boundaries evenly spaced between min and max of the split column."""
+    cursor.execute(build_select(schema_name, table_name, [f'MIN({split_column})', f'MAX({split_column})'], predicate))
+    low, high = cursor.fetchone()
+    if low is None or low == high or partitions < 2:
+        return []
+
+    if isinstance(low, date):
+        step = (high - low) / partitions
+    elif isinstance(low, int):
+        step = max((high - low) // partitions, 1)
+    elif isinstance(low, (float, Decimal)):
+        step = (high - low) / partitions
+    else:
+        # no arithmetic on this type, use the histogram instead
+        return split_bounds_histogram(cursor, schema_name, table_name, split_column, partitions)
+
+    bounds = [low + step * index for index in range(1, partitions)]
+    return sorted({bound for bound in bounds if low < bound <= high})
+
+
+def split_bounds_histogram(cursor, schema_name, table_name, split_column, partitions):
+    """N-1 inner boundaries picked evenly from the pg_stats histogram (equi-depth ranges).
+
+    The histogram describes the whole table, so the ranges are only balanced for an
+    unfiltered extract. Returns [] when the table has not been analyzed.
+    """
+    cursor.execute('''SELECT unnest(histogram_bounds::text::text[]) FROM pg_stats
+                      WHERE schemaname = %s AND tablename = %s AND attname = %s;''',
+                   (schema_name, table_name, split_column))
+    histogram = [bound for (bound,) in cursor.fetchall()]
+    if len(histogram) < 3 or partitions < 2:
+        return []
+
+    picks = [histogram[round(index * (len(histogram) - 1) / partitions)] for index in range(1, partitions)]
+    bounds = []
+    for bound in picks:
+        if bound not in bounds:
+            bounds.append(bound)
+    return bounds
+
+
+def range_predicates(split_column, bounds):
+    """(predicate, params) for each range; NULLs of the split column go to the first range."""
+    if not bounds:
+        return [('TRUE', None)]
+
+    predicates = [(f'({split_column} < %s OR {split_column} IS NULL)', (bounds[0],))]
+    for lower, upper in zip(bounds, bounds[1:]):
+        predicates.append((f'{split_column} >= %s AND {split_column} < %s', (lower, upper)))
+    predicates.append((f'{split_column} >= %s', (bounds[-1],)))
+    return predicates
+
+
+def _extract_range(connection_params, snapshot_id, query, params, fragmentPath, itersize, cursor_name):
+    connection = psycopg2.connect(**connection_params)
+    try:
+        connection.set_session(isolation_level='REPEATABLE READ', readonly=True, autocommit=False)
+        with connection.cursor() as cursor:
+            # must be the first statement of the transaction
+            cursor.execute('SET TRANSACTION SNAPSHOT %s;', (snapshot_id,))
+        return extract_to_json(connection, query, fragmentPath, params, itersize, cursor_name, fragment=True)
+    finally:
+        connection.close()
+
+
+def extract_partitioned(coordinator, connection_params, schema_name, table_name, columns, split_column, partitions, jsonFilePath,
+                        predicate=None, split_method='minmax', itersize=DEFAULT_ITERSIZE, cursor_name='oltp_extract'):
+    """Extract a table as `partitions` concurrent range scans merged in split-column order.
+
+    `coordinator` must be in a REPEATABLE READ transaction; it exports the snapshot
+    shared by the workers and has to stay open until they are done.
+    Returns the number of rows extracted.
+    """
+    with coordinator.cursor() as cursor:
+        cursor.execute('SELECT pg_export_snapshot();')
+        snapshot_id = cursor.fetchone()[0]
+
+        # the histogram ignores the predicate, min/max of the filtered rows balance a filtered extract better
+        if split_method == 'histogram' and not predicate:
+            bounds = split_bounds_histogram(cursor, schema_name, table_name, split_column, partitions)
+        else:
+            bounds = split_bounds_minmax(cursor, schema_name, table_name, split_column, partitions, predicate)
+
+    ranges = range_predicates(split_column, bounds)
+
+    with tempfile.TemporaryDirectory(prefix=f'{table_name}_parts_') as parts_dir:
+        fragmentPaths = [os.path.join(parts_dir, f'part_{index:04d}.json') for index in range(len(ranges))]
+
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix=f'{table_name}_range') as executor:
+            futures = []
+            for index, (range_predicate, params) in enumerate(ranges):
+                # the predicate is literal SQL run with the range params: psycopg2 reads its % as placeholders
+                user_predicate = predicate.replace('%', '%%') if predicate and params is not None else predicate
+                full_predicate = f'({user_predicate}) AND ({range_predicate})' if predicate else range_predicate
+                query = build_select(schema_name, table_name, columns, full_predicate, order_by=split_column)
+                futures.append(executor.submit(_extract_range, connection_params, snapshot_id, query, params,
+                                               fragmentPaths[index], itersize, f'{cursor_name}_{index}'))
+            row_count = sum(future.result() for future in futures)
+
+        concat_json_fragments(fragmentPaths, jsonFilePath)
+
+    return row_count
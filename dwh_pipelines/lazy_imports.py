@@ -0,0 +1,50 @@
+import sys
+import logging
+import importlib.util
+
+# Deferred imports for the stage scripts.
+#
+# Importing a stage only defines its loader; the connection, the queries and the
+# console logging all happen in run(). psycopg2 and coloredlogs cost more to
+# import than the rest of a tbl_* module together, so the stages bind them
+# lazily: the module object exists at import, its code runs on first attribute
+# access (psycopg2.connect in run()). `pipeline_runner.py --list`, the runner
+# resolving its stages and any code that only reads a stage's config start
+# without them. The numpy-backed helpers of the fact and export stages
+# (dss.columnar, approximate, revenue_fact, ...) are bound the same way.
+# Finding a dotted module imports its parent package, so psycopg2.extras and
+# psycopg2.pool are imported inside the function that uses them instead.
+#
+#     psycopg2 = lazy_import('psycopg2')
+#
+# performance/import_time.py holds the cold-start budget this keeps.
+
+
+def lazy_import(name):
+    """The module `name`, executed on first attribute access (or as imported already)."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+class LazyColoredFormatter(logging.Formatter):
+    """coloredlogs.ColoredFormatter built on the first record formatted: only console output needs coloredlogs."""
+
+    def __init__(self, **kwargs):
+        super().__init__(kwargs.get('fmt'), kwargs.get('datefmt'))
+        self.kwargs = kwargs
+        self.formatter = None
+
+    def format(self, record):
+        if self.formatter is None:
+            import coloredlogs
+            self.formatter = coloredlogs.ColoredFormatter(**self.kwargs)
+        return self.formatter.format(record)
@@ -0,0 +1,100 @@
+import os
+import sys
+import argparse
+import subprocess
+import configparser
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from pipeline_runner import STAGE_GROUPS, discover_stages
+
+# Cold-start benchmark of the pipeline modules.
+#
+# Every stage module, and the runner itself, is imported in a fresh interpreter
+# under `python -X importtime`; the module's cumulative import time (best of
+# --repeat runs) is checked against IMPORT_TIME_BUDGET_MS. Importing a stage
+# must not load psycopg2, coloredlogs, pandas or numpy (see lazy_imports.py),
+# so any of those showing up in the import tree fails the check as well. The
+# slowest imports underneath a failing module are listed to show the offender.
+#
+#     python dwh_pipelines/performance/import_time.py                    # every stage and the runner
+#     python dwh_pipelines/performance/import_time.py tbl_Tax_amount --repeat 10
+#
+# Exits 1 when a module is over budget or imports a deferred dependency.
+
+DEFAULT_BUDGET_MS = 100
+DEFAULT_REPEAT = 5
+DEFERRED_MODULES = ('psycopg2', 'coloredlogs', 'pandas', 'numpy')
+TOP_OFFENDERS = 5
+
+
+def import_paths():
+    """PYTHONPATH the stages are imported with, as pipeline_runner sets it up."""
+    directories = ['dwh_pipelines'] + sorted({directory for _, directory, _ in STAGE_GROUPS})
+    return os.pathsep.join(os.path.abspath(directory) for directory in directories)
+
+
+def parse_importtime(output):
+    """[(depth, module, self us, cumulative us)] of the -X importtime lines of `output`, in report order."""
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        imports.append(((len(name) - len(name.lstrip()) - 1) // 2, module, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure(module, repeat=DEFAULT_REPEAT):
+    """(cumulative us of importing `module`, its import tree) of the fastest of `repeat` fresh interpreters."""
+    environment = dict(os.environ, PYTHONPATH=import_paths())
+    best = None
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                   env=environment, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{completed.stderr.strip().splitlines()[-1]}")
+        imports = parse_importtime(completed.stderr)
+        total = next(cumulative for depth, name, _, cumulative in imports if depth == 0 and name == module)
+        if best is None or total < best[0]:
+            best = (total, imports)
+    return best
+
+
+def main(argv=None):
+    config = configparser.ConfigParser()
+    config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+
+    parser = argparse.ArgumentParser(description="Check the cold-start import time of the pipeline modules.")
+    parser.add_argument('modules', nargs='*', help="modules to import; every stage and pipeline_runner when omitted")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="fresh interpreters per module, the fastest counts")
+    parser.add_argument('--budget-ms', type=float, default=float(config['data_filepath'].get('IMPORT_TIME_BUDGET_MS', DEFAULT_BUDGET_MS)),
+                        help="cumulative import time allowed per module")
+    args = parser.parse_args(argv)
+
+    modules = args.modules or [stage for stages in discover_stages().values() for stage in stages] + ['pipeline_runner']
+    failures = 0
+    for module in modules:
+        total, imports = measure(module, args.repeat)
+        deferred = sorted({name for _, name, _, _ in imports if name in DEFERRED_MODULES})
+        over_budget = total / 1000 > args.budget_ms
+        message = f"{module}: {total / 1000:.1f}ms"
+        if not over_budget and not deferred:
+            print("\033[92m {}\033[00m".format(message))
+            continue
+
+        failures += 1
+        if over_budget:
+            message += f" over the {args.budget_ms:g}ms budget"
+        if deferred:
+            message += f", imports {', '.join(deferred)}"
+        print("\033[91m {}\033[00m".format(message))
+        for _, name, self_us, _ in sorted(imports, key=lambda entry: entry[2], reverse=True)[:TOP_OFFENDERS]:
+            print(f"     {self_us / 1000:7.1f}ms  {name}")
+
+    print(f"{len(modules) - failures}/{len(modules)} modules within {args.budget_ms:g}ms")
+    return 1 if failures else 0
+
+
+if __name__=="__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import argparse
+import importlib
+from collections import OrderedDict
+
+# Single-process pipeline runner.
+#
+# Every stage script (tables/tbl_*.py, dwh/datamarts/dim_*, fact_*, export_*,
+# synthetic_data_generator/oltp.py) only defines its loader at import and does
+# its work in run(), so the stages can be imported and run one after the other
+# in this interpreter: psycopg2, coloredlogs, numpy and the config are loaded
+# once for the whole pipeline instead of once per `python3 <script>` process,
+# and only when a stage first uses them (lazy_imports.py), so --list and stage
+# resolution start without them.
+# The scripts still run standalone (`python3 dwh_pipelines/tables/tbl_Tax_amount.py`).
+#
+#     python dwh_pipelines/pipeline_runner.py                     # every stage, in order
+#     python dwh_pipelines/pipeline_runner.py tables facts -v     # stage groups, logs on the console
+#     python dwh_pipelines/pipeline_runner.py tbl_Tax_amount      # single stages by module name
+#     python dwh_pipelines/pipeline_runner.py --list
+
+# (group, directory, module prefix) in pipeline order; dimensions come before the facts that resolve keys from them
+STAGE_GROUPS = [
+    ('oltp', 'dwh_pipelines/synthetic_data_generator', 'oltp.py'),
+    ('tables', 'dwh_pipelines/tables', 'tbl_'),
+    ('dims', 'dwh_pipelines/dwh/datamarts', 'dim_'),
+    ('facts', 'dwh_pipelines/dwh/datamarts', 'fact_'),
+    ('exports', 'dwh_pipelines/dwh/datamarts', 'export_'),
+]
+
+
+def discover_stages():
+    """{group: [stage module names]} from the files on disk, in pipeline order."""
+    stages = OrderedDict()
+    for group, directory, prefix in STAGE_GROUPS:
+        filenames = sorted(os.listdir(os.path.abspath(directory)))
+        stages[group] = [filename[:-3] for filename in filenames if filename.startswith(prefix) and filename.endswith('.py')]
+    return stages
+
+
+def resolve_stages(names, stages=None):
+    """Expand group names to their stages; stage module names are kept as given."""
+    stages = stages or discover_stages()
+    known = {stage for group_stages in stages.values() for stage in group_stages}
+    resolved = []
+    for name in names or list(stages):
+        if name in stages:
+            resolved.extend(stages[name])
+        elif name in known:
+            resolved.append(name)
+        else:
+            raise ValueError(f"Unknown stage '{name}', expected one of {list(stages)} or a stage module: {sorted(known)}")
+    return resolved
+
+
+def _prepare_imports():
+    # the stage modules import their siblings by bare name, as when run as scripts
+    for directory in ['dwh_pipelines'] + sorted({directory for _, directory, _ in STAGE_GROUPS}):
+        if os.path.abspath(directory) not in sys.path:
+            sys.path.append(os.path.abspath(directory))
+    os.makedirs('logs', exist_ok=True)
+
+
+def run_stages(names=None, verbose=False, keep_going=False):
+    """Import and run the stages in this process; returns [(stage, seconds, succeeded)]."""
+    _prepare_imports()
+    results = []
+    for stage in resolve_stages(names):
+        start_time = time.perf_counter()
+        try:
+            module = importlib.import_module(stage)
+            if verbose and module.console_handler not in module.root_logger.handlers:
+                module.root_logger.addHandler(module.console_handler)
+            module.run()
+            succeeded = True
+        except Exception as error:
+            print("\033[91m {}\033[00m".format(f"Stage {stage} failed: {error!r}"))
+            succeeded = False
+        results.append((stage, time.perf_counter() - start_time, succeeded))
+        print("\033[92m {}\033[00m".format(f"{stage}: {results[-1][1]:.2f}s"))
+        if not succeeded and not keep_going:
+            break
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run pipeline stages in a single process.")
+    parser.add_argument('stages', nargs='*', help="stage groups (oltp, tables, dims, facts, exports) or stage module names; all when omitted")
+    parser.add_argument('-v', '--verbose', action='store_true', help="also log every stage to the console")
+    parser.add_argument('--keep-going', action='store_true', help="run the remaining stages after a failure")
+    parser.add_argument('--list', action='store_true', help="list the stages and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for group, stages in discover_stages().items():
+            print(f"{group}: {' '.join(stages)}")
+        return 0
+
+    start_time = time.perf_counter()
+    results = run_stages(args.stages, args.verbose, args.keep_going)
+    print("\033[92m {}\033[00m".format(f"{sum(succeeded for _, _, succeeded in results)}/{len(results)} stages in {time.perf_counter() - start_time:.2f}s"))
+    return 0 if all(succeeded for _, _, succeeded in results) else 1
+
+
+if __name__=="__main__":
+    sys.exit(main())
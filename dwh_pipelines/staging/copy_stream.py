@@ -0,0 +1,59 @@
+import io
+
+# Generator-backed file-like adapter for COPY ... FROM STDIN: psycopg2 pulls
+# text from read() while rows are produced lazily, so whole tables are bulk
+# loaded in constant memory without building a file or a list of rows first.
+
+COPY_NULL = '\\N'
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def format_copy_row(row):
+    """One line of COPY text format: tab separated, \\N for NULL, special characters escaped."""
+    return '\t'.join(COPY_NULL if value is None else str(value).translate(_COPY_ESCAPES) for value in row) + '\n'
+
+
+class IteratorFile(io.TextIOBase):
+    """Read-only text stream over an iterable of row tuples, formatted for COPY text format."""
+
+    def __init__(self, rows):
+        self._lines = map(format_copy_row, rows)
+        self._buffer = ''
+        self.rows_read = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        pieces = [self._buffer]
+        length = len(self._buffer)
+        while size is None or size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            pieces.append(line)
+            length += len(line)
+            self.rows_read += 1
+
+        data = ''.join(pieces)
+        if size is None or size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        if not self._buffer:
+            line = next(self._lines, None)
+            if line is None:
+                return ''
+            self.rows_read += 1
+            return line
+        line, self._buffer = self._buffer, ''
+        return line
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY an iterable of row tuples into table(columns); returns the number of rows copied."""
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", IteratorFile(rows))
+    return cursor.rowcount
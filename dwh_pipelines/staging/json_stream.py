@@ -0,0 +1,148 @@
+import json
+
+# Streaming helpers for the staged JSON files (a single JSON array of records).
+# They let the pipeline read and write files far larger than RAM one record or
+# one chunk at a time, while keeping the same on-disk layout as df.to_json(orient="records", indent=4).
+
+READ_BUFFER_SIZE = 1 << 20
+
+
+def iter_json_array(jsonFilePath, buffer_size=READ_BUFFER_SIZE):
+    """Yield the records of a JSON array file one by one without loading the whole file."""
+    decoder = json.JSONDecoder()
+
+    with open(jsonFilePath, encoding='utf-8') as jsonf:
+        buf = ''
+        pos = 0
+        eof = False
+        started = False
+
+        while True:
+            # skip whitespace, and the separators between records once inside the array
+            while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+                pos += 1
+
+            # keep a full buffer of lookahead so records are decoded from complete text
+            if not eof and len(buf) - pos < buffer_size:
+                chunk = jsonf.read(buffer_size)
+                eof = chunk == ''
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            if pos >= len(buf):
+                raise ValueError(f"Unexpected end of file while reading {jsonFilePath}")
+
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError(f"{jsonFilePath} does not contain a JSON array of records")
+                started = True
+                pos += 1
+                continue
+
+            if buf[pos] == ']':
+                return
+
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # record is larger than the lookahead, pull in more data and retry
+                chunk = jsonf.read(buffer_size)
+                eof = chunk == ''
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            yield record
+            pos = end
+
+
+def iter_json_chunks(jsonFilePath, chunksize, buffer_size=READ_BUFFER_SIZE):
+    """Yield lists of at most `chunksize` records from a JSON array file."""
+    chunk = []
+    for record in iter_json_array(jsonFilePath, buffer_size):
+        chunk.append(record)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+class JsonArrayWriter:
+    """Incrementally write records into a JSON array file.
+
+    Records can be appended one at a time (write_record) or a whole DataFrame
+    chunk at a time (write_frame), so the first bytes land on disk as soon as
+    the first batch is ready.
+    """
+
+    def __init__(self, jsonFilePath, sort_keys=False, fragment=False):
+        self.path = jsonFilePath
+        self.sort_keys = sort_keys
+        # a fragment holds records without the enclosing brackets, so several of
+        # them can be concatenated into one array (see concat_json_fragments)
+        self.fragment = fragment
+        self.records_written = 0
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'w', encoding='utf-8')
+        if not self.fragment:
+            self._file.write('[')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_body(self, body, count):
+        if count == 0:
+            return
+        if self.records_written:
+            self._file.write(',\n')
+        elif not self.fragment:
+            self._file.write('\n')
+        self._file.write(body)
+        self.records_written += count
+
+    def write_record(self, record):
+        body = json.dumps(record, indent=4, sort_keys=self.sort_keys)
+        self._write_body('    ' + body.replace('\n', '\n    '), 1)
+
+    def write_records(self, records):
+        for record in records:
+            self.write_record(record)
+
+    def write_frame(self, df):
+        # let pandas serialize the whole chunk at once, then splice it into the open array
+        body = df.to_json(orient="records", indent=4).strip()
+        self._write_body(body[1:-1].strip('\n'), len(df))
+
+    def close(self):
+        if self._file is None:
+            return
+        if not self.fragment:
+            self._file.write('\n]' if self.records_written else ']')
+        self._file.close()
+        self._file = None
+
+
+def concat_json_fragments(fragmentPaths, jsonFilePath, buffer_size=READ_BUFFER_SIZE):
+    """Concatenate fragment files, in order, into one JSON array without re-parsing them."""
+    written = False
+    with open(jsonFilePath, 'w', encoding='utf-8') as jsonf:
+        jsonf.write('[')
+        for fragmentPath in fragmentPaths:
+            with open(fragmentPath, encoding='utf-8') as fragment:
+                data = fragment.read(buffer_size)
+                if not data:
+                    continue
+                jsonf.write(',\n' if written else '\n')
+                while data:
+                    jsonf.write(data)
+                    data = fragment.read(buffer_size)
+                written = True
+        jsonf.write('\n]' if written else ']')
@@ -0,0 +1,239 @@
+import os
+import re
+import time
+import argparse
+import configparser
+
+import numpy as np
+import pandas as pd
+
+# Scalable, deterministic generator for the five source files of the warehouse:
+# Online_Sales, CustomersData, Discount_Coupon, Tax_amount and Marketing_Spend.
+#
+# --scale is the number of Online_Sales rows (1K to 100M); customers are sized
+# from it with the ratio of the original extract (~36 sales per customer), while
+# the calendar stays the 2019 year of the original data and only the sales per
+# day grow with the scale. Every column is generated with vectorized NumPy kernels
+# from a fixed seed, and large tables are written in chunks, so the same
+# (seed, scale, chunksize) always produces byte-identical files.
+
+PRODUCT_CATEGORIES = ["Nest-USA", "Office", "Apparel", "Bags", "Drinkware", "Lifestyle", "Notebooks & Journals", "Headgear", "Waze", "Fun",
+                      "Nest-Canada", "Backpacks", "Google", "Bottles", "Gift Cards", "More Bags", "Housewares", "Android", "Accessories", "Nest"]
+# share of sales rows per category, skewed like the original extract (Nest-USA and Apparel dominate)
+CATEGORY_WEIGHTS = np.array([14.0, 6.5, 18.0, 1.8, 3.4, 3.4, 1.4, 0.8, 0.5, 0.1, 0.6, 0.1, 0.2, 0.2, 0.2, 0.1, 0.1, 0.1, 0.4, 2.2])
+CATEGORY_GST = [0.1, 0.1, 0.18, 0.18, 0.18, 0.18, 0.05, 0.05, 0.18, 0.18, 0.1, 0.1, 0.1, 0.05, 0.05, 0.12, 0.18, 0.1, 0.1, 0.05]
+
+LOCATIONS = ["Chicago", "California", "New York", "New Jersey", "Washington DC"]
+LOCATION_WEIGHTS = np.array([456, 464, 324, 149, 75], dtype=float)
+GENDERS = ["M", "F"]
+GENDER_WEIGHTS = np.array([534, 934], dtype=float)
+
+COUPON_STATUSES = ["Used", "Not Used", "Clicked"]
+COUPON_STATUS_WEIGHTS = np.array([0.34, 0.15, 0.51])
+DELIVERY_CHARGES = np.array([6.5, 6.0, 0.0, 19.99, 12.99])
+DELIVERY_WEIGHTS = np.array([0.55, 0.25, 0.08, 0.07, 0.05])
+
+SHORT_MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+# seasonal weight of each calendar month on sales volume
+MONTH_WEIGHTS = np.array([0.9, 0.8, 0.9, 0.9, 0.9, 0.9, 1.1, 1.2, 1.0, 1.1, 1.4, 1.6])
+
+SALES_PER_CUSTOMER = 36
+CALENDAR_DAYS = 365
+# sales per Marketing_Spend day of the original extract, sizes the spend seeded into the OLTP database
+SALES_PER_SPEND_DAY = 145
+SKUS_PER_CATEGORY = 60
+START_DATE = np.datetime64('2019-01-01')
+
+DEFAULT_SEED = 42
+DEFAULT_OUT_DIR = 'csvdata_generated'
+DEFAULT_CHUNKSIZE = 1_000_000
+
+
+def _rng(seed, *stream):
+    # independent, reproducible stream per (table, chunk)
+    return np.random.default_rng(np.random.SeedSequence([seed, *stream]))
+
+
+def _weights(weights):
+    return np.asarray(weights, dtype=float) / np.sum(weights)
+
+
+def table_sizes(scale):
+    return {
+        'Online_Sales': scale,
+        'CustomersData': max(scale // SALES_PER_CUSTOMER, 1),
+        'Marketing_Spend': CALENDAR_DAYS,
+        'Discount_Coupon': 12 * len(PRODUCT_CATEGORIES),
+        'Tax_amount': len(PRODUCT_CATEGORIES),
+    }
+
+
+def seed_spend_days(scale):
+    """Marketing_Spend days seeded into the OLTP database for `scale` Online_Sales rows.
+
+    The source files keep the 2019 calendar; the OLTP seed keeps the original ratio of
+    sales per spend day instead, so its marketing_spend grows with the scale (past 2019).
+    """
+    return max(scale // SALES_PER_SPEND_DAY, CALENDAR_DAYS)
+
+
+def date_strings(days):
+    """'M/D/YYYY' labels for every day of the generated calendar, indexed by day offset."""
+    # numpy day arithmetic: no pandas Timestamp bounds on long calendars
+    dates = START_DATE + np.arange(days)
+    months = dates.astype('datetime64[M]')
+    labels = np.char.add((months.astype(np.int64) % 12 + 1).astype(str), '/')
+    labels = np.char.add(labels, ((dates - months).astype(np.int64) + 1).astype(str))
+    labels = np.char.add(labels, '/')
+    return np.char.add(labels, (dates.astype('datetime64[Y]').astype(np.int64) + 1970).astype(str)).astype(object)
+
+
+def generate_tax_amount():
+    return pd.DataFrame({'Product_Category': PRODUCT_CATEGORIES, 'GST': CATEGORY_GST})
+
+
+def generate_discount_coupon():
+    categories = np.repeat(PRODUCT_CATEGORIES, 12)
+    months = np.tile(SHORT_MONTHS, len(PRODUCT_CATEGORIES))
+    discount = np.tile([10, 20, 30], 4 * len(PRODUCT_CATEGORIES))
+    prefixes = np.repeat([re.sub('[^A-Z]', '', category.upper())[:4] for category in PRODUCT_CATEGORIES], 12)
+    return pd.DataFrame({
+        'Month': months,
+        'Product_Category': categories,
+        'Coupon_Code': np.char.add(prefixes.astype(str), discount.astype(str)),
+        'Discount_pct': discount,
+    })
+
+
+def generate_customers(seed, customers):
+    rng = _rng(seed, 1)
+    return pd.DataFrame({
+        'CustomerID': 10000 + np.arange(customers),
+        'Gender': np.array(GENDERS)[rng.choice(len(GENDERS), customers, p=_weights(GENDER_WEIGHTS))],
+        'Location': np.array(LOCATIONS)[rng.choice(len(LOCATIONS), customers, p=_weights(LOCATION_WEIGHTS))],
+        'Tenure_Months': rng.integers(2, 51, customers),
+    })
+
+
+def generate_marketing_spend(seed, days):
+    rng = _rng(seed, 2)
+    return pd.DataFrame({
+        'Date': date_strings(days),
+        'Offline_Spend': rng.choice(np.arange(500, 5001, 500), days),
+        'Online_Spend': np.round(rng.lognormal(np.log(1800), 0.35, days), 2),
+    })
+
+
+def customer_weights(seed, customers):
+    # a few loyal customers account for many purchases (heavy tailed, like the original extract)
+    return _weights(_rng(seed, 3).lognormal(0.0, 1.0, customers))
+
+
+def sku_catalog(seed):
+    rng = _rng(seed, 4)
+    skus = SKUS_PER_CATEGORY * len(PRODUCT_CATEGORIES)
+    return {
+        'sku': np.char.add('GGOE', np.char.zfill((rng.permutation(10 ** 6)[:skus]).astype(str), 6)),
+        'category': np.repeat(np.arange(len(PRODUCT_CATEGORIES)), SKUS_PER_CATEGORY),
+        'description': np.array([f"{category} item {index + 1}" for category in PRODUCT_CATEGORIES for index in range(SKUS_PER_CATEGORY)]),
+        'price': np.round(rng.lognormal(np.log(25), 0.9, skus), 2),
+    }
+
+
+def day_weights(days):
+    months = pd.date_range(str(START_DATE), periods=days, freq='D').month.to_numpy() - 1
+    return _weights(MONTH_WEIGHTS[months])
+
+
+def generate_sales_chunk(seed, chunk_index, rows, first_transaction_id, customer_p, catalog, day_p, labels):
+    """One chunk of Online_Sales rows; returns (DataFrame, next transaction id)."""
+    rng = _rng(seed, 5, chunk_index)
+
+    # sales rows come in baskets: a new transaction starts with probability 1/2.2
+    new_basket = rng.random(rows) < 1 / 2.2
+    new_basket[0] = True
+    transaction_id = first_transaction_id + np.cumsum(new_basket) - 1
+
+    # one customer and one day per basket
+    basket_starts = np.flatnonzero(new_basket)
+    basket_of_row = np.cumsum(new_basket) - 1
+    customers = 10000 + rng.choice(len(customer_p), len(basket_starts), p=customer_p)[basket_of_row]
+    days = np.sort(rng.choice(len(day_p), len(basket_starts), p=day_p))[basket_of_row]
+
+    category = rng.choice(len(PRODUCT_CATEGORIES), rows, p=_weights(CATEGORY_WEIGHTS))
+    sku = category * SKUS_PER_CATEGORY + rng.integers(0, SKUS_PER_CATEGORY, rows)
+
+    chunk = pd.DataFrame({
+        'CustomerID': customers,
+        'Transaction_ID': transaction_id,
+        'Transaction_Date': labels[days],
+        'Product_SKU': catalog['sku'][sku],
+        'Product_Description': catalog['description'][sku],
+        'Product_Category': np.array(PRODUCT_CATEGORIES)[category],
+        'Quantity': rng.geometric(0.55, rows),
+        'Avg_Price': catalog['price'][sku],
+        'Delivery_Charges': DELIVERY_CHARGES[rng.choice(len(DELIVERY_CHARGES), rows, p=DELIVERY_WEIGHTS)],
+        'Coupon_Status': np.array(COUPON_STATUSES)[rng.choice(len(COUPON_STATUSES), rows, p=COUPON_STATUS_WEIGHTS)],
+    })
+    return chunk, int(transaction_id[-1]) + 1
+
+
+def iter_online_sales(seed, scale, chunksize=DEFAULT_CHUNKSIZE):
+    """Yield Online_Sales chunks; customers, SKUs and dates all reference the other generated tables."""
+    sizes = table_sizes(scale)
+    customer_p = customer_weights(seed, sizes['CustomersData'])
+    catalog = sku_catalog(seed)
+    day_p = day_weights(sizes['Marketing_Spend'])
+    labels = date_strings(sizes['Marketing_Spend'])
+
+    transaction_id = 16679
+    for chunk_index, start in enumerate(range(0, scale, chunksize)):
+        chunk, transaction_id = generate_sales_chunk(seed, chunk_index, min(chunksize, scale - start), transaction_id,
+                                                     customer_p, catalog, day_p, labels)
+        yield chunk
+
+
+def write_chunks(chunks, csvFilePath):
+    rows = 0
+    for index, chunk in enumerate(chunks):
+        chunk.to_csv(csvFilePath, mode='w' if index == 0 else 'a', header=index == 0, index=False)
+        rows += len(chunk)
+    return rows
+
+
+def generate_sources(out_dir, scale, seed=DEFAULT_SEED, chunksize=DEFAULT_CHUNKSIZE, tables=None):
+    """Write the selected source tables as CSV files in out_dir; returns {table: rows}."""
+    sizes = table_sizes(scale)
+    generators = {
+        'Tax_amount': lambda: [generate_tax_amount()],
+        'Discount_Coupon': lambda: [generate_discount_coupon()],
+        'CustomersData': lambda: [generate_customers(seed, sizes['CustomersData'])],
+        'Marketing_Spend': lambda: [generate_marketing_spend(seed, sizes['Marketing_Spend'])],
+        'Online_Sales': lambda: iter_online_sales(seed, scale, chunksize),
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    for table in tables or generators:
+        written[table] = write_chunks(generators[table](), os.path.join(out_dir, f'{table}.csv'))
+    return written
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Generate the warehouse source files at any scale")
+    parser.add_argument("--scale", type=int, default=50_000, help="number of Online_Sales rows, other tables are sized from it")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE, help="Online_Sales rows generated and written per chunk")
+    parser.add_argument("--out", help="output folder, GENERATED_CSVDATA from local_config.ini by default (never the committed CSVDATA)")
+    parser.add_argument("--tables", nargs="*", choices=list(table_sizes(1)), help="only generate these tables")
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+
+    START_TIME = time.time()
+    written = generate_sources(args.out or config['data_filepath'].get('GENERATED_CSVDATA', DEFAULT_OUT_DIR), args.scale, args.seed, args.chunksize, args.tables)
+
+    for table, rows in written.items():
+        print("\033[92m {}\033[00m".format(f"SUCCESS Generated {table}.csv: {rows} rows"))
+    print("\033[92m {}\033[00m".format(f"Total time Generation: {time.time() - START_TIME:.2f}s"))
@@ -1,16 +1,23 @@
 import os 
+import sys
+import csv
 import json
 import time 
 import random
-import pandas as pd
-import psycopg2
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+sys.path.append(os.path.abspath('dwh_pipelines/synthetic_data_generator'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from staging.copy_stream import copy_rows
+from extract import load_remote_Marketing_Spend
+
+psycopg2 = lazy_import('psycopg2')
 
-with open(f"{os.getcwd()}{os.sep}dwh_pipelines{os.sep}extract{os.sep}load_remote_Marketing_Spend.py") as start_fetch:
-    exec(start_fetch.read())
 
 src_file = 'Marketing_Spend.csv'
 
@@ -18,7 +25,7 @@ src_file = 'Marketing_Spend.csv'
 root_logger     =   logging.getLogger(__name__)
 root_logger.setLevel(logging.DEBUG)
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
 debug           =   dict    (color  =   'white'),
 info            =   dict    (color  =   'green'),
 warning         =   dict    (color  =   'cyan'),
@@ -32,7 +39,7 @@ messages            =   dict    (color  =   'white')
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -60,6 +67,7 @@ config  =   configparser.ConfigParser()
 path    =   os.path.abspath('dwh_pipelines/local_config.ini')
 config.read(path)
 customer_info_path     =   config['data_filepath']['CSVDATA'] + os.sep + src_file
+SEED_SCALE             =   int(config['data_filepath'].get('OLTP_SEED_SCALE', 0))
 
 host                    =   config['data_filepath']['OLTP_HOST']
 port                    =   config['data_filepath']['OLTP_PORT']
@@ -71,36 +79,30 @@ postgres_connection     =   None
 cursor                  =   None
 
 
-root_logger.info("")
-root_logger.info("---------------------------------------------")
-root_logger.info("Beginning the source data extraction process...")
-COMPUTE_START_TIME  =  time.time()
-
    
-try:
-    df = pd.read_csv(customer_info_path)
-    root_logger.info(f"Successfully loaded '{src_file}'")
-except:
-    root_logger.error("Unable to locate source file...")
-    raise Exception("No source file located")
-
-data_by_cols = []
-for col in list(df.columns.values):
-    data_by_cols.append(df[col].to_list())
-
-print(str(data_by_cols))
-    
-
-postgres_connection = psycopg2.connect(
-host        =   host,
-port        =   port,
-dbname      =   database,
-user        =   username,
-password    =   password,
-)
-postgres_connection.set_session(autocommit=True)
+def to_integer(value):
+    # same rounding as Postgres' numeric -> integer cast (half away from zero)
+    return int(Decimal(value).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def iter_csv_rows(csvFilePath):
+    """Stream (dateh, offs, ons) rows from the Marketing_Spend CSV without loading it."""
+    with open(csvFilePath, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        next(reader)
+        for date_value, offline_spend, online_spend in reader:
+            yield date_value, to_integer(offline_spend), to_integer(online_spend)
 
-def load_data_to_table(postgres_connection):
+
+def iter_generated_rows(scale):
+    """Generated (dateh, offs, ons) rows sized for `scale` Online_Sales rows (see generate_sources.py)."""
+    from generate_sources import generate_marketing_spend, seed_spend_days, DEFAULT_SEED
+    spend = generate_marketing_spend(DEFAULT_SEED, seed_spend_days(scale))
+    for date_value, offline_spend, online_spend in spend.itertuples(index=False, name=None):
+        yield date_value, to_integer(str(offline_spend)), to_integer(str(online_spend))
+
+
+def load_data_to_table(postgres_connection, source_rows):
     try:
         db_layer_name =   database
         schema_name = 'main'
@@ -149,12 +151,6 @@ def load_data_to_table(postgres_connection):
         check_total_row_count_before_insert_statement = f'''SELECT COUNT(*) FROM {schema_name}.{table_name}'''
 
 
-        insert_data  = f'''INSERT INTO {schema_name}.{table_name} (
-            dateh,
-            offs,
-            ons
-        ) VALUES (%s, %s, %s);'''
-
         check_total_row_count_after_insert_statement    =   f'''SELECT COUNT(*) FROM {schema_name}.{table_name}'''
 
 
@@ -257,29 +253,10 @@ def load_data_to_table(postgres_connection):
         root_logger.debug(f"")
 
 
-        for index in range( len(data_by_cols[0]) ):
-            values = (
-                data_by_cols[0][index],
-                data_by_cols[1][index], 
-                data_by_cols[2][index]
-            )
-
-            cursor.execute(insert_data, values)
-
-
-            # Validate if each row inserted into the table exists 
-            if cursor.rowcount == 1:
-                row_counter += 1
-                successful_rows_upload_count += 1
-                root_logger.debug(f'---------------------------------')
-                root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
-                root_logger.debug(f'---------------------------------')
-            else:
-                row_counter += 1
-                failed_rows_upload_count +=1
-                root_logger.error(f'---------------------------------')
-                root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
-                root_logger.error(f'---------------------------------')
+        # Stream all rows through one COPY ... FROM STDIN instead of one INSERT per row
+        successful_rows_upload_count = copy_rows(cursor, f'{schema_name}.{table_name}', ['dateh', 'offs', 'ons'], source_rows)
+        row_counter = successful_rows_upload_count
+        root_logger.info(f'COPY SUCCESS: {successful_rows_upload_count} records streamed into {schema_name}.{table_name} ')
 
         ROW_INSERTION_PROCESSING_END_TIME   =   time.time()
 
@@ -379,7 +356,8 @@ def load_data_to_table(postgres_connection):
         root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
         root_logger.info("Saved successfully, now terminating cursor and current session....")
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
     finally:
         # Close the cursor if it exists 
         if cursor is not None:
@@ -393,4 +371,36 @@ def load_data_to_table(postgres_connection):
             # root_logger.debug("")
             root_logger.debug("Session connected to Postgres database closed.")
 
-load_data_to_table(postgres_connection)
\ No newline at end of file
+
+def run():
+    """Pipeline stage: seed main.marketing_spend in the OLTP database (from the CSV, or generated rows)."""
+    load_remote_Marketing_Spend.run()
+
+    root_logger.info("")
+    root_logger.info("---------------------------------------------")
+    root_logger.info("Beginning the source data extraction process...")
+
+    if SEED_SCALE > 0:
+        source_rows = iter_generated_rows(SEED_SCALE)
+        root_logger.info(f"Seeding from generated rows (scale {SEED_SCALE})")
+    elif os.path.exists(customer_info_path):
+        source_rows = iter_csv_rows(customer_info_path)
+        root_logger.info(f"Successfully located '{src_file}'")
+    else:
+        root_logger.error("Unable to locate source file...")
+        raise Exception("No source file located")
+
+    postgres_connection = psycopg2.connect(
+    host        =   host,
+    port        =   port,
+    dbname      =   database,
+    user        =   username,
+    password    =   password,
+    )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection, source_rows)
+
+
+if __name__=="__main__":
+    run()
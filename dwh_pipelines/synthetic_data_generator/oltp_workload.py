@@ -0,0 +1,236 @@
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import threading
+import configparser
+from datetime import date, timedelta
+
+import psycopg2
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from extract.oltp_extract import oltp_connection_params
+
+# Concurrent OLTP workload simulator, to benchmark extraction while oltp_db is
+# serving writes. A pool of worker threads (one connection each) runs a
+# configurable mix of short INSERT/UPDATE transactions against the OLTP tables,
+# paced to a target rate of transactions per second. A monitor thread samples
+# pg_locks for sessions waiting on a lock. With --with-extract the extract stage
+# runs in the foreground and its throughput is reported next to the OLTP latency
+# percentiles and lock waits.
+
+DEFAULT_TPS = 50
+DEFAULT_WORKERS = 4
+DEFAULT_MIX = 'insert:0.3,update:0.7'
+LOCK_SAMPLE_INTERVAL = 0.2
+
+MARKETING_SPEND_TABLE = 'main.marketing_spend'
+
+
+def parse_mix(mix):
+    """'insert:0.3,update:0.7' -> {'insert': 0.3, 'update': 0.7}"""
+    weights = {}
+    for item in mix.split(','):
+        kind, weight = item.split(':')
+        if kind.strip() not in TRANSACTIONS:
+            raise ValueError(f"Unknown transaction type '{kind.strip()}', expected one of {sorted(TRANSACTIONS)}")
+        weights[kind.strip()] = float(weight)
+    return weights
+
+
+def insert_spend(cursor, rng, dates):
+    cursor.execute(f"INSERT INTO {MARKETING_SPEND_TABLE} (dateh, offs, ons) VALUES (%s, %s, %s);",
+                   (date(2019, 1, 1) + timedelta(days=rng.randrange(3650)), rng.randrange(500, 5001, 500), rng.randrange(500, 5000)))
+
+
+def update_spend(cursor, rng, dates):
+    cursor.execute(f"UPDATE {MARKETING_SPEND_TABLE} SET ons = ons + %s WHERE dateh = %s;",
+                   (rng.randrange(-50, 51), rng.choice(dates)))
+
+
+TRANSACTIONS = {
+    'insert': insert_spend,
+    'update': update_spend,
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)]
+
+
+class WorkloadSimulator:
+    """Drive `tps` transactions per second spread over `workers` threads until stop() is called."""
+
+    def __init__(self, connection_params, tps=DEFAULT_TPS, workers=DEFAULT_WORKERS, mix=DEFAULT_MIX, seed=None):
+        self.connection_params = connection_params
+        self.tps = tps
+        self.workers = workers
+        self.mix = parse_mix(mix) if isinstance(mix, str) else dict(mix)
+        self.seed = seed
+
+        self.latencies = {kind: [] for kind in self.mix}
+        self.errors = 0
+        self.lock_samples = 0
+        self.lock_waiting_samples = 0
+        self.max_lock_waiters = 0
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._started = None
+        self._elapsed = 0.0
+
+    def _existing_dates(self):
+        connection = psycopg2.connect(**self.connection_params)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT DISTINCT dateh FROM {MARKETING_SPEND_TABLE} WHERE dateh IS NOT NULL;")
+                return [dateh for (dateh,) in cursor.fetchall()] or [date(2019, 1, 1)]
+        finally:
+            connection.close()
+
+    def _worker(self, index, dates):
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        kinds, weights = list(self.mix), list(self.mix.values())
+        interval = self.workers / self.tps if self.tps > 0 else 0.0
+        latencies = {kind: [] for kind in kinds}
+        errors = 0
+
+        connection = psycopg2.connect(**self.connection_params)
+        try:
+            next_start = time.perf_counter()
+            while not self._stop.is_set():
+                kind = rng.choices(kinds, weights)[0]
+                start = time.perf_counter()
+                try:
+                    with connection.cursor() as cursor:
+                        TRANSACTIONS[kind](cursor, rng, dates)
+                    connection.commit()
+                    latencies[kind].append(time.perf_counter() - start)
+                except psycopg2.Error:
+                    errors += 1
+                    try:
+                        connection.rollback()
+                    except psycopg2.Error:
+                        # the connection is gone: reconnect instead of losing this worker
+                        connection.close()
+                        connection = psycopg2.connect(**self.connection_params)
+
+                # fixed schedule so slow transactions do not lower the offered rate
+                next_start += interval
+                delay = next_start - time.perf_counter()
+                if delay > 0:
+                    self._stop.wait(delay)
+                else:
+                    next_start = time.perf_counter()
+        finally:
+            connection.close()
+            with self._lock:
+                for kind, values in latencies.items():
+                    self.latencies[kind].extend(values)
+                self.errors += errors
+
+    def _monitor(self):
+        connection = psycopg2.connect(**self.connection_params)
+        connection.set_session(autocommit=True)
+        try:
+            with connection.cursor() as cursor:
+                while not self._stop.is_set():
+                    cursor.execute("SELECT COUNT(DISTINCT pid) FROM pg_locks WHERE NOT granted;")
+                    waiters = cursor.fetchone()[0]
+                    self.lock_samples += 1
+                    self.lock_waiting_samples += waiters > 0
+                    self.max_lock_waiters = max(self.max_lock_waiters, waiters)
+                    self._stop.wait(LOCK_SAMPLE_INTERVAL)
+        finally:
+            connection.close()
+
+    def start(self):
+        dates = self._existing_dates()
+        self._started = time.perf_counter()
+        self._threads = [threading.Thread(target=self._worker, args=(index, dates), name=f'oltp_workload_{index}', daemon=True)
+                         for index in range(self.workers)]
+        self._threads.append(threading.Thread(target=self._monitor, name='oltp_workload_locks', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._elapsed = time.perf_counter() - self._started
+        return self.report()
+
+    def report(self):
+        """Achieved TPS, latency percentiles (ms) per transaction type, errors and lock-wait samples."""
+        committed = sum(len(values) for values in self.latencies.values())
+        report = {
+            'seconds': self._elapsed,
+            'committed': committed,
+            'achieved_tps': committed / self._elapsed if self._elapsed else 0.0,
+            'errors': self.errors,
+            'latency_ms': {},
+            'lock_wait_ratio': self.lock_waiting_samples / self.lock_samples if self.lock_samples else 0.0,
+            'max_lock_waiters': self.max_lock_waiters,
+        }
+        for kind, values in self.latencies.items():
+            values = sorted(values)
+            report['latency_ms'][kind] = {f'p{pct}': percentile(values, pct) * 1000 for pct in (50, 95, 99)}
+        return report
+
+
+def run_extract_under_load(config, simulator):
+    """Run the concurrent extract stage while the simulator is writing; returns {table: (rows, cache_hit, seconds)}."""
+    from extract.extract_oltp_tables import extract_tables, EXTRACT_SOURCES
+
+    settings = config['data_filepath']
+    # no extraction cache and a scratch JSON folder: the benchmark must not hide the
+    # cost of reading under load, nor touch the pipeline's extract_cache/ or JSONDATA
+    json_dir = tempfile.mkdtemp(prefix='oltp_workload_')
+    simulator.start()
+    try:
+        return extract_tables(oltp_connection_params(config), EXTRACT_SOURCES, json_dir,
+                              int(settings.get('EXTRACT_WORKERS', 4)), int(settings.get('EXTRACT_ITERSIZE', 10000)),
+                              None, 0, int(settings.get('EXTRACT_PARTITIONS', 1)), settings.get('EXTRACT_SPLIT_METHOD', 'minmax'))
+    finally:
+        simulator.stop()
+        shutil.rmtree(json_dir, ignore_errors=True)
+
+
+if __name__=="__main__":
+    config  =   configparser.ConfigParser()
+    config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+    settings = config['data_filepath']
+
+    parser = argparse.ArgumentParser(description="Simulate concurrent OLTP writes, optionally while extracting")
+    parser.add_argument("--tps", type=float, default=float(settings.get('WORKLOAD_TPS', DEFAULT_TPS)), help="target transactions per second")
+    parser.add_argument("--workers", type=int, default=int(settings.get('WORKLOAD_WORKERS', DEFAULT_WORKERS)))
+    parser.add_argument("--mix", default=settings.get('WORKLOAD_MIX', DEFAULT_MIX), help="transaction mix, e.g. insert:0.3,update:0.7")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run without --with-extract")
+    parser.add_argument("--with-extract", action="store_true", help="run the extract stage while the workload is running")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    simulator = WorkloadSimulator(oltp_connection_params(config), args.tps, args.workers, args.mix, args.seed)
+
+    if args.with_extract:
+        results = run_extract_under_load(config, simulator)
+        for table, (rows, cache_hit, seconds) in sorted(results.items()):
+            print("\033[92m {}\033[00m".format(f"Extracted {table}: {rows} rows in {seconds:.3f}s ({rows / seconds if seconds else 0:.0f} rows/s)"))
+    else:
+        simulator.start()
+        time.sleep(args.duration)
+        simulator.stop()
+
+    report = simulator.report()
+    print("\033[92m {}\033[00m".format(f"OLTP workload: {report['committed']} transactions in {report['seconds']:.2f}s "
+                                       f"({report['achieved_tps']:.1f} TPS, target {args.tps}), {report['errors']} errors"))
+    for kind, latency in report['latency_ms'].items():
+        print("\033[92m {}\033[00m".format(f"  {kind}: p50 {latency['p50']:.2f}ms  p95 {latency['p95']:.2f}ms  p99 {latency['p99']:.2f}ms"))
+    print("\033[92m {}\033[00m".format(f"Lock waits: {report['lock_wait_ratio']:.1%} of samples, at most {report['max_lock_waiters']} waiting session(s)"))
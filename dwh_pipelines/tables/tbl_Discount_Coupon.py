@@ -1,19 +1,26 @@
 import os 
+import sys
 import json
 import time 
 import random
-import psycopg2
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
 
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from transform.elt_transform import load_with_elt, STAGING_SCHEMA
+from dwh.data_versions import bump_version
+
+psycopg2 = lazy_import('psycopg2')
+
 src_file = 'Discount_Coupon.csv.json'
 # ================================================ LOGGER ================================================
 root_logger     =   logging.getLogger(__name__)
 root_logger.setLevel(logging.DEBUG)
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
                                                                                                 debug           =   dict    (color  =   'white'),
                                                                                                 info            =   dict    (color  =   'green'),
                                                                                                 warning         =   dict    (color  =   'cyan'),
@@ -29,7 +36,7 @@ console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(m
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -62,38 +69,14 @@ port                    =   config['data_filepath']['PORT']
 database                =   config['data_filepath']['DWH_DB']
 username                =   config['data_filepath']['USERNAME']
 password                =   config['data_filepath']['PASSWORD']
+TRANSFORM_MODE          =   config['data_filepath'].get('TRANSFORM_MODE', 'etl')
+csv_dir                 =   config['data_filepath']['CSVDATA']
 
 postgres_connection     =   None
 cursor                  =   None
 
 
-root_logger.info("")
-
-root_logger.info("Beginning the source data extraction process...")
-COMPUTE_START_TIME  =  time.time()
-
-
-with open(customer_info_path, 'r') as customer_info_file:    
-    try:
-        customer_info_data = json.load(customer_info_file)
-        root_logger.info(f"Successfully located '{src_file}'")
-        root_logger.info(f"File type: '{type(customer_info_data)}'")
-
-    except:
-        root_logger.error("Unable to locate source file...")
-        raise Exception("No source file located")
-    
-
-postgres_connection = psycopg2.connect(
-host        =   host,
-port        =   port,
-dbname      =   database,
-user        =   username,
-password    =   password,
-)
-postgres_connection.set_session(autocommit=True)
-
-def load_data_to_table(postgres_connection):
+def load_data_to_table(postgres_connection, customer_info_data=None):
     try:
         db_layer_name =   database
         schema_name = 'main'
@@ -296,33 +279,43 @@ def load_data_to_table(postgres_connection):
         root_logger.debug(f"")
 
 
-        for datainfo in customer_info_data:
-            values = (
-                datainfo['Month'],
-                datainfo['Product_Category'], 
-                datainfo['Coupon_Code'], 
-                datainfo['Discount_pct'],
-                CURRENT_TIMESTAMP,
-                CURRENT_TIMESTAMP,
-                source_system[random.randint(0, len(source_system)-1)]
-            )
-
-            cursor.execute(insert_data, values)
-
+        if TRANSFORM_MODE == 'elt':
+            # Bulk-load the raw CSV into the staging schema and run the compiled transform rules set-based
+            successful_rows_upload_count = load_with_elt(cursor, 'Discount_Coupon', schema_name, table_name, csv_dir, CURRENT_TIMESTAMP, source_system)
+            row_counter = successful_rows_upload_count
+            root_logger.info(f'ELT INSERT SUCCESS: {successful_rows_upload_count} records transformed from the {STAGING_SCHEMA} schema ')
 
-            # Validate if each row inserted into the table exists 
-            if cursor.rowcount == 1:
-                row_counter += 1
-                successful_rows_upload_count += 1
-                root_logger.debug(f'---------------------------------')
-                root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
-                root_logger.debug(f'---------------------------------')
-            else:
-                row_counter += 1
-                failed_rows_upload_count +=1
-                root_logger.error(f'---------------------------------')
-                root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
-                root_logger.error(f'---------------------------------')
+        else:
+            for datainfo in customer_info_data:
+                values = (
+                    datainfo['Month'],
+                    datainfo['Product_Category'], 
+                    datainfo['Coupon_Code'], 
+                    datainfo['Discount_pct'],
+                    CURRENT_TIMESTAMP,
+                    CURRENT_TIMESTAMP,
+                    source_system[random.randint(0, len(source_system)-1)]
+                )
+
+                cursor.execute(insert_data, values)
+
+
+                # Validate if each row inserted into the table exists 
+                if cursor.rowcount == 1:
+                    row_counter += 1
+                    successful_rows_upload_count += 1
+                    root_logger.debug(f'---------------------------------')
+                    root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
+                    root_logger.debug(f'---------------------------------')
+                else:
+                    row_counter += 1
+                    failed_rows_upload_count +=1
+                    root_logger.error(f'---------------------------------')
+                    root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
+                    root_logger.error(f'---------------------------------')
+
+        # New data version for readers caching results built on this table (dss/query_client.py)
+        bump_version(cursor, schema_name, table_name)
 
         cursor.execute(check_total_row_count_after_insert_statement)
 
@@ -418,7 +411,8 @@ def load_data_to_table(postgres_connection):
         root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
         root_logger.info("Saved successfully, now terminating cursor and current session....")
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
     finally:
         # Close the cursor if it exists 
         if cursor is not None:
@@ -432,4 +426,38 @@ def load_data_to_table(postgres_connection):
             # root_logger.debug("")
             root_logger.debug("Session connected to Postgres database closed.")
 
-load_data_to_table(postgres_connection)
\ No newline at end of file
+
+def run():
+    """Pipeline stage: load Discount_Coupon into main.discount_coupon (from the staged JSON, or the raw CSV in ELT mode)."""
+    customer_info_data = None
+    root_logger.info("")
+
+    root_logger.info("Beginning the source data extraction process...")
+    COMPUTE_START_TIME  =  time.time()
+
+    # In ELT mode the raw CSV is staged and transformed inside the DWH, so the JSON file is never read
+    if TRANSFORM_MODE != 'elt':
+        with open(customer_info_path, 'r') as customer_info_file:    
+            try:
+                customer_info_data = json.load(customer_info_file)
+                root_logger.info(f"Successfully located '{src_file}'")
+                root_logger.info(f"File type: '{type(customer_info_data)}'")
+
+            except:
+                root_logger.error("Unable to locate source file...")
+                raise Exception("No source file located")
+
+    postgres_connection = psycopg2.connect(
+    host        =   host,
+    port        =   port,
+    dbname      =   database,
+    user        =   username,
+    password    =   password,
+    )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection, customer_info_data)
+
+
+if __name__=="__main__":
+    run()
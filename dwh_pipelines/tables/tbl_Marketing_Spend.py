@@ -1,15 +1,28 @@
 import os 
+import sys
 import json
 import time 
 import random
-import psycopg2
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
 
-with open(f"{os.getcwd()}{os.sep}dwh_pipelines{os.sep}etl{os.sep}load_remote_Marketing_Spend.py") as start_fetch:
-    exec(start_fetch.read())
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from extract.oltp_extract import oltp_connection_params, build_select
+from extract.copy_transfer import transfer_table
+from extract.fdw_extract import fdw_extract
+from dwh.data_versions import bump_version
+from extract import load_remote_Marketing_Spend
+
+psycopg2 = lazy_import('psycopg2')
+
+pipeline_config = configparser.ConfigParser()
+pipeline_config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
+EXTRACT_BACKEND = pipeline_config['data_filepath'].get('EXTRACT_BACKEND', 'python')
+EXTRACT_PREDICATE = pipeline_config['data_filepath'].get('EXTRACT_PREDICATE', '') or None
+
 
 src_file = 'Marketing_Spend.sql.json'
 
@@ -17,7 +30,7 @@ src_file = 'Marketing_Spend.sql.json'
 root_logger     =   logging.getLogger(__name__)
 root_logger.setLevel(logging.DEBUG)
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
 debug           =   dict    (color  =   'white'),
 info            =   dict    (color  =   'green'),
 warning         =   dict    (color  =   'cyan'),
@@ -32,7 +45,7 @@ messages            =   dict    (color  =   'white')
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -68,31 +81,7 @@ postgres_connection     =   None
 cursor                  =   None
 
 
-root_logger.info("Beginning the source data extraction process...")
-COMPUTE_START_TIME  =  time.time()
-
-
-with open(customer_info_path, 'r') as customer_info_file:    
-    try:
-        customer_info_data = json.load(customer_info_file)
-        root_logger.info(f"Successfully located '{src_file}'")
-        root_logger.info(f"File type: '{type(customer_info_data)}'")
-
-    except:
-        root_logger.error("Unable to locate source file...")
-        raise Exception("No source file located")
-    
-
-postgres_connection = psycopg2.connect(
-host        =   host,
-port        =   port,
-dbname      =   database,
-user        =   username,
-password    =   password,
-)
-postgres_connection.set_session(autocommit=True)
-
-def load_data_to_table(postgres_connection):
+def load_data_to_table(postgres_connection, customer_info_data=None):
     try:
         db_layer_name =   database
         schema_name = 'main'
@@ -292,35 +281,59 @@ def load_data_to_table(postgres_connection):
         root_logger.debug(f"")
 
 
-        for datainfo in customer_info_data:
-            values = (
-                datainfo['dateh'],
-                datainfo['offs'], 
-                datainfo['ons'], 
-                CURRENT_TIMESTAMP,
-                CURRENT_TIMESTAMP,
-                source_system
-            )
-
-            cursor.execute(insert_data, values)
+        if EXTRACT_BACKEND == 'copy':
+            # Stream the OLTP table into this table with COPY TO/COPY FROM, no Python rows or staged file in between
+            oltp_connection = psycopg2.connect(**oltp_connection_params(config))
+            try:
+                src_select = build_select('main', 'marketing_spend', ['dateh', 'offs', 'ons', f"'{source_system}'"], EXTRACT_PREDICATE)
+                successful_rows_upload_count = transfer_table(oltp_connection, postgres_connection, src_select, f'{schema_name}.{table_name}', ['Date', 'Offline_Spend', 'Online_Spend', 'source'])
+                row_counter = successful_rows_upload_count
+                root_logger.info(f'COPY TRANSFER SUCCESS: {successful_rows_upload_count} records streamed from the OLTP database ')
+            finally:
+                oltp_connection.close()
+
+        elif EXTRACT_BACKEND == 'fdw':
+            # Read the OLTP table through a postgres_fdw foreign table, the WHERE clause is pushed down to the OLTP server
+            successful_rows_upload_count, remote_sql = fdw_extract(cursor, oltp_connection_params(config), 'main', 'marketing_spend', ['dateh', 'offs', 'ons', '%s'],
+                                                                   f'{schema_name}.{table_name}', ['Date', 'Offline_Spend', 'Online_Spend', 'source'], EXTRACT_PREDICATE, (source_system,))
+            row_counter = successful_rows_upload_count
+            root_logger.info(f'FDW MATERIALIZE SUCCESS: {successful_rows_upload_count} records copied from the foreign table ')
+            for line in remote_sql:
+                root_logger.debug(line)
 
-
-            # Validate if each row inserted into the table exists 
-            if cursor.rowcount == 1:
-                row_counter += 1
-                successful_rows_upload_count += 1
-                root_logger.debug(f'---------------------------------')
-                root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
-                root_logger.debug(f'---------------------------------')
-            else:
-                row_counter += 1
-                failed_rows_upload_count +=1
-                root_logger.error(f'---------------------------------')
-                root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
-                root_logger.error(f'---------------------------------')
+        else:
+            for datainfo in customer_info_data:
+                values = (
+                    datainfo['dateh'],
+                    datainfo['offs'], 
+                    datainfo['ons'], 
+                    CURRENT_TIMESTAMP,
+                    CURRENT_TIMESTAMP,
+                    source_system
+                )
+
+                cursor.execute(insert_data, values)
+
+
+                # Validate if each row inserted into the table exists 
+                if cursor.rowcount == 1:
+                    row_counter += 1
+                    successful_rows_upload_count += 1
+                    root_logger.debug(f'---------------------------------')
+                    root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
+                    root_logger.debug(f'---------------------------------')
+                else:
+                    row_counter += 1
+                    failed_rows_upload_count +=1
+                    root_logger.error(f'---------------------------------')
+                    root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
+                    root_logger.error(f'---------------------------------')
 
         ROW_INSERTION_PROCESSING_END_TIME   =   time.time()
 
+        # New data version for readers caching results built on this table (dss/query_client.py)
+        bump_version(cursor, schema_name, table_name)
+
         ROW_COUNT_VAL_CHECK_PROCESSING_START_TIME   =   time.time()
         cursor.execute(check_total_row_count_after_insert_statement)
         ROW_COUNT_VAL_CHECK_PROCESSING_END_TIME     =   time.time()
@@ -417,7 +430,8 @@ def load_data_to_table(postgres_connection):
         root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
         root_logger.info("Saved successfully, now terminating cursor and current session....")
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
     finally:
         # Close the cursor if it exists 
         if cursor is not None:
@@ -431,4 +445,39 @@ def load_data_to_table(postgres_connection):
             # root_logger.debug("")
             root_logger.debug("Session connected to Postgres database closed.")
 
-load_data_to_table(postgres_connection)
\ No newline at end of file
+
+def run():
+    """Pipeline stage: load main.marketing_spend into the DWH through the configured extract backend."""
+    # The python backend stages the OLTP table as JSON first, the copy and fdw backends move it server to server
+    if EXTRACT_BACKEND == 'python':
+        load_remote_Marketing_Spend.run()
+
+    customer_info_data = None
+    root_logger.info("Beginning the source data extraction process...")
+    COMPUTE_START_TIME  =  time.time()
+
+    if EXTRACT_BACKEND == 'python':
+        with open(customer_info_path, 'r') as customer_info_file:    
+            try:
+                customer_info_data = json.load(customer_info_file)
+                root_logger.info(f"Successfully located '{src_file}'")
+                root_logger.info(f"File type: '{type(customer_info_data)}'")
+
+            except:
+                root_logger.error("Unable to locate source file...")
+                raise Exception("No source file located")
+
+    postgres_connection = psycopg2.connect(
+    host        =   host,
+    port        =   port,
+    dbname      =   database,
+    user        =   username,
+    password    =   password,
+    )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection, customer_info_data)
+
+
+if __name__=="__main__":
+    run()
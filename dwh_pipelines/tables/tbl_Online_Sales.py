@@ -1,20 +1,28 @@
 import os 
+import sys
 import json
 import time 
 import random
-import psycopg2
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
 
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from transform.elt_transform import load_with_elt, STAGING_SCHEMA
+from dwh.data_versions import bump_version
+from dwh.table_reload import reload_mode, dependent_matviews, truncate_table, check_matviews_kept, create_load_table, merge_load_table
+
+psycopg2 = lazy_import('psycopg2')
+
 src_file = 'Online_Sales.csv.json'
 
 # ================================================ LOGGER ================================================
 root_logger     =   logging.getLogger(__name__)
 root_logger.setLevel(logging.DEBUG)
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
                                                                                                 debug           =   dict    (color  =   'white'),
                                                                                                 info            =   dict    (color  =   'green'),
                                                                                                 warning         =   dict    (color  =   'cyan'),
@@ -30,7 +38,7 @@ console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(m
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -64,38 +72,18 @@ port                    =   config['data_filepath']['PORT']
 database                =   config['data_filepath']['DWH_DB']
 username                =   config['data_filepath']['USERNAME']
 password                =   config['data_filepath']['PASSWORD']
+FACT_BUILD_MODE         =   config['data_filepath'].get('FACT_BUILD_MODE', 'full')
+# natural key and updatable columns of a row, for the merge reload of FACT_BUILD_MODE=incremental
+MERGE_KEY_COLUMNS       =   ['CustomerID', 'Transaction_ID', 'Transaction_Date', 'Product_SKU', 'Product_Description', 'Product_Category', 'Quantity', 'Avg_Price', 'Delivery_Charges', 'Coupon_Status']
+MERGE_VALUE_COLUMNS     =   []
+TRANSFORM_MODE          =   config['data_filepath'].get('TRANSFORM_MODE', 'etl')
+csv_dir                 =   config['data_filepath']['CSVDATA']
 
 postgres_connection     =   None
 cursor                  =   None
 
 
-root_logger.info("")
-
-root_logger.info("Beginning the source data extraction process...")
-COMPUTE_START_TIME  =  time.time()
-
-
-with open(customer_info_path, 'r') as customer_info_file:    
-    try:
-        customer_info_data = json.load(customer_info_file)
-        root_logger.info(f"Successfully located '{src_file}'")
-        root_logger.info(f"File type: '{type(customer_info_data)}'")
-
-    except:
-        root_logger.error("Unable to locate source file...")
-        raise Exception("No source file located")
-    
-
-postgres_connection = psycopg2.connect(
-                host        =   host,
-                port        =   port,
-                dbname      =   database,
-                user        =   username,
-                password    =   password,
-        )
-postgres_connection.set_session(autocommit=True)
-
-def load_data_to_table(postgres_connection):
+def load_data_to_table(postgres_connection, customer_info_data=None):
     try:
         db_layer_name =   database
         schema_name = 'main'
@@ -110,6 +98,10 @@ def load_data_to_table(postgres_connection):
 
         cursor      =   postgres_connection.cursor()
 
+        # Rows go into a temp copy of the table, merged in after the inserts, when the incremental fact build needs the table kept
+        RELOAD_MODE = reload_mode(FACT_BUILD_MODE)
+        load_schema_name, load_table_name = ('pg_temp', f'{table_name}_load') if RELOAD_MODE == 'merge' else (schema_name, table_name)
+
 
         if postgres_connection.closed == 0:
             root_logger.debug(f"")
@@ -155,9 +147,9 @@ def load_data_to_table(postgres_connection):
 
 
         add_data_lineage_to_tbl  =   f''' ALTER TABLE {schema_name}.{table_name}
-                                                                ADD COLUMN  created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                                                                ADD COLUMN  updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                                                                ADD COLUMN  source VARCHAR(255);'''
+                                                                ADD COLUMN IF NOT EXISTS created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                                                                ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                                                                ADD COLUMN IF NOT EXISTS source VARCHAR(255);'''
 
         check_if_data_lineage_fields_are_added_to_tbl   =   f'''        
                                                                 SELECT * 
@@ -167,7 +159,7 @@ def load_data_to_table(postgres_connection):
         check_total_row_count_before_insert_statement   =   f'''SELECT COUNT(*) FROM {schema_name}.{table_name}'''
 
 
-        insert_data  = f'''INSERT INTO {schema_name}.{table_name} (
+        insert_data  = f'''INSERT INTO {load_schema_name}.{load_table_name} (
             CustomerID,
             Transaction_ID,
             Transaction_Date,
@@ -183,7 +175,7 @@ def load_data_to_table(postgres_connection):
             source) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);'''
 
 
-        check_total_row_count_after_insert_statement    =   f'''SELECT COUNT(*) FROM {schema_name}.{table_name}'''
+        check_total_row_count_after_insert_statement    =   f'''SELECT COUNT(*) FROM {load_schema_name}.{load_table_name}'''
 
 
         
@@ -228,27 +220,30 @@ def load_data_to_table(postgres_connection):
 
         
 
-        # Delete table if it exists in Postgres
-        cursor.execute(delete_tbl_if_exists)
+        # Delete table if it exists in Postgres; the matview and incremental fact backends need it kept (emptied or merged into below)
+        if RELOAD_MODE == 'truncate':
+            kept_matviews = dependent_matviews(cursor, schema_name, table_name)
+        elif RELOAD_MODE == 'drop':
+            cursor.execute(delete_tbl_if_exists)
 
-        cursor.execute(check_if_tbl_is_deleted)
+            cursor.execute(check_if_tbl_is_deleted)
 
 
-        sql_result = cursor.fetchone()[0]
-        if sql_result:
-            root_logger.debug(f"")
-            root_logger.info(f"=============================================================================================================================================================================")
-            root_logger.info(f"TABLE DELETION SUCCESS: Managed to drop {table_name} table in {db_layer_name}. Now advancing to recreating table... ")
-            root_logger.info(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
-            root_logger.info(f"=============================================================================================================================================================================")
-            root_logger.debug(f"")
-        else:
-            root_logger.debug(f"")
-            root_logger.error(f"==========================================================================================================================================================================")
-            root_logger.error(f"TABLE DELETION FAILURE: Unable to delete {table_name}. This table may have objects that depend on it (use DROP TABLE ... CASCADE to resolve) or it doesn't exist. ")
-            root_logger.error(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
-            root_logger.error(f"==========================================================================================================================================================================")
-            root_logger.debug(f"")
+            sql_result = cursor.fetchone()[0]
+            if sql_result:
+                root_logger.debug(f"")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.info(f"TABLE DELETION SUCCESS: Managed to drop {table_name} table in {db_layer_name}. Now advancing to recreating table... ")
+                root_logger.info(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
+                root_logger.info(f"=============================================================================================================================================================================")
+                root_logger.debug(f"")
+            else:
+                root_logger.debug(f"")
+                root_logger.error(f"==========================================================================================================================================================================")
+                root_logger.error(f"TABLE DELETION FAILURE: Unable to delete {table_name}. This table may have objects that depend on it (use DROP TABLE ... CASCADE to resolve) or it doesn't exist. ")
+                root_logger.error(f"SQL Query for validation check:  {check_if_tbl_is_deleted} ")
+                root_logger.error(f"==========================================================================================================================================================================")
+                root_logger.debug(f"")
 
 
 
@@ -279,6 +274,12 @@ def load_data_to_table(postgres_connection):
         # Add data lineage to table 
         cursor.execute(add_data_lineage_to_tbl)
 
+        if RELOAD_MODE == 'truncate':
+            truncate_table(cursor, schema_name, table_name)
+            root_logger.info(f"TABLE TRUNCATED: {schema_name}.{table_name} kept for the materialized views reading it: {kept_matviews} ")
+        elif RELOAD_MODE == 'merge':
+            create_load_table(cursor, schema_name, table_name, MERGE_KEY_COLUMNS + MERGE_VALUE_COLUMNS)
+
 
         # sql_results = cursor.fetchall()
         
@@ -308,41 +309,58 @@ def load_data_to_table(postgres_connection):
         root_logger.debug(f"")
 
 
-        for datainfo in customer_info_data:
-            values = (
-                datainfo['CustomerID'],
-                datainfo['Transaction_ID'],
-                datainfo['Transaction_Date'],
-                datainfo['Product_SKU'],
-                datainfo['Product_Description'],
-                datainfo['Product_Category'],
-                datainfo['Quantity'],
-                datainfo['Avg_Price'],
-                datainfo['Delivery_Charges'],
-                datainfo['Coupon_Status'],
-                CURRENT_TIMESTAMP,
-                CURRENT_TIMESTAMP,
-                source_system[random.randint(0, len(source_system)-1)]
-            )
+        if TRANSFORM_MODE == 'elt':
+            # Bulk-load the raw CSV into the staging schema and run the compiled transform rules set-based
+            successful_rows_upload_count = load_with_elt(cursor, 'Online_Sales', load_schema_name, load_table_name, csv_dir, CURRENT_TIMESTAMP, source_system)
+            row_counter = successful_rows_upload_count
+            root_logger.info(f'ELT INSERT SUCCESS: {successful_rows_upload_count} records transformed from the {STAGING_SCHEMA} schema ')
 
-            cursor.execute(insert_data, values)
+        else:
+            for datainfo in customer_info_data:
+                values = (
+                    datainfo['CustomerID'],
+                    datainfo['Transaction_ID'],
+                    datainfo['Transaction_Date'],
+                    datainfo['Product_SKU'],
+                    datainfo['Product_Description'],
+                    datainfo['Product_Category'],
+                    datainfo['Quantity'],
+                    datainfo['Avg_Price'],
+                    datainfo['Delivery_Charges'],
+                    datainfo['Coupon_Status'],
+                    CURRENT_TIMESTAMP,
+                    CURRENT_TIMESTAMP,
+                    source_system[random.randint(0, len(source_system)-1)]
+                )
+
+                cursor.execute(insert_data, values)
+
+
+                # Validate if each row inserted into the table exists 
+                if cursor.rowcount == 1:
+                    row_counter += 1
+                    successful_rows_upload_count += 1
+                    root_logger.debug(f'---------------------------------')
+                    root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
+                    root_logger.debug(f'---------------------------------')
+                else:
+                    row_counter += 1
+                    failed_rows_upload_count +=1
+                    root_logger.error(f'---------------------------------')
+                    root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
+                    root_logger.error(f'---------------------------------')
 
+        ROW_INSERTION_PROCESSING_END_TIME   =   time.time()
 
-            # Validate if each row inserted into the table exists 
-            if cursor.rowcount == 1:
-                row_counter += 1
-                successful_rows_upload_count += 1
-                root_logger.debug(f'---------------------------------')
-                root_logger.info(f'INSERT SUCCESS record no {row_counter} ')
-                root_logger.debug(f'---------------------------------')
-            else:
-                row_counter += 1
-                failed_rows_upload_count +=1
-                root_logger.error(f'---------------------------------')
-                root_logger.error(f'INSERT FAILED: Unable to insert datainfo record no {row_counter} ')
-                root_logger.error(f'---------------------------------')
+        if RELOAD_MODE == 'merge':
+            merged_rows_count, updated_rows_count = merge_load_table(cursor, schema_name, table_name, load_table_name, MERGE_KEY_COLUMNS, MERGE_VALUE_COLUMNS)
+            root_logger.info(f"MERGE SUCCESS: {merged_rows_count} new rows appended to {schema_name}.{table_name} and {updated_rows_count} changed rows updated, the other rows keep their created_at / updated_at ")
 
-        ROW_INSERTION_PROCESSING_END_TIME   =   time.time()
+        # New data version for readers caching results built on this table (dss/query_client.py)
+        bump_version(cursor, schema_name, table_name)
+
+        if RELOAD_MODE == 'truncate':
+            check_matviews_kept(cursor, schema_name, table_name, kept_matviews)
 
         ROW_COUNT_VAL_CHECK_PROCESSING_START_TIME   =   time.time()
         cursor.execute(check_total_row_count_after_insert_statement)
@@ -440,7 +458,8 @@ def load_data_to_table(postgres_connection):
         root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
         root_logger.info("Saved successfully, now terminating cursor and current session....")
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
     finally:
         # Close the cursor if it exists 
         if cursor is not None:
@@ -454,4 +473,38 @@ def load_data_to_table(postgres_connection):
             # root_logger.debug("")
             root_logger.debug("Session connected to Postgres database closed.")
 
-load_data_to_table(postgres_connection)
\ No newline at end of file
+
+def run():
+    """Pipeline stage: load Online_Sales into main.online_sales (from the staged JSON, or the raw CSV in ELT mode)."""
+    customer_info_data = None
+    root_logger.info("")
+
+    root_logger.info("Beginning the source data extraction process...")
+    COMPUTE_START_TIME  =  time.time()
+
+    # In ELT mode the raw CSV is staged and transformed inside the DWH, so the JSON file is never read
+    if TRANSFORM_MODE != 'elt':
+        with open(customer_info_path, 'r') as customer_info_file:    
+            try:
+                customer_info_data = json.load(customer_info_file)
+                root_logger.info(f"Successfully located '{src_file}'")
+                root_logger.info(f"File type: '{type(customer_info_data)}'")
+
+            except:
+                root_logger.error("Unable to locate source file...")
+                raise Exception("No source file located")
+
+    postgres_connection = psycopg2.connect(
+                    host        =   host,
+                    port        =   port,
+                    dbname      =   database,
+                    user        =   username,
+                    password    =   password,
+            )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection, customer_info_data)
+
+
+if __name__=="__main__":
+    run()
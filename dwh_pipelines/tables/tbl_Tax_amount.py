@@ -1,20 +1,26 @@
 import os 
+import sys
 import json
 import time 
 import random
-import psycopg2
 import configparser
 from pathlib import Path
-import logging, coloredlogs
+import logging
 from datetime import datetime
 
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from lazy_imports import lazy_import, LazyColoredFormatter
+from dwh.data_versions import bump_version
+
+psycopg2 = lazy_import('psycopg2')
+
 src_file = 'Tax_amount.csv.json'
 
 # ================================================ LOGGER ================================================
 root_logger = logging.getLogger(__name__)
 root_logger.setLevel(logging.DEBUG)
 file_handler_log_formatter      =   logging.Formatter('%(asctime)s  |  %(levelname)s  |  %(message)s  ')
-console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
+console_handler_log_formatter   =   LazyColoredFormatter(fmt    =   '%(message)s', level_styles=dict(
                                                                                                 debug           =   dict    (color  =   'white'),
                                                                                                 info            =   dict    (color  =   'green'),
                                                                                                 warning         =   dict    (color  =   'cyan'),
@@ -30,7 +36,7 @@ console_handler_log_formatter   =   coloredlogs.ColoredFormatter(fmt    =   '%(m
 
 # Set up file handler object for logging events to file
 current_filepath    =   Path(__file__).stem
-file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w')
+file_handler        =   logging.FileHandler('logs/' + current_filepath + '.log', mode='w', delay=True)
 file_handler.setFormatter(file_handler_log_formatter)
 
 
@@ -68,34 +74,7 @@ postgres_connection     =   None
 cursor                  =   None
 
 
-root_logger.info("")
-
-root_logger.info("Beginning the source data extraction process...")
-COMPUTE_START_TIME  =  time.time()
-
-
-with open(customer_info_path, 'r') as customer_info_file:    
-    try:
-        customer_info_data = json.load(customer_info_file)
-        # root_logger.info(f"Successfully located '{src_file}'")
-        root_logger.info(f"File type: '{type(customer_info_data)}'")
-        root_logger.info(str(customer_info_data))
-
-    except:
-        root_logger.error("Unable to locate source file...")
-        raise Exception("No source file located")
-    
-
-postgres_connection = psycopg2.connect(
-host        =   host,
-port        =   port,
-dbname      =   database,
-user        =   username,
-password    =   password,
-)
-postgres_connection.set_session(autocommit=True)
-
-def load_data_to_table(postgres_connection):
+def load_data_to_table(postgres_connection, customer_info_data=None):
     try:
         db_layer_name =   database
         schema_name = 'main'
@@ -312,6 +291,9 @@ def load_data_to_table(postgres_connection):
         ROW_INSERTION_PROCESSING_END_TIME   =   time.time()
 
 
+        # New data version for readers caching results built on this table (dss/query_client.py)
+        bump_version(cursor, schema_name, table_name)
+
         ROW_COUNT_VAL_CHECK_PROCESSING_START_TIME   =   time.time()
         cursor.execute(check_total_row_count_after_insert_statement)
         ROW_COUNT_VAL_CHECK_PROCESSING_END_TIME     =   time.time()
@@ -411,7 +393,8 @@ def load_data_to_table(postgres_connection):
         root_logger.info("Now saving changes made by SQL statements to Postgres DB....")
         root_logger.info("Saved successfully, now terminating cursor and current session....")
     except Exception as e:
-            root_logger.info(e)
+            root_logger.error(e)
+            raise
         
     finally:
         
@@ -427,4 +410,36 @@ def load_data_to_table(postgres_connection):
             # root_logger.debug("")
             root_logger.debug("Session connected to Postgres database closed.")
 
-load_data_to_table(postgres_connection)
\ No newline at end of file
+
+def run():
+    """Pipeline stage: load the staged Tax_amount JSON into main.tax_amount."""
+    root_logger.info("")
+
+    root_logger.info("Beginning the source data extraction process...")
+    COMPUTE_START_TIME  =  time.time()
+
+    with open(customer_info_path, 'r') as customer_info_file:    
+        try:
+            customer_info_data = json.load(customer_info_file)
+            # root_logger.info(f"Successfully located '{src_file}'")
+            root_logger.info(f"File type: '{type(customer_info_data)}'")
+            root_logger.info(str(customer_info_data))
+
+        except:
+            root_logger.error("Unable to locate source file...")
+            raise Exception("No source file located")
+
+    postgres_connection = psycopg2.connect(
+    host        =   host,
+    port        =   port,
+    dbname      =   database,
+    user        =   username,
+    password    =   password,
+    )
+    postgres_connection.set_session(autocommit=True)
+
+    load_data_to_table(postgres_connection, customer_info_data)
+
+
+if __name__=="__main__":
+    run()
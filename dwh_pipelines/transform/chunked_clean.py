@@ -0,0 +1,182 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from staging.json_stream import iter_json_chunks, JsonArrayWriter
+
+# Out-of-core version of initial_json_clean: the staged file is streamed in
+# fixed-size chunks, and duplicates are detected across chunks with 64-bit row
+# hashes instead of keeping every row in memory.
+
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+
+
+def _in_sorted(sorted_hashes, hashes):
+    """Vectorized membership test of `hashes` against a sorted uint64 array (may be memory-mapped)."""
+    if len(sorted_hashes) == 0:
+        return np.zeros(len(hashes), dtype=bool)
+    positions = np.searchsorted(sorted_hashes, hashes)
+    positions[positions == len(sorted_hashes)] = len(sorted_hashes) - 1
+    return np.asarray(sorted_hashes[positions]) == hashes
+
+
+class ExternalHashSet:
+    """Set of row hashes that spills to sorted runs on disk once it outgrows its memory budget.
+
+    In memory the hashes are kept as a few sorted tiers: each batch is added as a
+    tier of its own and tiers are merged when the newer one is as large as the
+    one before it, so a batch costs a sort of itself rather than of the whole set.
+    A spill merges the tiers into one sorted .npy run; each run is memory-mapped
+    and probed with a binary search, so only the pages touched by the lookups are
+    read back. Once there are more than MAX_RUNS runs they are merged into one,
+    block by block.
+
+    Rows are identified by their 64-bit hash alone: two distinct rows with the same
+    hash count as one, so the second is dropped as a duplicate (for n rows this
+    happens with a probability of about n^2 / 2^65).
+    """
+
+    MAX_RUNS = 4
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, spill_dir=None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.runs = []
+        self._tiers = []
+        self._run_arrays = []
+        self._spilled = 0
+
+    def __len__(self):
+        return sum(len(tier) for tier in self._tiers) + sum(len(run) for run in self._run_arrays)
+
+    def add_unseen(self, hashes):
+        """Add `hashes` to the set and return a mask of the ones seen for the first time.
+
+        Repeats inside `hashes` itself only keep their first occurrence.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+
+        first_occurrence = np.zeros(len(hashes), dtype=bool)
+        first_occurrence[np.unique(hashes, return_index=True)[1]] = True
+
+        seen = np.zeros(len(hashes), dtype=bool)
+        for sorted_hashes in self._tiers + self._run_arrays:
+            seen |= _in_sorted(sorted_hashes, hashes)
+
+        unseen = first_occurrence & ~seen
+        self._add_tier(np.sort(hashes[unseen]))
+
+        if sum(tier.nbytes for tier in self._tiers) > self.memory_budget:
+            self._spill()
+
+        return unseen
+
+    def _add_tier(self, tier):
+        self._tiers.append(tier)
+        while len(self._tiers) > 1 and len(self._tiers[-2]) <= len(self._tiers[-1]):
+            newer = self._tiers.pop()
+            # the stable sort is a merge of the two sorted halves
+            self._tiers[-1] = np.sort(np.concatenate((self._tiers[-1], newer)), kind='stable')
+
+    def _run_path(self):
+        self._spilled += 1
+        return os.path.join(self.spill_dir, f"run_{self._spilled:05d}.npy")
+
+    def _spill(self):
+        run_path = self._run_path()
+        np.save(run_path, np.sort(np.concatenate(self._tiers), kind='stable'))
+        self.runs.append(run_path)
+        self._run_arrays.append(np.load(run_path, mmap_mode='r'))
+        self._tiers = []
+
+        if len(self.runs) > self.MAX_RUNS:
+            self._compact()
+
+    def _compact(self):
+        run_path = self._run_path()
+        merge_sorted_runs(self._run_arrays, run_path, max(self.memory_budget // (8 * len(self._run_arrays)), 1024))
+        old_runs = self.runs
+        self.runs = [run_path]
+        self._run_arrays = [np.load(run_path, mmap_mode='r')]
+        for old_run in old_runs:
+            os.remove(old_run)
+
+
+def merge_sorted_runs(run_arrays, run_path, block_size):
+    """Merge sorted uint64 arrays (may be memory-mapped) into the .npy file `run_path`, reading `block_size` values per run at a time."""
+    total = sum(len(run) for run in run_arrays)
+    merged = np.lib.format.open_memmap(run_path, mode='w+', dtype=np.uint64, shape=(total,))
+    positions = [0] * len(run_arrays)
+    written = 0
+    while written < total:
+        active = [index for index, run in enumerate(run_arrays) if positions[index] < len(run)]
+        blocks = {index: np.asarray(run_arrays[index][positions[index]:positions[index] + block_size]) for index in active}
+        # every value up to the smallest block end is in the blocks; the run owning that end is consumed entirely
+        cutoff = min(block[-1] for block in blocks.values())
+        parts = []
+        for index, block in blocks.items():
+            taken = int(np.searchsorted(block, cutoff, side='right'))
+            parts.append(block[:taken])
+            positions[index] += taken
+        values = np.sort(np.concatenate(parts), kind='stable')
+        merged[written:written + len(values)] = values
+        written += len(values)
+    merged.flush()
+    del merged
+
+
+def chunked_json_clean(jsonFilePath, chunksize=DEFAULT_CHUNKSIZE, memory_budget=DEFAULT_MEMORY_BUDGET, verbose=False):
+    """Drop missing and duplicate records from a staged JSON file, one chunk at a time.
+
+    Cleaned chunks are written incrementally to a temporary file next to the
+    source, which then replaces it.
+    """
+    tempFilePath = f"{jsonFilePath}.tmp"
+    rows_read = 0
+    missing_rows = 0
+    duplicate_rows = 0
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="dedup_runs_") as spill_dir:
+            seen_rows = ExternalHashSet(memory_budget, spill_dir)
+
+            with JsonArrayWriter(tempFilePath) as writer:
+                for records in iter_json_chunks(jsonFilePath, chunksize):
+                    # object columns keep the values as parsed: inferred per chunk, an int column
+                    # with a null would turn float64 and its rows would hash (and be written)
+                    # differently from the same rows in other chunks
+                    df = pd.DataFrame(records, dtype=object)
+                    rows_read += len(df)
+
+                    # drop missing value
+                    before = len(df)
+                    df.dropna(inplace=True)
+                    missing_rows += before - len(df)
+
+                    # drop duplicate, against this chunk and every chunk before it
+                    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+                    unseen = seen_rows.add_unseen(row_hashes)
+                    duplicate_rows += int((~unseen).sum())
+
+                    writer.write_frame(df[unseen])
+
+                    if verbose:
+                        print("\033[92m {}\033[00m".format(f"{os.path.basename(jsonFilePath)}: {rows_read} rows read, {len(seen_rows)} unique rows kept, {len(seen_rows.runs)} spilled runs"))
+
+        os.replace(tempFilePath, jsonFilePath)
+
+        if missing_rows:
+            print("\033[91m {}\033[00m".format("Number of rows with missing values deleted: {}".format(missing_rows)))
+        if duplicate_rows:
+            print("\033[91m {}\033[00m".format("Number of duplicate rows deleted: {}".format(duplicate_rows)))
+
+    except (Exception) as err:
+        if os.path.exists(tempFilePath):
+            os.remove(tempFilePath)
+        print("\033[91m {}\033[00m".format("ERROR while Initial Cleaning Data" ))
+        print(err)
@@ -1,13 +1,18 @@
-import os, json
+import os
+import argparse
 import pandas as pd
 import configparser
 
-def initial_json_clean(jsonFilePath): 
+from chunked_clean import chunked_json_clean, DEFAULT_MEMORY_BUDGET
+
+def initial_json_clean(jsonFilePath, verbose=False): 
     try:
         df = pd.read_json(jsonFilePath)
 
-        print("\033[92m {}\033[00m".format(df.info()))
-        print("\033[92m {}\033[00m".format(df.describe()))
+        # summaries are costly on large files, only compute them on request
+        if verbose:
+            df.info()
+            print("\033[92m {}\033[00m".format(df.describe()))
         
         # drop missing value
         df.dropna(inplace=True)
@@ -16,25 +21,21 @@ def initial_json_clean(jsonFilePath):
         duplicate_rows = df.duplicated()
         if duplicate_rows.any():
             df.drop_duplicates(inplace=True)
-            print("\033[91m {}\033[00m".format("Number of duplicate rows deleted: ", duplicate_rows.sum()))
-
-        result = df.to_json(orient="records")
-        parsed = json.loads(result)
-        # json_content = json.loads()
-
-        # print(len(parsed))
+            print("\033[91m {}\033[00m".format("Number of duplicate rows deleted: {}".format(duplicate_rows.sum())))
 
-        # json_array = []
-        # for key in json_content.keys():
-        #     json_array.append(json_content[key])
-
-        with open(jsonFilePath, 'w', encoding='utf-8') as jsonf: 
-            jsonf.write(json.dumps(parsed, indent=4))
+        # single serialization pass, straight from the DataFrame to the file
+        df.to_json(jsonFilePath, orient="records", indent=4)
 
     except (Exception) as err:
         print("\033[91m {}\033[00m".format("ERROR while Initial Cleaning Data" ))
         print(err)
 
+parser = argparse.ArgumentParser(description="Drop missing and duplicate records from the staged JSON files")
+parser.add_argument("-v", "--verbose", action="store_true", help="print df.info()/df.describe() summaries for each file")
+parser.add_argument("--chunksize", type=int, default=0, help="stream each file in chunks of this many records instead of loading it whole (for files larger than RAM)")
+parser.add_argument("--memory-budget", type=int, default=DEFAULT_MEMORY_BUDGET, help="bytes of row hashes kept in memory before spilling to disk in chunked mode")
+args = parser.parse_args()
+
 config = configparser.ConfigParser()    
 config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
 
@@ -43,4 +44,7 @@ JSONDATA_DIR = config['data_filepath']['JSONDATA']
 JSON_FILENAMES = [filename for filename in os.listdir(f'{os.getcwd()}{os.sep}{JSONDATA_DIR}')]
 
 for name in JSON_FILENAMES:
-    initial_json_clean(f"{os.getcwd()}{os.sep}{JSONDATA_DIR}{os.sep}{name}")
\ No newline at end of file
+    if args.chunksize > 0:
+        chunked_json_clean(f"{os.getcwd()}{os.sep}{JSONDATA_DIR}{os.sep}{name}", args.chunksize, args.memory_budget, args.verbose)
+    else:
+        initial_json_clean(f"{os.getcwd()}{os.sep}{JSONDATA_DIR}{os.sep}{name}", args.verbose)
\ No newline at end of file
@@ -0,0 +1,144 @@
+import os
+
+# ELT execution mode: instead of rewriting the staged JSON with pandas
+# (format_Online_Sales.py, format_Discount_Coupon.py) and inserting row by row,
+# the raw CSV is bulk-loaded as text into a staging schema and the transform
+# rules are compiled to SQL, so a single INSERT ... SELECT does the work inside the DWH.
+
+STAGING_SCHEMA = 'staging'
+
+FULL_MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+
+# raw CSV file, target columns with their SQL type, and the transform rule applied to each column
+ELT_SOURCES = {
+    'Online_Sales': {
+        'csv': 'Online_Sales.csv',
+        'columns': [
+            ('CustomerID', 'varchar'),
+            ('Transaction_ID', 'varchar'),
+            ('Transaction_Date', 'varchar'),
+            ('Product_SKU', 'varchar'),
+            ('Product_Description', 'varchar'),
+            ('Product_Category', 'varchar'),
+            ('Quantity', 'integer'),
+            ('Avg_Price', 'numeric'),
+            ('Delivery_Charges', 'numeric'),
+            ('Coupon_Status', 'varchar'),
+        ],
+        'rules': {
+            'Transaction_Date': 'format_date',
+        },
+    },
+    'Discount_Coupon': {
+        'csv': 'Discount_Coupon.csv',
+        'columns': [
+            ('Month', 'varchar'),
+            ('Product_Category', 'varchar'),
+            ('Coupon_Code', 'varchar'),
+            ('Discount_pct', 'smallint'),
+        ],
+        'rules': {
+            'Month': 'full_month',
+        },
+    },
+}
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def compile_format_date(column, alias):
+    # same as format_Online_Sales.format_date: 'M/D/YYYY' -> 'M-YYYY', values without '/' are kept
+    return (f"CASE WHEN strpos({column}, '/') > 0 "
+            f"THEN split_part({column}, '/', 1) || '-' || split_part({column}, '/', 3) "
+            f"ELSE {column} END"), None
+
+
+def compile_full_month(column, alias):
+    # same as format_Discount_Coupon.get_full_month: first month whose name starts with the value
+    join = (f"LEFT JOIN LATERAL (SELECT full_month FROM {STAGING_SCHEMA}.month_lookup "
+            f"WHERE position({column} in full_month) = 1 ORDER BY month_no LIMIT 1) AS {alias} ON true")
+    return f"COALESCE({alias}.full_month, {column})", join
+
+
+SQL_RULES = {
+    'format_date': compile_format_date,
+    'full_month': compile_full_month,
+}
+
+
+def compile_rules(source_name):
+    """Compile the transform rules of a source into select expressions and the joins they need."""
+    source = ELT_SOURCES[source_name]
+    expressions = []
+    joins = []
+
+    for index, (column, sql_type) in enumerate(source['columns']):
+        expression = f"src.{quote_ident(column)}"
+        rule = source['rules'].get(column)
+        if rule is not None:
+            expression, join = SQL_RULES[rule](expression, f"rule_{index}")
+            if join is not None:
+                joins.append(join)
+        expressions.append(f"({expression})::{sql_type}")
+
+    return expressions, joins
+
+
+def compile_insert_select(source_name, schema_name, table_name):
+    """Build the set-based INSERT ... SELECT moving a staged source into its DWH table.
+
+    The statement takes the named parameters created_at, updated_at and
+    source_system, the list of source systems one is randomly picked from for each row.
+    """
+    source = ELT_SOURCES[source_name]
+    raw_columns = [quote_ident(column) for column, _ in source['columns']]
+    expressions, joins = compile_rules(source_name)
+
+    # same cleaning as clean_initial_data: no missing values, no duplicated rows
+    not_null = ' AND '.join(f"{column} IS NOT NULL" for column in raw_columns)
+
+    return f'''INSERT INTO {schema_name}.{table_name} (
+            {', '.join(column for column, _ in source['columns'])},
+            created_at,
+            updated_at,
+            source
+        )
+        SELECT {', '.join(expressions)},
+            %(created_at)s,
+            %(updated_at)s,
+            (%(source_system)s::varchar[])[1 + floor(random() * cardinality(%(source_system)s::varchar[]))::int]
+        FROM (SELECT DISTINCT {', '.join(raw_columns)} FROM {STAGING_SCHEMA}.{table_name}_raw WHERE {not_null}) AS src
+        {' '.join(joins)};'''
+
+
+def stage_raw_csv(cursor, source_name, table_name, csv_dir):
+    """Bulk-load the raw CSV of a source as text into the staging schema with COPY."""
+    source = ELT_SOURCES[source_name]
+    staging_table = f"{STAGING_SCHEMA}.{table_name}_raw"
+    raw_columns = ', '.join(f"{quote_ident(column)} text" for column, _ in source['columns'])
+
+    cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {STAGING_SCHEMA};")
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_table};")
+    cursor.execute(f"CREATE UNLOGGED TABLE {staging_table} ({raw_columns});")
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {STAGING_SCHEMA}.month_lookup (month_no smallint PRIMARY KEY, full_month varchar(16) NOT NULL);")
+    month_rows = ', '.join(f"({month_no}, '{month}')" for month_no, month in enumerate(FULL_MONTHS, 1))
+    cursor.execute(f"INSERT INTO {STAGING_SCHEMA}.month_lookup VALUES {month_rows} ON CONFLICT DO NOTHING;")
+
+    with open(os.path.join(csv_dir, source['csv']), encoding='utf-8') as csvf:
+        cursor.copy_expert(f"COPY {staging_table} FROM STDIN WITH (FORMAT csv, HEADER true)", csvf)
+
+    return cursor.rowcount
+
+
+def load_with_elt(cursor, source_name, schema_name, table_name, csv_dir, current_timestamp, source_system):
+    """Stage the raw CSV and transform it into schema_name.table_name; returns the number of rows inserted."""
+    stage_raw_csv(cursor, source_name, table_name, csv_dir)
+    cursor.execute(compile_insert_select(source_name, schema_name, table_name), {
+        'created_at': current_timestamp,
+        'updated_at': current_timestamp,
+        'source_system': source_system,
+    })
+    return cursor.rowcount
@@ -1,4 +1,5 @@
-import os, json
+import os
+import sys
 import pandas as pd
 import configparser
 
@@ -16,6 +17,11 @@ config.read(os.path.abspath('dwh_pipelines/local_config.ini'))
 
 JSONDATA_DIR = config['data_filepath']['JSONDATA']
 
+# in ELT mode this rewrite is compiled to SQL and run inside the DWH by the tbl_ loader (see elt_transform.py)
+if config['data_filepath'].get('TRANSFORM_MODE', 'etl') == 'elt':
+    print("\033[92m {}\033[00m".format("TRANSFORM_MODE=elt, formatting is deferred to the DWH load"))
+    sys.exit(0)
+
 JSON_FILENAME = 'Online_Sales.csv'
 
 jsonFilePath = f'{os.getcwd()}{os.sep}{JSONDATA_DIR}{os.sep}{JSON_FILENAME}.json'
@@ -25,8 +31,5 @@ df = pd.read_json(jsonFilePath)
 # reaformat Date
 df["Transaction_Date"] = df['Transaction_Date'].map(lambda ele:format_date(ele))
 
-result = df.to_json(orient="records") 
-
-### Rewrite into files
-with open(jsonFilePath, 'w', encoding='utf-8') as jsonf: 
-    jsonf.write(json.dumps(json.loads(result), indent=4))
\ No newline at end of file
+### Rewrite into files, in a single serialization pass
+df.to_json(jsonFilePath, orient="records", indent=4)
\ No newline at end of file
@@ -1,12 +1,8 @@
 import os
+import sys
 
-level1_dir = 'dwh_pipelines'
-level2_dir = 'dwh'
-level3_dir = 'datamarts'
-common_dir = f'{level1_dir}{os.sep}{level2_dir}{os.sep}{level3_dir}'
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from pipeline_runner import run_stages
 
-for filename in [filename for filename in os.listdir(f'{os.getcwd()}{os.sep}{common_dir}') if filename.startswith('fact_')]:
-    if os.sep == '/': # linux, mac
-        os.system(f'python3 {common_dir}{os.sep}{filename}')
-    else:
-        os.system(f'python {common_dir}{os.sep}{filename}')
\ No newline at end of file
+# dimensions first: the fact loaders resolve their surrogate keys from them; snapshots of the built facts last
+run_stages(['dims', 'facts', 'exports'])
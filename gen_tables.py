@@ -1,5 +1,5 @@
 import os
-import platform
+import sys
 # import psycopg2
 # import configparser
 
@@ -27,17 +27,8 @@ import platform
 # cursor.execute(f"CREATE DATABASE {databaseoltp};")
 
 # ======================== RUN GENERATION SCRIPT ==============================
-if platform.system() == "Windows":
-    os.system('genoltp')
-else:
-    os.system('./genoltp.sh')
+# the OLTP seed (genoltp.sh / genoltp.bat run it standalone) and every table loader, in one interpreter
+sys.path.append(os.path.abspath('dwh_pipelines'))
+from pipeline_runner import run_stages
 
-level1_dir = 'dwh_pipelines'
-level2_dir = 'tables'
-common_dir = f'{level1_dir}{os.sep}{level2_dir}'
-
-for filename in [filename for filename in os.listdir(f'{os.getcwd()}{os.sep}{common_dir}') if filename.startswith('tbl_')]:
-    if os.sep == '/': # linux, mac
-        os.system(f'python3 {common_dir}{os.sep}{filename}')
-    else:
-        os.system(f'python {common_dir}{os.sep}{filename}')
\ No newline at end of file
+run_stages(['oltp', 'tables'])
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dwh_pipelines'))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dwh_pipelines', 'transform'))
+from chunked_clean import ExternalHashSet, chunked_json_clean
+
+
+def test_external_hash_set_across_spilled_runs(tmp_path):
+    # a zero budget spills after every batch, so later batches are probed against runs on disk
+    seen = ExternalHashSet(memory_budget=0, spill_dir=str(tmp_path))
+
+    assert seen.add_unseen([3, 1, 3, 2]).tolist() == [True, True, False, True]
+    assert seen.add_unseen([2, 4]).tolist() == [False, True]
+    assert seen.add_unseen(np.array([1, 4, 5, 5], dtype=np.uint64)).tolist() == [False, False, True, False]
+    assert len(seen.runs) == 3
+    assert len(seen) == 5
+
+
+
+def test_external_hash_set_compacts_runs(tmp_path):
+    rng = np.random.default_rng(0)
+    seen = ExternalHashSet(memory_budget=800, spill_dir=str(tmp_path))
+    expected = set()
+    for _ in range(40):
+        hashes = rng.integers(0, 5000, size=300).astype(np.uint64)
+        first = [value not in expected and value not in hashes[:position].tolist() for position, value in enumerate(hashes.tolist())]
+        assert seen.add_unseen(hashes).tolist() == first
+        expected.update(hashes.tolist())
+
+    assert len(seen) == len(expected)
+    assert 1 <= len(seen.runs) <= ExternalHashSet.MAX_RUNS
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(run) for run in seen.runs)
+    for run in seen._run_arrays:
+        assert np.all(run[1:] > run[:-1])
+
+
+def test_chunked_json_clean_drops_duplicates_across_chunks(tmp_path):
+    records = [
+        {'id': 1, 'name': 'a'},
+        {'id': None, 'name': 'b'},      # an int column with a null in the first chunk
+        {'id': 2, 'name': 'c'},
+        {'id': 1, 'name': 'a'},         # duplicate of a row of the first chunk
+        {'id': 2, 'name': 'c'},
+        {'id': 3, 'name': None},
+        {'id': 4, 'name': 'd'},
+    ]
+    jsonFilePath = tmp_path / 'source.json'
+    jsonFilePath.write_text(json.dumps(records))
+
+    chunked_json_clean(str(jsonFilePath), chunksize=3, memory_budget=8)
+
+    assert json.loads(jsonFilePath.read_text()) == [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'c'}, {'id': 4, 'name': 'd'}]
+    assert not os.path.exists(f'{jsonFilePath}.tmp')
@@ -0,0 +1,27 @@
+import os
+import sys
+import importlib
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _oltp(monkeypatch):
+    # the stage reads dwh_pipelines/local_config.ini relative to the working directory, as when run from the repo root
+    monkeypatch.chdir(REPO_ROOT)
+    monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, 'dwh_pipelines', 'synthetic_data_generator'))
+    monkeypatch.syspath_prepend(os.path.join(REPO_ROOT, 'dwh_pipelines'))
+    return importlib.import_module('oltp')
+
+
+def test_generated_seed_grows_with_scale(monkeypatch):
+    oltp = _oltp(monkeypatch)
+
+    small = list(oltp.iter_generated_rows(50_000))
+    large = list(oltp.iter_generated_rows(1_000_000))
+
+    assert len(small) == 365
+    assert len(large) == 1_000_000 // 145
+    # the first year is the same calendar, the larger seed continues past 2019
+    assert [row[0] for row in large[:365]] == [row[0] for row in small]
+    assert large[-1][0].endswith('/2037')
+    assert all(isinstance(offline, int) and isinstance(online, int) for _, offline, online in large)